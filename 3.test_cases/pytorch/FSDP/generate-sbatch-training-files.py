@@ -2,17 +2,35 @@
 
 import argparse
 import jinja2
+import json
 import os
 import pathlib
 
 
 def get_model_parameters(model_name):
     f = open('models/' + model_name + '.txt')
-    return f.read()
+    return apply_autotune(model_name, f.read())
+
+
+def apply_autotune(model_name, model_parameters):
+    """Override parameters with the best configuration found by src/autotune.py, if any."""
+    path = 'models/' + model_name + '.autotune.json'
+    if not os.path.exists(path):
+        return model_parameters
+    with open(path) as f:
+        best = json.load(f)['best']
+
+    lines = []
+    for line in model_parameters.splitlines():
+        key = line.split('=')[0].split('#')[0].strip().lstrip('-')
+        if key not in best:
+            lines.append(line)
+    lines += ['--{}={}'.format(key, value) for key, value in best.items()]
+    return '\n'.join(lines)
 
 
 def list_models(path='models'):
-    models = [str(pathlib.Path(i).with_suffix('')) for i in os.listdir(path)]
+    models = [str(pathlib.Path(i).with_suffix('')) for i in os.listdir(path) if i.endswith('.txt')]
 
     return models
 
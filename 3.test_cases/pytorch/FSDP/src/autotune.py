@@ -0,0 +1,239 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""Search FSDP2 settings for the highest training throughput that fits in GPU memory.
+
+Launch it like train.py, with torchrun on the nodes the model will train on
+and the same model arguments, for example:
+
+    torchrun --nproc_per_node=8 --nnodes=2 ... autotune.py --model_type=llama_v3 \\
+        --max_context_width=8192 --hidden_width=4096 --num_layers=32 ... \\
+        --autotune_output=../models/llama3_1_8b.autotune.json
+
+Every trial builds the model with build_model() from train.py and runs a
+few optimizer steps on random tokens, so no dataset is read. The search is
+bounded in two stages:
+
+1. With full sharding, micro-batch sizes and activation checkpointing
+   ratios are tried, largest ratio first; a configuration that runs out of
+   memory rules out every larger batch with a smaller ratio.
+2. With the best batch size and ratio, every shard group size (full
+   sharding, or HSDP over one or more nodes), reshard_after_forward and
+   prefetch depth is tried, falling back to the next larger ratio when a
+   combination runs out of memory.
+
+The best configuration is written as JSON for
+generate-sbatch-training-files.py. Ranks run identical shapes, so a trial
+that runs out of memory does so on every rank.
+"""
+
+import copy
+import gc
+import json
+import os
+import sys
+import time
+
+import torch
+import torch.distributed as dist
+from torch import optim
+from torch.distributed.device_mesh import init_device_mesh
+
+from train import build_model, compute_loss
+from model_utils.arguments import parse_args
+from model_utils.step_metrics import gpu_peak_tflops, model_flops_per_token
+from model_utils.train_utils import get_model_config
+
+import logging
+
+logging.basicConfig(format="%(asctime)s [%(levelname)s] %(name)s: %(message)s", level=logging.INFO, stream=sys.stdout)
+
+logger = logging.getLogger(__name__)
+
+
+def shard_sizes(world_size, local_world_size):
+    """Full sharding, then HSDP shard groups of 1, 2, 4, ... nodes."""
+    sizes = [world_size]
+    size = local_world_size
+    while size < world_size:
+        if world_size % size == 0:
+            sizes.append(size)
+        size *= 2
+    return sizes
+
+
+def trial_args(base_args, config, world_size):
+    args = copy.copy(base_args)
+    args.train_batch_size = config["train_batch_size"]
+    args.activation_checkpointing = int(config["activation_checkpointing_ratio"] > 0)
+    args.activation_checkpointing_ratio = config["activation_checkpointing_ratio"]
+    args.reshard_after_forward = config["reshard_after_forward"]
+    args.prefetch_depth = config["prefetch_depth"]
+    args.sharding_strategy = "full" if config["hsdp_shard_size"] == world_size else "hybrid"
+    args.hsdp_shard_size = config["hsdp_shard_size"]
+    return args
+
+
+def run_trial(base_args, config, model_config, global_rank, world_size, peak_tflops=None, meshes=None):
+    """Train for a few steps with config; every rank returns the same result.
+
+    HSDP device meshes are taken from meshes, by shard group size, and
+    created there on first use, so trials do not leak process groups.
+    """
+    args = trial_args(base_args, config, world_size)
+    mesh = None
+    if args.sharding_strategy == "hybrid" and meshes is not None:
+        shard_size = args.hsdp_shard_size
+        if shard_size not in meshes:
+            meshes[shard_size] = init_device_mesh(
+                "cuda", (world_size // shard_size, shard_size), mesh_dim_names=("replicate", "shard")
+            )
+        mesh = meshes[shard_size]
+    model = optimizer = None
+    num_params = 0
+    elapsed = 0.0
+    fits = True
+    gc.collect()
+    torch.cuda.empty_cache()
+    torch.cuda.reset_peak_memory_stats()
+    try:
+        model, num_params = build_model(args, model_config, global_rank, world_size, mesh)
+        optimizer = optim.AdamW(model.parameters(), lr=args.lr)
+        tokens = torch.randint(args.vocab_size, (args.train_batch_size, args.max_context_width), device="cuda")
+        start = torch.cuda.Event(enable_timing=True)
+        end = torch.cuda.Event(enable_timing=True)
+        for step in range(args.autotune_warmup_steps + args.autotune_steps):
+            if step == args.autotune_warmup_steps:
+                start.record()
+            optimizer.zero_grad(set_to_none=True)
+            loss = compute_loss(model, tokens)
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(model.parameters(), args.grad_clip)
+            optimizer.step()
+        end.record()
+        end.synchronize()
+        elapsed = start.elapsed_time(end) / 1000
+    except torch.cuda.OutOfMemoryError:
+        fits = False
+    finally:
+        del model, optimizer
+        gc.collect()
+        torch.cuda.empty_cache()
+    peak = torch.cuda.max_memory_reserved()
+
+    local = torch.tensor([float(fits), float(peak), elapsed], device="cuda", dtype=torch.float64)
+    gathered = torch.zeros(world_size, 3, device="cuda", dtype=torch.float64)
+    dist.all_gather_into_tensor(gathered, local)
+    gathered = gathered.cpu()
+    peak = gathered[:, 1].max().item()
+    budget = args.autotune_memory_fraction * torch.cuda.get_device_properties(torch.cuda.current_device()).total_memory
+    result = dict(config, fits=bool(gathered[:, 0].min().item()) and peak <= budget,
+                  peak_memory_gb=round(peak / 1024**3, 2))
+    if result["fits"]:
+        # The slowest rank sets the pace
+        seconds = gathered[:, 2].max().item()
+        tokens_per_sec = args.train_batch_size * args.max_context_width * args.autotune_steps * world_size / seconds
+        result["tokens_per_sec"] = round(tokens_per_sec, 1)
+        if peak_tflops:
+            flops = model_flops_per_token(model_config, num_params, args.max_context_width)
+            result["mfu"] = round(tokens_per_sec / world_size * flops / (peak_tflops * 1e12), 4)
+    return result
+
+
+def autotune(args):
+    dist.init_process_group()
+    global_rank = dist.get_rank()
+    world_size = dist.get_world_size()
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+    torch.cuda.set_device(int(os.environ.get("LOCAL_RANK", 0)))
+
+    model_config = get_model_config(args)
+    peak_tflops = args.gpu_peak_tflops or gpu_peak_tflops()
+    trials = []
+    tried = {}
+    meshes = {}
+
+    def run(config):
+        key = tuple(sorted(config.items()))
+        if key in tried:
+            return tried[key]
+        if len(trials) >= args.autotune_max_trials:
+            return None
+        start = time.time()
+        result = run_trial(args, config, model_config, global_rank, world_size, peak_tflops, meshes)
+        trials.append(result)
+        tried[key] = result
+        if global_rank == 0:
+            logger.info("Trial %d/%d %s: %s in %.0fs", len(trials), args.autotune_max_trials, config,
+                        f"{result['tokens_per_sec']:.0f} tokens/sec, {result['peak_memory_gb']} GB"
+                        if result["fits"] else f"does not fit ({result['peak_memory_gb']} GB)",
+                        time.time() - start)
+        return result
+
+    def best(results):
+        results = [result for result in results if result and result["fits"]]
+        return max(results, key=lambda result: result["tokens_per_sec"]) if results else None
+
+    ratios = sorted(set(args.autotune_ac_ratios), reverse=True)
+    default = {"hsdp_shard_size": world_size, "reshard_after_forward": 1, "prefetch_depth": 0}
+
+    # Stage 1: micro-batch size and activation checkpointing ratio
+    failed = []
+    for batch_size in sorted(set(args.autotune_batch_sizes)):
+        for ratio in ratios:
+            if any(batch_size >= b and ratio <= r for b, r in failed):
+                continue
+            result = run(dict(default, train_batch_size=batch_size, activation_checkpointing_ratio=ratio))
+            if result is not None and not result["fits"]:
+                failed.append((batch_size, ratio))
+    stage1 = best(trials)
+    if stage1 is None:
+        raise RuntimeError("No configuration fits in GPU memory; try smaller --autotune_batch_sizes")
+
+    # Stage 2: sharding, resharding and prefetching at the best batch size
+    larger_ratios = [ratio for ratio in ratios if ratio > stage1["activation_checkpointing_ratio"]][::-1]
+    for shard_size in shard_sizes(world_size, local_world_size):
+        for reshard in (1, 0):
+            for prefetch in sorted(set(args.autotune_prefetch_depths)):
+                config = {"hsdp_shard_size": shard_size, "reshard_after_forward": reshard,
+                          "prefetch_depth": prefetch, "train_batch_size": stage1["train_batch_size"]}
+                for ratio in [stage1["activation_checkpointing_ratio"]] + larger_ratios:
+                    result = run(dict(config, activation_checkpointing_ratio=ratio))
+                    if result is None or result["fits"]:
+                        break
+
+    winner = best(trials)
+    if global_rank == 0:
+        config = trial_args(args, winner, world_size)
+        output = {
+            "model_type": args.model_type,
+            "max_context_width": args.max_context_width,
+            "num_nodes": world_size // local_world_size,
+            "gpus_per_node": local_world_size,
+            "gpu": torch.cuda.get_device_name(),
+            "tokens_per_sec": winner["tokens_per_sec"],
+            "peak_memory_gb": winner["peak_memory_gb"],
+            "best": {
+                "train_batch_size": config.train_batch_size,
+                "sharding_strategy": config.sharding_strategy,
+                "hsdp_shard_size": config.hsdp_shard_size if config.sharding_strategy == "hybrid" else 0,
+                "reshard_after_forward": config.reshard_after_forward,
+                "prefetch_depth": config.prefetch_depth,
+                "activation_checkpointing": config.activation_checkpointing,
+                "activation_checkpointing_ratio": config.activation_checkpointing_ratio,
+            },
+            "trials": trials,
+        }
+        if "mfu" in winner:
+            output["mfu"] = winner["mfu"]
+        with open(args.autotune_output, "w") as f:
+            json.dump(output, f, indent=2)
+        logger.info("Best of %d trials: %s, %.0f tokens/sec, %.1f GB peak; written to %s", len(trials),
+                    output["best"], winner["tokens_per_sec"], winner["peak_memory_gb"], args.autotune_output)
+
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    args, _ = parse_args()
+    autotune(args)
@@ -68,6 +68,10 @@ def parse_args():  # pylint: disable=too-many-statements
                         type=int,
                         default=1,
                         help="number of iterations between logging")
+    parser.add_argument("--gpu_peak_tflops",
+                        type=float,
+                        default=0,
+                        help="peak bf16 TFLOPs of a GPU for MFU, 0 to detect it from the GPU name")
     parser.add_argument("--tensorboard_dir", type=str, nargs="+", default=None)
 
     model_grp = parser.add_argument_group(
@@ -85,6 +89,13 @@ def parse_args():  # pylint: disable=too-many-statements
     model_grp.add_argument("--model_type", type=str, default="gpt_neox")
     model_grp.add_argument("--rotary_pct", type=float, default=0.25)
     model_grp.add_argument("--rotary_emb_base", type=int, default=10000)
+    model_grp.add_argument(
+        "--document_masking",
+        type=int,
+        default=0,
+        help="pack documents with per-document position ids and cu_seqlens so that "
+        "they do not attend to each other; requires flash-attn and --bf16=1",
+    )
 
     fsdp_grp = parser.add_argument_group(
         title="fsdp", description="arguments for fully sharded data parallel")
@@ -105,6 +116,45 @@ def parse_args():  # pylint: disable=too-many-statements
         help=
         "CPU offloading https://pytorch.org/docs/stable/fsdp.html#torch.distributed.fsdp.CPUOffload"
     )
+    fsdp_grp.add_argument(
+        "--reshard_after_forward",
+        type=int,
+        default=1,
+        help="free gathered parameters after forward and all-gather them again for backward",
+    )
+    fsdp_grp.add_argument(
+        "--hsdp_shard_size",
+        type=int,
+        default=0,
+        help="ranks per shard group with --sharding_strategy=hybrid, 0 for the GPUs of a node",
+    )
+    fsdp_grp.add_argument(
+        "--prefetch_depth",
+        type=int,
+        default=0,
+        help="number of layers whose all-gathers are issued ahead, 0 for FSDP2's implicit prefetching",
+    )
+    fsdp_grp.add_argument(
+        "--activation_checkpointing_ratio",
+        type=float,
+        default=1.0,
+        help="fraction of transformer layers to checkpoint with --activation_checkpointing=1",
+    )
+
+    autotune_grp = parser.add_argument_group(
+        title="autotune", description="arguments for autotune.py")
+    autotune_grp.add_argument("--autotune_output", type=str, default="autotune.json",
+                              help="file the best configuration is written to")
+    autotune_grp.add_argument("--autotune_batch_sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    autotune_grp.add_argument("--autotune_ac_ratios", type=float, nargs="+", default=[1.0, 0.5, 0.25, 0.0],
+                              help="activation checkpointing ratios to try, 0 disables it")
+    autotune_grp.add_argument("--autotune_prefetch_depths", type=int, nargs="+", default=[0, 2])
+    autotune_grp.add_argument("--autotune_steps", type=int, default=10,
+                              help="measured steps per trial, after --autotune_warmup_steps")
+    autotune_grp.add_argument("--autotune_warmup_steps", type=int, default=3)
+    autotune_grp.add_argument("--autotune_max_trials", type=int, default=64)
+    autotune_grp.add_argument("--autotune_memory_fraction", type=float, default=0.9,
+                              help="reject configurations whose peak memory exceeds this fraction of the GPU")
 
     # learning rate
     lr_grp = parser.add_argument_group(
@@ -152,6 +202,14 @@ def parse_args():  # pylint: disable=too-many-statements
         title="io", description="location for input and output")
     io_grp.add_argument("--dataset", type=str, default="allenai/c4")
     io_grp.add_argument("--dataset_config_name", type=str, default="en")
+    io_grp.add_argument(
+        "--dataset_format",
+        type=str,
+        default="streaming",
+        choices=["streaming", "memmap"],
+        help="streaming tokenizes --dataset from the HF hub on the fly; memmap reads "
+        "token shards written by pretokenize.py from --dataset/train and --dataset/validation",
+    )
     io_grp.add_argument("--tokenizer",
                         type=str,
                         default="EleutherAI/gpt-neox-20b")
@@ -167,6 +225,50 @@ def parse_args():  # pylint: disable=too-many-statements
         default=None,
         help="Saves partial checkpoints (model, optimizer) to this dir.",  # pylint: disable=line-too-long
     )
+    io_grp.add_argument(
+        "--async_checkpoint",
+        type=int,
+        default=0,
+        help="stage checkpoints to pinned CPU memory and write them in the background",
+    )
+    io_grp.add_argument(
+        "--local_checkpoint_dir",
+        type=str,
+        default=None,
+        help="Write checkpoints to this node-local directory (e.g. /opt/dlami/nvme/checkpoints) "
+        "first and drain them to --checkpoint_dir in the background.",
+    )
+    io_grp.add_argument(
+        "--checkpoint_drain_mbps",
+        type=int,
+        default=500,
+        help="Per-node bandwidth limit in MB/s for draining local checkpoints, 0 for unlimited",
+    )
+    io_grp.add_argument(
+        "--local_checkpoints_to_keep",
+        type=int,
+        default=2,
+        help="Number of drained checkpoints kept on node-local storage",
+    )
+    io_grp.add_argument(
+        "--checkpoints_to_keep",
+        type=int,
+        default=0,
+        help="Delete all but this many newest checkpoints in --checkpoint_dir, 0 keeps all",
+    )
+    io_grp.add_argument(
+        "--keep_checkpoint_every",
+        type=int,
+        default=0,
+        help="Never delete checkpoints whose step is a multiple of this, 0 to disable",
+    )
+    io_grp.add_argument(
+        "--verify_checkpoint",
+        type=str,
+        default="size",
+        choices=["none", "size", "checksum"],
+        help="How to verify a checkpoint against its manifest before resuming from it",
+    )
     io_grp.add_argument("--epochs",
                         type=int,
                         default=3,
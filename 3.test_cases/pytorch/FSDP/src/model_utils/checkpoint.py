@@ -3,6 +3,8 @@
 
 import os
 import re
+import threading
+import time
 import warnings
 from pathlib import Path
 
@@ -16,17 +18,114 @@ from torch.distributed.checkpoint.state_dict import (
     StateDictOptions,
 )
 import torch.distributed.checkpoint as dist_cp
+from torch.distributed.checkpoint.default_planner import DefaultSavePlanner
+from model_utils.checkpoint_catalog import LATEST_FILE, checkpoint_step
 from model_utils.train_utils import get_logger
 
 logger = get_logger()
 
-def save_checkpoint(model, optimizer, scheduler, user_content, root_dir, sub_dir):
-    """Save checkpoint using FSDP2 DTensor state dict APIs."""
-    torch.cuda.empty_cache()
+def dataloader_state_path(checkpoint_dir):
+    """Data position of every rank is saved separately, next to the sharded model state."""
+    return os.path.join(checkpoint_dir, f"dataloader_rank{dist.get_rank()}.pt")
 
-    save_dir = os.path.join(root_dir, sub_dir)
+def save_dataloader_state(dataloader, save_dir):
+    os.makedirs(save_dir, exist_ok=True)
+    path = dataloader_state_path(save_dir)
+    torch.save(dataloader.state_dict(), path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def load_dataloader_state(dataloader, checkpoint_dir):
+    """Restore the data position saved with a checkpoint; returns False if there is none."""
+    path = dataloader_state_path(checkpoint_dir)
+    if not os.path.exists(path):
+        logger.warning(f"{path} not found. Data position will be restored by skipping batches")
+        return False
+    dataloader.load_state_dict(torch.load(path, weights_only=False))
+    return True
+
+class AsyncCheckpointer:
+    """Holds the in-flight asynchronous checkpoint write.
+
+    dist_cp.async_save stages the sharded state dict to pinned CPU memory on
+    the training thread and writes it to storage from a background thread,
+    so training only stalls for the device-to-host copy. The staging buffers
+    are cached in the writer and reused by every save. Background writes
+    coordinate over a separate gloo process group so they never issue NCCL
+    collectives concurrently with training. With a CheckpointCatalog, a
+    background thread catalogues the checkpoint over the same group as soon
+    as its write has completed, so checksums do not stall training and the
+    latest pointer does not wait for the next save.
+    """
+
+    def __init__(self, catalog=None):
+        self.process_group = dist.new_group(backend="gloo")
+        self.catalog = catalog
+        self.storage_writer = None
+        self.pending = None
+        self._error = None
+
+    def writer(self, save_dir):
+        if self.storage_writer is None:
+            self.storage_writer = dist_cp.FileSystemWriter(save_dir, cache_staged_state_dict=True)
+        return self.storage_writer
+
+    def track(self, future, save_dir, start):
+        """Complete an asynchronous save in the background."""
+        self.pending = threading.Thread(target=self._complete, args=(future, save_dir, start),
+                                        name="checkpoint-complete", daemon=True)
+        self.pending.start()
+
+    def _complete(self, future, save_dir, start):
+        try:
+            future.result()
+            if dist.get_rank() == 0:
+                logger.info("Completed checkpoint %s (%.1fs after it was started).",
+                            save_dir, time.perf_counter() - start)
+            if self.catalog is not None:
+                self.catalog.commit(save_dir, checkpoint_step(save_dir), group=self.process_group)
+        except Exception as e:  # pylint: disable=broad-except
+            self._error = e
+
+    def wait(self):
+        """Block until the previous checkpoint is fully written and catalogued."""
+        if self.pending is None:
+            return
+        self.pending.join()
+        self.pending = None
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def finish(self):
+        self.wait()
+        dist.destroy_process_group(self.process_group)
+
+
+def save_checkpoint(model, optimizer, scheduler, user_content, root_dir, sub_dir, dataloader=None,
+                    checkpointer=None, tiered=None, catalog=None):
+    """Save checkpoint using FSDP2 DTensor state dict APIs.
+
+    With an AsyncCheckpointer, returns once the state is staged in CPU memory
+    and the write continues in the background; the previous write is
+    awaited first. With a TieredCheckpointer, the checkpoint is written to
+    node-local storage and drained to root_dir in the background. With a
+    CheckpointCatalog, a blocking checkpoint is catalogued once written; the
+    other modes catalogue it when their write completes. Returns the
+    seconds training was stalled.
+    """
+    start = time.perf_counter()
+    if checkpointer is not None and tiered is None:
+        checkpointer.wait()
+    else:
+        torch.cuda.empty_cache()
+
+    save_dir = tiered.local_path(sub_dir) if tiered is not None else os.path.join(root_dir, sub_dir)
     if dist.get_rank() == 0:
         logger.info("Writing checkpoint to {0}.".format(save_dir))
+
+    # Written before the .metadata file, which marks the checkpoint complete
+    if dataloader is not None:
+        save_dataloader_state(dataloader, save_dir)
     
     # Get sharded state dicts (DTensor format)
     model_state_dict = get_model_state_dict(model)
@@ -43,14 +142,47 @@ def save_checkpoint(model, optimizer, scheduler, user_content, root_dir, sub_dir
         "start_batch_index": user_content["start_batch_index"],
     }
     
+    if tiered is not None:
+        # Replicated state is written once, by the lowest rank holding it; a
+        # local copy is only resumed from when every file it refers to is
+        # on the node or already drained
+        dist_cp.save(
+            state_dict=state_dict,
+            storage_writer=dist_cp.FileSystemWriter(save_dir),
+            planner=DefaultSavePlanner(dedup_save_to_lowest_rank=True),
+        )
+        tiered.commit(sub_dir, user_content["total_steps"])
+        stall = time.perf_counter() - start
+        if dist.get_rank() == 0:
+            logger.info("Completed local checkpoint, training stalled %.2fs (tiered, draining to %s).",
+                        stall, root_dir)
+        return stall
+
+    if checkpointer is not None:
+        future = dist_cp.async_save(
+            state_dict=state_dict,
+            checkpoint_id=save_dir,
+            storage_writer=checkpointer.writer(save_dir),
+            process_group=checkpointer.process_group,
+        )
+        checkpointer.track(future, save_dir, start)
+        stall = time.perf_counter() - start
+        if dist.get_rank() == 0:
+            logger.info("Checkpoint staged, training stalled %.2fs (async, write continues in background).", stall)
+        return stall
+
     dist_cp.save(
         state_dict=state_dict,
         storage_writer=dist_cp.FileSystemWriter(save_dir),
     )
     
     dist.barrier()
+    if catalog is not None:
+        catalog.commit(save_dir, user_content["total_steps"])
+    stall = time.perf_counter() - start
     if dist.get_rank() == 0:
-        logger.info("Completed checkpoint.")
+        logger.info("Completed checkpoint, training stalled %.2fs (blocking).", stall)
+    return stall
 
 def get_last_checkpoint(checkpoint_paths, model_type):
     """Find the most recent checkpoint."""
@@ -68,10 +200,25 @@ def get_last_checkpoint(checkpoint_paths, model_type):
     else:
         return None
     
-def load_checkpoint(model, optimizer, scheduler, checkpoint_dir, model_type, device):
-    """Load checkpoint using FSDP2 DTensor state dict APIs."""
-    checkpoint_paths = list(Path(checkpoint_dir).glob(f"{model_type}-*steps"))
-    last_checkpoint = get_last_checkpoint(checkpoint_paths, model_type)
+def load_checkpoint(model, optimizer, scheduler, checkpoint_dir, model_type, device, dataloader=None,
+                    tiered=None, catalog=None):
+    """Load checkpoint using FSDP2 DTensor state dict APIs.
+
+    The last element of the returned tuple tells whether the dataloader
+    position was restored; otherwise training has to skip start_batch_index
+    batches. With a TieredCheckpointer, the freshest checkpoint across
+    node-local and durable storage is loaded. With a CheckpointCatalog, the
+    checkpoint is found through the latest pointer and verified, falling
+    back to older catalogued checkpoints.
+    """
+    if catalog is not None and os.path.exists(os.path.join(checkpoint_dir, LATEST_FILE)):
+        last_checkpoint = catalog.latest(checkpoint_dir, model_type)
+    else:
+        checkpoint_paths = list(Path(checkpoint_dir).glob(f"{model_type}-*steps"))
+        last_checkpoint = get_last_checkpoint(checkpoint_paths, model_type)
+    if tiered is not None:
+        # A fresher checkpoint may still be on local storage, not yet drained
+        last_checkpoint = tiered.resolve(model_type, last_checkpoint)
     
     if last_checkpoint is None:
         if dist.get_rank() == 0:
@@ -82,6 +229,7 @@ def load_checkpoint(model, optimizer, scheduler, checkpoint_dir, model_type, dev
             scheduler,
             0,
             0,
+            False,
         )
     
     if dist.get_rank() == 0:
@@ -120,6 +268,10 @@ def load_checkpoint(model, optimizer, scheduler, checkpoint_dir, model_type, dev
     
     # Load scheduler state
     scheduler.load_state_dict(state_dict["scheduler"])
+
+    dataloader_restored = False
+    if dataloader is not None:
+        dataloader_restored = load_dataloader_state(dataloader, last_checkpoint)
     
     dist.barrier()
     if dist.get_rank() == 0:
@@ -131,5 +283,6 @@ def load_checkpoint(model, optimizer, scheduler, checkpoint_dir, model_type, dev
         scheduler,
         state_dict["total_steps"],
         state_dict["start_batch_index"],
+        dataloader_restored,
     )
 
@@ -0,0 +1,197 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import glob
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import torch.distributed as dist
+
+from model_utils.train_utils import get_logger
+
+logger = get_logger()
+
+CATALOG_FILE = "catalog.json"
+LATEST_FILE = "latest"
+METADATA_FILE = ".metadata"
+CHECKSUM_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def checkpoint_step(path):
+    return int(re.findall(r'(\d+)steps', os.path.basename(path))[-1])
+
+
+def file_crc32(path):
+    """CRC32 of a file; zlib releases the GIL, so files checksum in parallel threads."""
+    crc = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHECKSUM_CHUNK_BYTES)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    return f"{crc:08x}"
+
+
+def _write_atomic(path, text):
+    with open(path + ".tmp", "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+class CheckpointCatalog:
+    """Integrity manifests, a latest pointer and retention for a checkpoint directory.
+
+    When a checkpoint is complete on storage, every rank checksums the files
+    it wrote and rank 0 writes them, with their sizes, to catalog.json in
+    the checkpoint and then atomically points <root_dir>/latest at it. Resume
+    reads the pointer instead of listing the root directory, verifies the
+    checkpoint against its manifest, and falls back to older catalogued
+    checkpoints if verification fails.
+
+    With keep_last > 0, a background thread on rank 0 deletes checkpoints
+    older than the latest one, except the keep_last newest and those whose
+    step is a multiple of keep_every.
+    """
+
+    def __init__(self, keep_last=0, keep_every=0, verify="size", workers=8):
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.verify = verify
+        self.workers = workers
+        self._queue = None
+        self._pruner = None
+
+    def _checksum(self, root, names):
+        with ThreadPoolExecutor(self.workers) as pool:
+            crcs = pool.map(file_crc32, [os.path.join(root, name) for name in names])
+        return {name: {"size": os.path.getsize(os.path.join(root, name)), "crc32": crc}
+                for name, crc in zip(names, crcs)}
+
+    def build_manifest(self, save_dir, step, group=None):
+        """Checksum a complete checkpoint; collective over group, returns the manifest on rank 0."""
+        rank = dist.get_rank()
+        names = [os.path.basename(path) for path in glob.glob(os.path.join(save_dir, f"__{rank}_*.distcp"))]
+        if os.path.exists(os.path.join(save_dir, f"dataloader_rank{rank}.pt")):
+            names.append(f"dataloader_rank{rank}.pt")
+        if rank == 0:
+            names.append(METADATA_FILE)
+        files = [None] * dist.get_world_size() if rank == 0 else None
+        dist.gather_object(self._checksum(save_dir, names), files, dst=0, group=group)
+        if rank != 0:
+            return None
+        manifest = {"step": step, "world_size": dist.get_world_size(), "files": {}}
+        for rank_files in files:
+            manifest["files"].update(rank_files)
+        return manifest
+
+    def write_manifest(self, save_dir, manifest):
+        _write_atomic(os.path.join(save_dir, CATALOG_FILE), json.dumps(manifest, indent=2, sort_keys=True))
+
+    def publish(self, save_dir):
+        """Point latest at a catalogued checkpoint and prune older ones; rank 0 only."""
+        root_dir = os.path.dirname(os.path.normpath(save_dir))
+        _write_atomic(os.path.join(root_dir, LATEST_FILE), os.path.basename(os.path.normpath(save_dir)) + "\n")
+        if self.keep_last:
+            if self._pruner is None:
+                self._queue = queue.Queue()
+                self._pruner = threading.Thread(target=self._prune_loop, name="checkpoint-prune", daemon=True)
+                self._pruner.start()
+            self._queue.put(save_dir)
+
+    def commit(self, save_dir, step, group=None):
+        """Catalogue a checkpoint that every rank has finished writing; collective over group."""
+        manifest = self.build_manifest(save_dir, step, group)
+        if dist.get_rank() == 0:
+            self.write_manifest(save_dir, manifest)
+            self.publish(save_dir)
+            logger.info("Catalogued checkpoint %s: %d files, %.1f GB", save_dir, len(manifest["files"]),
+                        sum(entry["size"] for entry in manifest["files"].values()) / 1024**3)
+
+    def _prune_loop(self):
+        while True:
+            latest = self._queue.get()
+            if latest is None:
+                return
+            try:
+                self._prune(latest)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Pruning checkpoints older than %s failed", latest)
+            finally:
+                self._queue.task_done()
+
+    def _prune(self, latest):
+        latest = os.path.normpath(latest)
+        model_type = os.path.basename(latest).rsplit("-", 1)[0]
+        latest_step = checkpoint_step(latest)
+        # Newer directories may still be in flight
+        paths = sorted((path for path in glob.glob(os.path.join(os.path.dirname(latest), f"{model_type}-*steps"))
+                        if checkpoint_step(path) <= latest_step), key=checkpoint_step)
+        for path in paths[:-self.keep_last]:
+            if self.keep_every and checkpoint_step(path) % self.keep_every == 0:
+                continue
+            logger.info("Removing checkpoint %s", path)
+            shutil.rmtree(path, ignore_errors=True)
+
+    def finish(self):
+        if self._pruner is not None:
+            self._queue.put(None)
+            self._pruner.join()
+
+    def _candidates(self, root_dir, model_type):
+        """Checkpoints to try on resume, newest first, read on rank 0."""
+        try:
+            with open(os.path.join(root_dir, LATEST_FILE)) as f:
+                latest = f.read().strip()
+        except FileNotFoundError:
+            latest = None
+        if latest and latest.startswith(f"{model_type}-"):
+            yield os.path.join(root_dir, latest)
+        # Only listed when there is no usable latest pointer
+        paths = sorted(glob.glob(os.path.join(root_dir, f"{model_type}-*steps")), key=checkpoint_step, reverse=True)
+        for path in paths:
+            if os.path.basename(path) != latest and os.path.exists(os.path.join(path, CATALOG_FILE)):
+                yield path
+
+    def _verify(self, path):
+        """Check this rank's share of a checkpoint against its manifest."""
+        try:
+            with open(os.path.join(path, CATALOG_FILE)) as f:
+                manifest = json.load(f)
+            # Files are verified round-robin across ranks
+            names = sorted(manifest["files"])[dist.get_rank()::dist.get_world_size()]
+            for name in names:
+                if os.path.getsize(os.path.join(path, name)) != manifest["files"][name]["size"]:
+                    return False
+            if self.verify == "checksum":
+                crcs = self._checksum(path, names)
+                return all(crcs[name]["crc32"] == manifest["files"][name]["crc32"] for name in names)
+            return True
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def latest(self, root_dir, model_type):
+        """The newest verified catalogued checkpoint, or None; collective."""
+        candidates = self._candidates(root_dir, model_type) if dist.get_rank() == 0 else None
+        while True:
+            path = [next(candidates, None) if candidates is not None else None]
+            dist.broadcast_object_list(path, src=0)
+            path = path[0]
+            if path is None:
+                return None
+            if self.verify == "none":
+                return path
+            verified = [None] * dist.get_world_size()
+            dist.all_gather_object(verified, self._verify(path))
+            if all(verified):
+                return path
+            if dist.get_rank() == 0:
+                logger.warning("Checkpoint %s failed verification, falling back to an older one", path)
@@ -1,42 +1,132 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import copy
+import itertools
 import os
 import numpy as np
 import datasets as hf_datasets
 from torch.utils.data import IterableDataset
-from typing import Dict, Iterable, Union
+from typing import Any, Dict, Iterable, Tuple, Union
 from transformers import PreTrainedTokenizerBase
 
+from model_utils.packing import packed_sample
+
 class ConcatTokensDataset(IterableDataset):
+    """Pack tokenized documents, separated by EOS, into max_length sequences.
+
+    Documents are tokenized tokenizer_batch_size at a time with the fast
+    tokenizer's batch API and copied into a preallocated ring of
+    ring_windows sequences. Each yielded array is a view into the ring and
+    stays valid until ring_windows more sequences have been yielded, so
+    ring_windows must be at least the DataLoader batch size.
+
+    state_dict() captures the position after the last yielded sequence: the
+    HF dataset state (shard index and offset within it) at the start of the
+    current tokenizer batch and how many of that batch's tokens were packed.
+    A sequence is only yielded when the ring row is full, so no partially
+    packed tokens are ever outstanding. Resuming re-reads one tokenizer batch
+    instead of replaying the stream. The contents of a HF shuffle buffer are
+    not part of the HF state, so a shuffled stream resumes at the right shard
+    position with a refilled buffer.
+
+    With document_masking, each sample is a dict that also carries the
+    position of every token within its document and the cu_seqlens of the
+    documents, for flash-attention varlen kernels (see model_utils.packing).
+    """
+
     def __init__(
         self,
         hf_dataset: Union[hf_datasets.IterableDataset, hf_datasets.Dataset],
         tokenizer: PreTrainedTokenizerBase,
         max_length: int,
         wrap: bool,
+        tokenizer_batch_size: int = 64,
+        ring_windows: int = 64,
+        document_masking: bool = False,
     ):
         os.environ['TOKENIZERS_PARALLELISM'] = 'false'
         self.hf_dataset = hf_dataset
         self.tokenizer = tokenizer
         self.max_length = max_length
         self.should_wrap = wrap
+        self.tokenizer_batch_size = tokenizer_batch_size
+        self.ring_windows = ring_windows
+        self.document_masking = document_masking
+        self._state = self._initial_state()
+        self._resume_state = None
+
+    @staticmethod
+    def _initial_state() -> Dict[str, Any]:
+        return {"source_state": None, "samples_before_batch": 0, "batch_pos": 0}
+
+    def state_dict(self) -> Dict[str, Any]:
+        return copy.deepcopy(self._state)
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        self._resume_state = copy.deepcopy(state_dict)
+
+    def _encode(self, texts) -> Tuple[np.ndarray, np.ndarray]:
+        """Tokenize a batch into one flat array and the end offset of every document."""
+        encoded = self.tokenizer(texts,
+                                 truncation=True,
+                                 padding=False,
+                                 return_attention_mask=False)['input_ids']
+        eos = [self.tokenizer.eos_token_id]
+        doc_ends = np.cumsum([len(ids) + 1 for ids in encoded])
+        tokens = np.fromiter(itertools.chain.from_iterable(ids + eos for ids in encoded),
+                             dtype=np.int64,
+                             count=int(doc_ends[-1]))
+        return tokens, doc_ends
+
+    def _tokenized_batches(self, resume_state) -> Iterable[Tuple[np.ndarray, np.ndarray]]:
+        has_state = hasattr(self.hf_dataset, "state_dict")
+        samples_before_batch = 0
+        if resume_state:
+            samples_before_batch = resume_state["samples_before_batch"]
+            if has_state and resume_state["source_state"] is not None:
+                self.hf_dataset.load_state_dict(resume_state["source_state"])
+        samples = (sample['text'] for sample in self.hf_dataset)
+        if resume_state and not has_state:
+            # Sources without a checkpointable state are skipped forward
+            samples = itertools.islice(samples, samples_before_batch, None)
+        while True:
+            source_state = copy.deepcopy(self.hf_dataset.state_dict()) if has_state else None
+            texts = list(itertools.islice(samples, self.tokenizer_batch_size))
+            if not texts:
+                return
+            self._state = {"source_state": source_state,
+                           "samples_before_batch": samples_before_batch,
+                           "batch_pos": 0}
+            samples_before_batch += len(texts)
+            yield self._encode(texts)
 
-    def __iter__(self) -> Iterable[Dict[str, bytes]]:
-
-        buffer = []
-        mask_buffer = []
-        for sample in self.hf_dataset:
-            encoded = self.tokenizer(sample['text'],
-                                     truncation=True,
-                                     padding=False)
-            iids = encoded['input_ids']
-            mask = encoded['attention_mask']
-            buffer = buffer + iids + [self.tokenizer.eos_token_id]
-            mask_buffer = mask_buffer + mask + [1]
-            while len(buffer) >= self.max_length:
-                concat_sample = buffer[:self.max_length]
-                buffer = buffer[self.max_length:] if self.should_wrap else []
-                concat_sample_mask = mask_buffer[:self.max_length]
-                mask_buffer = mask_buffer[self.max_length:] if self.should_wrap else []
-                yield np.array(concat_sample)
+    def __iter__(self) -> Iterable[Union[np.ndarray, Dict[str, np.ndarray]]]:
+        resume_state, self._resume_state = self._resume_state, None
+        ring = np.empty((self.ring_windows, self.max_length), dtype=np.int64)
+        slot = 0
+        fill = 0
+        for tokens, doc_ends in self._tokenized_batches(resume_state):
+            pos = 0
+            if resume_state:
+                # Skip the part of the first batch packed before the checkpoint
+                pos = resume_state["batch_pos"]
+                resume_state = None
+            while pos < len(tokens):
+                n = min(self.max_length - fill, len(tokens) - pos)
+                ring[slot, fill:fill + n] = tokens[pos:pos + n]
+                fill += n
+                pos += n
+                if fill < self.max_length:
+                    continue
+                if not self.should_wrap:
+                    # Drop the rest of the document that completed the sequence
+                    pos = int(doc_ends[np.searchsorted(doc_ends, pos)])
+                self._state["batch_pos"] = pos
+                if self.document_masking:
+                    yield packed_sample(ring[slot], self.tokenizer.eos_token_id)
+                else:
+                    yield ring[slot]
+                slot = (slot + 1) % self.ring_windows
+                fill = 0
+        self._state = self._initial_state()
@@ -0,0 +1,202 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import os
+import numpy as np
+from torch.utils.data import IterableDataset, get_worker_info
+from typing import Dict, Iterable, List, Union
+
+from model_utils.packing import packed_sample
+
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+
+
+def token_dtype(vocab_size: int):
+    """Smallest unsigned dtype able to hold every token id of the vocabulary."""
+    return np.uint16 if vocab_size <= np.iinfo(np.uint16).max + 1 else np.uint32
+
+
+class TokenShardWriter:
+    """Write a stream of token ids as fixed-dtype shards plus an index.
+
+    Layout of a token directory:
+        index.json          dtype, tokenizer, eos id and per-shard token counts
+        shard-00000.bin     raw little-endian token ids, documents separated by EOS
+    """
+
+    def __init__(self, output_dir: str, dtype, shard_tokens: int, metadata: Dict = None):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.shard_tokens = shard_tokens
+        self.metadata = metadata or {}
+        self.shards: List[Dict] = []
+        self._file = None
+        self._count = 0
+
+    def _open_shard(self):
+        name = f"shard-{len(self.shards):05d}.bin"
+        self._file = open(os.path.join(self.output_dir, name), "wb")
+        self.shards.append({"file": name, "num_tokens": 0})
+        self._count = 0
+
+    def write(self, tokens):
+        tokens = np.asarray(tokens, dtype=self.dtype)
+        while len(tokens):
+            if self._file is None:
+                self._open_shard()
+            room = self.shard_tokens - self._count
+            chunk, tokens = tokens[:room], tokens[room:]
+            chunk.tofile(self._file)
+            self._count += len(chunk)
+            self.shards[-1]["num_tokens"] = self._count
+            if self._count >= self.shard_tokens:
+                self._file.close()
+                self._file = None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        index = dict(self.metadata)
+        index.update({
+            "version": INDEX_VERSION,
+            "dtype": self.dtype.str,
+            "total_tokens": sum(shard["num_tokens"] for shard in self.shards),
+            "shards": self.shards,
+        })
+        tmp_file = os.path.join(self.output_dir, f".{INDEX_FILE}.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(index, f, indent=2)
+        # The index is written last, so a directory with an index is complete
+        os.replace(tmp_file, os.path.join(self.output_dir, INDEX_FILE))
+        return index
+
+
+def load_index(data_dir: str) -> Dict:
+    with open(os.path.join(data_dir, INDEX_FILE)) as f:
+        index = json.load(f)
+    if index.get("version") != INDEX_VERSION:
+        raise ValueError(f"{data_dir}: unsupported token index version {index.get('version')}")
+    return index
+
+
+class MemmapTokenDataset(IterableDataset):
+    """Serve max_length token windows from pre-tokenized shards through np.memmap.
+
+    Windows are read straight from the page cache, so the data loader does no
+    tokenization or deserialization. Every epoch visits the shards and the
+    windows inside each shard in a seeded random order; windows are dealt
+    round-robin across (rank, dataloader worker) streams so that each
+    window is read by at most one of them. Like
+    DistributedSampler(drop_last=True), the tail of every epoch's order is
+    dropped so that all streams yield the same number of windows and every
+    rank runs the same number of steps. num_workers must match the
+    DataLoader's for len() to be exact.
+
+    With document_masking, samples are dicts with per-document position ids
+    and cu_seqlens derived from the EOS separators (see model_utils.packing).
+
+    The state of a stream is its epoch and the number of windows it has
+    yielded, which is enough to resume since the order is a function of
+    the seed and epoch.
+    """
+
+    def __init__(
+        self,
+        data_dir: str,
+        max_length: int,
+        global_rank: int = 0,
+        world_size: int = 1,
+        seed: int = 42,
+        shuffle: bool = True,
+        document_masking: bool = False,
+        num_workers: int = 0,
+    ):
+        self.data_dir = data_dir
+        self.index = load_index(data_dir)
+        self.dtype = np.dtype(self.index["dtype"])
+        self.max_length = max_length
+        self.global_rank = global_rank
+        self.world_size = world_size
+        self.seed = seed
+        self.shuffle = shuffle
+        self.document_masking = document_masking
+        self.num_workers = num_workers
+        if document_masking and self.index.get("eos_token_id") is None:
+            raise ValueError(f"{data_dir}: index has no eos_token_id to find document boundaries")
+        self.epoch = 0
+        self._position = 0
+        # Windows never straddle shards; the tail of each shard is dropped
+        self.windows_per_shard = [shard["num_tokens"] // max_length for shard in self.index["shards"]]
+        if not sum(self.windows_per_shard):
+            raise ValueError(f"{data_dir}: no shard holds a full window of {max_length} tokens")
+        self._memmaps = {}
+
+    def _windows_per_stream(self, num_workers: int) -> int:
+        return sum(self.windows_per_shard) // (self.world_size * num_workers)
+
+    def __len__(self):
+        num_workers = max(self.num_workers, 1)
+        return self._windows_per_stream(num_workers) * num_workers
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+        self._position = 0
+
+    def state_dict(self) -> Dict:
+        return {"epoch": self.epoch, "position": self._position}
+
+    def load_state_dict(self, state_dict: Dict):
+        self.epoch = state_dict["epoch"]
+        self._position = state_dict["position"]
+
+    def _memmap(self, shard_id: int):
+        # Opened lazily so that each dataloader worker maps the files itself
+        if shard_id not in self._memmaps:
+            path = os.path.join(self.data_dir, self.index["shards"][shard_id]["file"])
+            self._memmaps[shard_id] = np.memmap(path, dtype=self.dtype, mode="r")
+        return self._memmaps[shard_id]
+
+    def __iter__(self) -> Iterable[Union[np.ndarray, Dict[str, np.ndarray]]]:
+        worker = get_worker_info()
+        num_workers = worker.num_workers if worker else 1
+        worker_id = worker.id if worker else 0
+        stride = self.world_size * num_workers
+        offset = 0
+        slot = self.global_rank * num_workers + worker_id
+        # Windows already yielded by this stream in this epoch, when resuming
+        skip = self._position
+        remaining = self._windows_per_stream(num_workers) - skip
+
+        rng = np.random.default_rng(self.seed + self.epoch)
+        shard_order = rng.permutation(len(self.windows_per_shard)) if self.shuffle \
+            else np.arange(len(self.windows_per_shard))
+        for shard_id in shard_order:
+            if remaining <= 0:
+                break
+            num_windows = self.windows_per_shard[shard_id]
+            windows = rng.permutation(num_windows) if self.shuffle else np.arange(num_windows)
+            # Continue the round-robin across shard boundaries
+            first = (slot - offset) % stride
+            offset = (offset + num_windows) % stride
+            if first >= num_windows:
+                continue
+            mine = windows[first::stride]
+            if skip >= len(mine):
+                skip -= len(mine)
+                continue
+            tokens = self._memmap(shard_id)
+            for window in mine[skip:skip + remaining]:
+                start = int(window) * self.max_length
+                self._position += 1
+                remaining -= 1
+                # The only copy: widening to int64 for the embedding lookup
+                sample = tokens[start:start + self.max_length].astype(np.int64)
+                yield packed_sample(sample, self.index["eos_token_id"]) if self.document_masking else sample
+            skip = 0
+        # The next pass over the data is a new epoch with a new order
+        self.epoch += 1
+        self._position = 0
@@ -0,0 +1,66 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import numpy as np
+import torch
+from typing import Dict, List
+
+IGNORE_INDEX = -100
+
+
+def document_position_ids(tokens: np.ndarray, eos_token_id: int) -> np.ndarray:
+    """Position of every token within its document; documents end with EOS.
+
+    A document continued from the previous sequence restarts at position 0,
+    since it cannot attend to the part it was split from.
+    """
+    index = np.arange(len(tokens))
+    starts = np.zeros(len(tokens), dtype=bool)
+    starts[0] = True
+    starts[1:] = tokens[:-1] == eos_token_id
+    return index - np.maximum.accumulate(np.where(starts, index, 0))
+
+
+def cu_seqlens(position_ids: np.ndarray) -> np.ndarray:
+    """Cumulative document lengths [0, len0, len0 + len1, ..., len(position_ids)]."""
+    starts = np.flatnonzero(position_ids == 0)
+    return np.append(starts, len(position_ids)).astype(np.int32)
+
+
+def packed_sample(tokens: np.ndarray, eos_token_id: int) -> Dict[str, np.ndarray]:
+    position_ids = document_position_ids(tokens, eos_token_id)
+    return {
+        "input_ids": tokens,
+        "position_ids": position_ids,
+        "cu_seqlens": cu_seqlens(position_ids),
+    }
+
+
+def collate_packed(samples: List[Dict[str, np.ndarray]]) -> Dict[str, torch.Tensor]:
+    """Flatten packed samples into one varlen batch for flash-attention.
+
+    Returns model keyword arguments: the batch becomes a single row whose
+    documents are delimited by cu_seq_lens, so no token attends across a
+    document boundary, and the first token of every document is excluded
+    from the loss so no document is trained to predict the next one.
+    """
+    input_ids = np.concatenate([sample["input_ids"] for sample in samples])
+    position_ids = np.concatenate([sample["position_ids"] for sample in samples])
+    offsets = np.cumsum([0] + [len(sample["input_ids"]) for sample in samples[:-1]])
+    cu = np.concatenate(
+        [sample["cu_seqlens"][:-1] + offset for sample, offset in zip(samples, offsets)]
+        + [[len(input_ids)]]
+    ).astype(np.int32)
+    labels = input_ids.copy()
+    labels[position_ids == 0] = IGNORE_INDEX
+    cu_seq_lens = torch.from_numpy(cu)
+    max_length = int(np.diff(cu).max())
+    return {
+        "input_ids": torch.from_numpy(input_ids).unsqueeze(0),
+        "position_ids": torch.from_numpy(position_ids).unsqueeze(0),
+        "labels": torch.from_numpy(labels).unsqueeze(0),
+        "cu_seq_lens_q": cu_seq_lens,
+        "cu_seq_lens_k": cu_seq_lens,
+        "max_length_q": max_length,
+        "max_length_k": max_length,
+    }
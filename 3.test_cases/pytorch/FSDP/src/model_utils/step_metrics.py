@@ -0,0 +1,162 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import statistics
+import time
+
+import torch
+import torch.distributed as dist
+
+PHASES = ("forward", "backward", "collective", "optimizer")
+STATS = ("step", "data", "idle") + PHASES + ("tokens_per_sec", "loss")
+
+# Dense bf16 tensor core peak, by substring of torch.cuda.get_device_name()
+PEAK_TFLOPS = (
+    ("GB200", 2500.0),
+    ("B200", 2250.0),
+    ("H200", 989.0),
+    ("H100", 989.0),
+    ("A100", 312.0),
+    ("L40S", 362.0),
+)
+
+
+def gpu_peak_tflops():
+    """Peak dense bf16 TFLOPs of the current GPU, or None if it is not known."""
+    name = torch.cuda.get_device_name()
+    for key, tflops in PEAK_TFLOPS:
+        if key in name:
+            return tflops
+    return None
+
+
+def model_flops_per_token(model_config, num_params, seq_len):
+    """Training FLOPs per token: 6 per parameter plus attention over seq_len.
+
+    Only the experts a token is routed to count towards the parameters of a
+    mixture-of-experts model.
+    """
+    hidden = model_config.hidden_size
+    layers = model_config.num_hidden_layers
+    num_experts = getattr(model_config, "num_local_experts", None)
+    if num_experts:
+        expert_params = layers * num_experts * 3 * hidden * model_config.intermediate_size
+        num_params -= expert_params * (1 - model_config.num_experts_per_tok / num_experts)
+    return 6 * num_params + 12 * layers * hidden * seq_len
+
+
+class StepMetrics:
+    """Per-step phase timing with CUDA events and no per-step host sync.
+
+    Every step records an event at its start and after each phase on the
+    current stream; the events of a window of steps are only resolved every
+    report_every steps, together with the loss summed on the GPU. Phases:
+
+        data        host time waiting for the dataloader
+        idle        GPU time between the end of the previous step and the
+                    start of this one, when the device waited for the host
+        forward, backward
+                    including the FSDP all-gathers and reduce-scatters that
+                    were not overlapped with compute
+        collective  gradient norm all-reduce and clipping
+        optimizer   optimizer and learning rate scheduler step
+
+    report() all-gathers the per-rank means so that a data loader stall on
+    one rank can be told apart from a slow GPU.
+    """
+
+    def __init__(self, flops_per_token, peak_tflops=None, report_every=10):
+        self.flops_per_token = flops_per_token
+        self.peak_tflops = peak_tflops
+        self.report_every = report_every
+        self._steps = []
+        self._prev_end = None
+        self._data_wait = 0.0
+        self._tokens = 0
+        self._loss = None
+        self._fetch_start = time.perf_counter()
+
+    def start(self, num_tokens):
+        """Mark the start of a step, once its batch is ready."""
+        self._data_wait += time.perf_counter() - self._fetch_start
+        self._tokens += num_tokens
+        self._events = [self._prev_end, self._record()]
+
+    def mark(self):
+        """Mark the end of the next phase."""
+        self._events.append(self._record())
+
+    def end(self, loss):
+        self._loss = loss.detach() if self._loss is None else self._loss + loss.detach()
+        self._steps.append(self._events)
+        self._prev_end = self._events[-1]
+        self._fetch_start = time.perf_counter()
+
+    def interrupt(self):
+        """Exclude the time until the next step, e.g. for validation or a checkpoint."""
+        self._prev_end = None
+        self._fetch_start = time.perf_counter()
+
+    @staticmethod
+    def _record():
+        event = torch.cuda.Event(enable_timing=True)
+        event.record()
+        return event
+
+    def ready(self):
+        return len(self._steps) >= self.report_every
+
+    def report(self):
+        """Per-rank stats of the window since the last report; collective.
+
+        Returns a (world_size, len(STATS)) tensor of per-step means in ms,
+        tokens/sec and the mean loss, on every rank.
+        """
+        steps = self._steps
+        steps[-1][-1].synchronize()
+        idle = [prev.elapsed_time(start) if prev is not None else 0.0 for prev, start, *_ in steps]
+        phases = [[events[i].elapsed_time(events[i + 1]) for i in range(1, len(events) - 1)] for events in steps]
+        step_ms = [gap + sum(times) for gap, times in zip(idle, phases)]
+        # Waiting for data only costs time when it leaves the GPU idle
+        total_ms = sum(step_ms)
+        local = [total_ms, self._data_wait * 1000, sum(idle)] + [sum(column) for column in zip(*phases)]
+        local = [value / len(steps) for value in local]
+        local += [self._tokens / total_ms * 1000, self._loss.item() / len(steps)]
+
+        stats = torch.zeros(dist.get_world_size(), len(STATS), device="cuda")
+        dist.all_gather_into_tensor(stats, torch.tensor(local, device="cuda"))
+        self._steps = []
+        self._data_wait = 0.0
+        self._tokens = 0
+        self._loss = None
+        return stats.cpu()
+
+    def mfu(self, tokens_per_sec):
+        if not self.peak_tflops:
+            return None
+        return tokens_per_sec * self.flops_per_token / (self.peak_tflops * 1e12)
+
+
+def summarize(stats):
+    """Cluster view of StepMetrics.report(): means, throughput and the straggler.
+
+    Ranks run in lockstep, so a straggler does not have a longer step: the
+    other ranks wait for it. The rank that arrives last at the gradient
+    norm all-reduce spends the least time in it; if that rank also left its
+    GPU idle for longer than the median rank, the host fed it late (data
+    loader or host stall), otherwise its GPU computed slower.
+    """
+    per_stat = {name: stats[:, i].tolist() for i, name in enumerate(STATS)}
+    median = {name: statistics.median(values) for name, values in per_stat.items()}
+    straggler = min(range(len(stats)), key=lambda rank: per_stat["collective"][rank])
+    waited = median["collective"] - per_stat["collective"][straggler]
+    idle_excess = per_stat["idle"][straggler] - median["idle"]
+    return {
+        "mean": {name: statistics.fmean(values) for name, values in per_stat.items()},
+        "tokens_per_sec": sum(per_stat["tokens_per_sec"]),
+        "straggler": straggler,
+        "waited": waited,
+        "straggler_data": per_stat["data"][straggler],
+        "median_data": median["data"],
+        "straggler_cause": "input" if idle_excess > waited / 2 else "compute",
+    }
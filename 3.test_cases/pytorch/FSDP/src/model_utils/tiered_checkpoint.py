@@ -0,0 +1,242 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import glob
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+import torch.distributed as dist
+from torch.distributed.checkpoint import FileSystemReader
+
+from model_utils.checkpoint_catalog import CATALOG_FILE, checkpoint_step
+from model_utils.train_utils import get_logger
+
+logger = get_logger()
+
+MANIFEST_FILE = "manifest.json"
+METADATA_FILE = ".metadata"
+DRAINED_DIR = ".drained"
+DRAINED_FILE = ".drained"
+COPY_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def _rate_limited_copy(src, dst, bytes_per_sec):
+    """Copy src to dst at no more than bytes_per_sec; dst appears atomically when complete."""
+    tmp = dst + ".tmp"
+    start = time.monotonic()
+    copied = 0
+    with open(src, "rb") as fin, open(tmp, "wb") as fout:
+        while True:
+            chunk = fin.read(COPY_CHUNK_BYTES)
+            if not chunk:
+                break
+            fout.write(chunk)
+            copied += len(chunk)
+            if bytes_per_sec:
+                ahead = copied / bytes_per_sec - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+    os.replace(tmp, dst)
+    return copied
+
+
+def _metadata_files(path):
+    """Names of the files the checkpoint .metadata in path refers to."""
+    metadata = FileSystemReader(path).read_metadata()
+    return {info.relative_path for info in metadata.storage_data.values()}
+
+
+class TieredCheckpointer:
+    """Write checkpoints to node-local NVMe and drain them to durable storage.
+
+    Every rank writes its shards to <local_dir>/<sub_dir>. Once all ranks are
+    done, each node holds a copy of the checkpoint .metadata and a
+    manifest.json listing the files it owns, which marks the local copy
+    complete. A background thread on each node's local rank 0 then copies the
+    node's files to <durable_dir>/<sub_dir> under a bandwidth limit and leaves
+    a .drained/node<N> marker, and a .drained file in the local copy that
+    allows it to be pruned. Node 0 copies .metadata last, after every node
+    has drained, so a durable checkpoint with .metadata is complete, exactly
+    as for checkpoints written directly to durable storage. With a
+    CheckpointCatalog, the checksum manifest is computed on the local copy
+    and the durable copy is published once it is complete.
+    """
+
+    def __init__(self, local_dir, durable_dir, drain_mbps=500, keep_local=2, drain_timeout=3600, catalog=None):
+        self.local_dir = local_dir
+        self.durable_dir = durable_dir
+        self.drain_bytes_per_sec = drain_mbps * 1024 * 1024 if drain_mbps else 0
+        self.keep_local = keep_local
+        self.drain_timeout = drain_timeout
+        self.catalog = catalog
+        self.local_rank = int(os.environ.get("LOCAL_RANK", 0))
+        local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+        self.node_rank = int(os.environ.get("GROUP_RANK", dist.get_rank() // local_world_size))
+        self.num_nodes = dist.get_world_size() // local_world_size
+        self._queue = queue.Queue()
+        self._drainer = None
+        if self.local_rank == 0:
+            self._drainer = threading.Thread(target=self._drain_loop, name="checkpoint-drain", daemon=True)
+            self._drainer.start()
+
+    def local_path(self, sub_dir):
+        return os.path.join(self.local_dir, sub_dir)
+
+    def commit(self, sub_dir, step):
+        """Mark a checkpoint written to local_path(sub_dir) complete and queue its drain."""
+        local_path = self.local_path(sub_dir)
+        # .metadata is only written on the coordinator's node; every node needs it to load locally
+        metadata = [None]
+        if dist.get_rank() == 0:
+            with open(os.path.join(local_path, METADATA_FILE), "rb") as f:
+                metadata[0] = f.read()
+        dist.broadcast_object_list(metadata, src=0)
+        dist.barrier()
+        if self.catalog is not None:
+            manifest = self.catalog.build_manifest(local_path, step)
+            if dist.get_rank() == 0:
+                self.catalog.write_manifest(local_path, manifest)
+
+        if self.local_rank == 0:
+            metadata_path = os.path.join(local_path, METADATA_FILE)
+            if not os.path.exists(metadata_path):
+                with open(metadata_path + ".tmp", "wb") as f:
+                    f.write(metadata[0])
+                os.replace(metadata_path + ".tmp", metadata_path)
+            files = sorted(
+                name for name in os.listdir(local_path)
+                if name not in (METADATA_FILE, MANIFEST_FILE, CATALOG_FILE) and not name.endswith(".tmp")
+            )
+            manifest = {
+                "step": step,
+                "world_size": dist.get_world_size(),
+                "node_rank": self.node_rank,
+                "num_nodes": self.num_nodes,
+                "files": {name: os.path.getsize(os.path.join(local_path, name)) for name in files},
+            }
+            with open(os.path.join(local_path, MANIFEST_FILE + ".tmp"), "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(os.path.join(local_path, MANIFEST_FILE + ".tmp"), os.path.join(local_path, MANIFEST_FILE))
+            self._queue.put(sub_dir)
+        dist.barrier()
+
+    def _drain_loop(self):
+        while True:
+            sub_dir = self._queue.get()
+            if sub_dir is None:
+                return
+            try:
+                self._drain(sub_dir)
+                self._prune_local()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Draining checkpoint %s to %s failed", sub_dir, self.durable_dir)
+            finally:
+                self._queue.task_done()
+
+    def _drain(self, sub_dir):
+        local_path = self.local_path(sub_dir)
+        durable_path = os.path.join(self.durable_dir, sub_dir)
+        drained_dir = os.path.join(durable_path, DRAINED_DIR)
+        os.makedirs(drained_dir, exist_ok=True)
+        with open(os.path.join(local_path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+
+        start = time.monotonic()
+        # Rank 0's files hold the deduplicated replicated state every rank loads
+        names = sorted(manifest["files"], key=lambda name: (not name.startswith("__0_"), name))
+        copied = sum(
+            _rate_limited_copy(os.path.join(local_path, name), os.path.join(durable_path, name),
+                               self.drain_bytes_per_sec)
+            for name in names
+        )
+        open(os.path.join(drained_dir, f"node{self.node_rank}"), "w").close()
+        # Recorded locally too: checkpoint retention may delete the durable copy, marker included
+        open(os.path.join(local_path, DRAINED_FILE), "w").close()
+        elapsed = time.monotonic() - start
+        logger.info("Drained %s from node %d: %.1f GB in %.0fs (%.0f MB/s)", sub_dir, self.node_rank,
+                    copied / 1024**3, elapsed, copied / 1024**2 / max(elapsed, 1e-9))
+
+        if self.node_rank != 0:
+            return
+        deadline = time.monotonic() + self.drain_timeout
+        while len(os.listdir(drained_dir)) < manifest["num_nodes"]:
+            if time.monotonic() > deadline:
+                logger.warning("Not all nodes drained %s within %ds; durable copy left incomplete",
+                               sub_dir, self.drain_timeout)
+                return
+            time.sleep(5)
+        _rate_limited_copy(os.path.join(local_path, METADATA_FILE), os.path.join(durable_path, METADATA_FILE), 0)
+        if self.catalog is not None:
+            _rate_limited_copy(os.path.join(local_path, CATALOG_FILE), os.path.join(durable_path, CATALOG_FILE), 0)
+            self.catalog.publish(durable_path)
+        logger.info("Checkpoint %s is complete on durable storage", durable_path)
+
+    def _prune_local(self):
+        """Remove local checkpoints beyond keep_local that this node has drained."""
+        paths = sorted(glob.glob(os.path.join(self.local_dir, "*steps")), key=checkpoint_step)
+        for path in paths[:-self.keep_local] if self.keep_local else paths:
+            if os.path.exists(os.path.join(path, DRAINED_FILE)):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def wait(self):
+        """Block until this node has drained every committed checkpoint."""
+        if self._drainer is not None:
+            self._queue.join()
+
+    def finish(self):
+        self.wait()
+        if self._drainer is not None:
+            self._queue.put(None)
+            self._drainer.join()
+
+    def _usable_local_steps(self, model_type):
+        """Steps of complete local checkpoints that this rank could load."""
+        steps = []
+        for path in glob.glob(os.path.join(self.local_dir, f"{model_type}-*steps")):
+            manifest_path = os.path.join(path, MANIFEST_FILE)
+            if not os.path.exists(manifest_path):
+                continue
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest["world_size"] != dist.get_world_size():
+                continue
+            # With deduplicated saves, and HSDP in particular, a rank may load from
+            # files any other rank wrote: every file must be local or already drained
+            durable_path = os.path.join(self.durable_dir, os.path.basename(path))
+            if not all(os.path.exists(os.path.join(path, name)) or os.path.exists(os.path.join(durable_path, name))
+                       for name in _metadata_files(path)):
+                continue
+            steps.append(manifest["step"])
+        return steps
+
+    def resolve(self, model_type, durable_checkpoint):
+        """Pick the freshest checkpoint across tiers; every rank returns the same choice.
+
+        A local checkpoint is used when all ranks can load it and it is at
+        least as recent as durable_checkpoint (the newest complete durable
+        one, or None). Files a node does not hold locally are linked from the
+        durable copy.
+        """
+        all_steps = [None] * dist.get_world_size()
+        dist.all_gather_object(all_steps, self._usable_local_steps(model_type))
+        common = set.intersection(*(set(steps) for steps in all_steps))
+        durable_step = checkpoint_step(durable_checkpoint) if durable_checkpoint else -1
+        if not common or max(common) < durable_step:
+            return durable_checkpoint
+
+        sub_dir = f"{model_type}-{max(common)}steps"
+        local_path = self.local_path(sub_dir)
+        if self.local_rank == 0:
+            durable_path = os.path.join(self.durable_dir, sub_dir)
+            for source in glob.glob(os.path.join(durable_path, "__*.distcp")):
+                target = os.path.join(local_path, os.path.basename(source))
+                if not os.path.exists(target):
+                    os.symlink(source, target)
+        dist.barrier()
+        if dist.get_rank() == 0:
+            logger.info("Resuming from local checkpoint %s (durable: %s)", local_path, durable_checkpoint)
+        return local_path
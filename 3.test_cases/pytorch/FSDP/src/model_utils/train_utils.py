@@ -8,6 +8,7 @@ import numpy as np
 import torch
 import torch.distributed as dist
 from torch.utils.data import DataLoader
+from torchdata.stateful_dataloader import StatefulDataLoader
 from datetime import datetime
 import tqdm
 import logging
@@ -16,6 +17,8 @@ from transformers import AutoTokenizer
 from datasets import load_dataset
 
 from model_utils.concat_dataset import ConcatTokensDataset
+from model_utils.memmap_dataset import MemmapTokenDataset
+from model_utils.packing import collate_packed
 
 from transformers import LlamaForCausalLM, LlamaTokenizer, LlamaConfig
 from transformers.models.llama.modeling_llama import LlamaDecoderLayer
@@ -503,15 +506,42 @@ def create_streaming_dataloader(dataset,
                       batch_size=1,
                       max_context_width=4096,
                       workers=4,
-                      split=None):
+                      split=None,
+                      document_masking=False):
     print(f"dataset={dataset}, name={name}")
     tokenizer = AutoTokenizer.from_pretrained(tokenizer,legacy=False)
     data = load_dataset(dataset, name=name, streaming=True, split=split).shuffle(42+global_rank)
-    train_concat_dataset = ConcatTokensDataset(data, tokenizer, max_context_width, True)
-    train_dataloader = DataLoader(train_concat_dataset,
+    # Yielded samples are views into a ring that must outlive one collated batch
+    train_concat_dataset = ConcatTokensDataset(data, tokenizer, max_context_width, True,
+                                               ring_windows=max(64, 2 * batch_size),
+                                               document_masking=document_masking)
+    # StatefulDataLoader collects the dataset state of every worker, so the
+    # data position can be checkpointed with the model
+    train_dataloader = StatefulDataLoader(train_concat_dataset,
                                        batch_size=batch_size,
                                        num_workers=workers,
                                        pin_memory=True,
                                        prefetch_factor=4,
-                                       timeout=600)
+                                       timeout=600,
+                                       collate_fn=collate_packed if document_masking else None)
     return train_dataloader
+
+def create_memmap_dataloader(data_dir,
+                      global_rank=0,
+                      world_size=1,
+                      batch_size=1,
+                      max_context_width=4096,
+                      workers=2,
+                      seed=42,
+                      document_masking=False):
+    print(f"memmap dataset={data_dir}")
+    dataset = MemmapTokenDataset(data_dir, max_context_width, global_rank, world_size, seed,
+                                 document_masking=document_masking, num_workers=workers)
+    dataloader = StatefulDataLoader(dataset,
+                            batch_size=batch_size,
+                            num_workers=workers,
+                            pin_memory=True,
+                            prefetch_factor=4 if workers else None,
+                            persistent_workers=workers > 0,
+                            collate_fn=collate_packed if document_masking else None)
+    return dataloader
@@ -0,0 +1,142 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""Tokenize a HuggingFace text dataset once into memory-mapped token shards.
+
+The output directory is read by train.py with --dataset_format=memmap:
+
+    python pretokenize.py --dataset allenai/c4 --dataset_config_name en \
+        --tokenizer hf-internal-testing/llama-tokenizer --split train \
+        --output_dir /fsx/data/c4-llama/train --num_proc 32
+"""
+
+import argparse
+import itertools
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+from datasets import load_dataset
+from transformers import AutoTokenizer
+
+from model_utils.memmap_dataset import TokenShardWriter, token_dtype
+
+logging.basicConfig(format="%(asctime)s [%(levelname)s] %(name)s: %(message)s", level=logging.INFO, stream=sys.stdout)
+
+logger = logging.getLogger(__name__)
+
+_tokenizer = None
+
+
+def _init_worker(tokenizer_name):
+    global _tokenizer
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    _tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, legacy=False)
+    # Documents are not truncated, so silence the sequence length warning
+    _tokenizer.model_max_length = sys.maxsize
+
+
+def _tokenize_batch(texts):
+    """Tokenize a batch of documents into one flat array, each document followed by EOS."""
+    encoded = _tokenizer(texts, padding=False, truncation=False)["input_ids"]
+    eos = [_tokenizer.eos_token_id]
+    return np.fromiter(itertools.chain.from_iterable(ids + eos for ids in encoded), dtype=np.int64)
+
+
+def _batches(data, text_field, batch_size, max_samples=None):
+    samples = (sample[text_field] for sample in data)
+    if max_samples:
+        samples = itertools.islice(samples, max_samples)
+    while True:
+        batch = list(itertools.islice(samples, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _bounded_imap(pool, func, iterable, window):
+    """Pool.imap that reads at most window items of iterable ahead of the results.
+
+    Pool's task feeder drains its input without backpressure, which would
+    pull a whole streamed dataset into memory.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, window))
+        if not chunk:
+            return
+        yield from pool.imap(func, chunk, chunksize=1)
+
+
+def pretokenize(args):
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, legacy=False)
+    vocab_size = len(tokenizer)
+    dtype = token_dtype(vocab_size)
+    data = load_dataset(args.dataset, name=args.dataset_config_name, split=args.split, streaming=True)
+
+    writer = TokenShardWriter(
+        args.output_dir,
+        dtype,
+        args.shard_tokens,
+        metadata={
+            "dataset": args.dataset,
+            "dataset_config_name": args.dataset_config_name,
+            "split": args.split,
+            "tokenizer": args.tokenizer,
+            "vocab_size": vocab_size,
+            "eos_token_id": tokenizer.eos_token_id,
+        },
+    )
+    logger.info("Writing %s tokens of %s/%s to %s", np.dtype(dtype).name, args.dataset, args.split, args.output_dir)
+
+    start = time.time()
+    num_tokens = 0
+    batches = _batches(data, args.text_field, args.batch_size, args.max_samples)
+    if args.num_proc > 1:
+        import multiprocessing
+
+        pool = multiprocessing.get_context("spawn").Pool(args.num_proc, _init_worker, (args.tokenizer,))
+        # imap keeps document order, so the output is identical for any --num_proc
+        results = _bounded_imap(pool, _tokenize_batch, batches, 4 * args.num_proc)
+    else:
+        pool = None
+        _init_worker(args.tokenizer)
+        results = map(_tokenize_batch, batches)
+
+    try:
+        for batch_idx, tokens in enumerate(results, 1):
+            writer.write(tokens)
+            num_tokens += len(tokens)
+            if batch_idx % 100 == 0:
+                elapsed = time.time() - start
+                logger.info("%d batches, %d tokens, %.0f tokens/sec", batch_idx, num_tokens, num_tokens / elapsed)
+            if args.max_tokens and num_tokens >= args.max_tokens:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    index = writer.close()
+    logger.info("Wrote %d tokens in %d shards in %.0fs", index["total_tokens"], len(index["shards"]), time.time() - start)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pre-tokenize a dataset into memory-mapped token shards")
+    parser.add_argument("--dataset", type=str, default="allenai/c4")
+    parser.add_argument("--dataset_config_name", type=str, default="en")
+    parser.add_argument("--split", type=str, default="train")
+    parser.add_argument("--text_field", type=str, default="text")
+    parser.add_argument("--tokenizer", type=str, default="EleutherAI/gpt-neox-20b")
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--num_proc", type=int, default=os.cpu_count(), help="tokenizer processes")
+    parser.add_argument("--batch_size", type=int, default=1000, help="documents per tokenizer call")
+    parser.add_argument("--shard_tokens", type=int, default=2**30, help="tokens per shard file")
+    parser.add_argument("--max_samples", type=int, default=None, help="stop after this many documents")
+    parser.add_argument("--max_tokens", type=int, default=None, help="stop after this many tokens")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    pretokenize(parse_args())
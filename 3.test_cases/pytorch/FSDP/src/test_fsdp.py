@@ -0,0 +1,124 @@
+import pytest
+
+pytest.importorskip("torch")
+
+import types
+
+import numpy as np
+
+import model_utils.memmap_dataset as memmap_dataset
+from model_utils.memmap_dataset import MemmapTokenDataset, TokenShardWriter
+from model_utils.packing import IGNORE_INDEX, collate_packed, packed_sample
+
+EOS = 0
+
+
+class WhitespaceTokenizer:
+    """Reads documents such as "3 1 4" as their token ids."""
+
+    eos_token_id = EOS
+
+    def __call__(self, texts, **kwargs):
+        return {"input_ids": [[int(token) for token in text.split()] for text in texts]}
+
+
+def documents(*docs):
+    return [{"text": " ".join(str(token) for token in doc)} for doc in docs]
+
+
+@pytest.fixture
+def concat_dataset():
+    pytest.importorskip("datasets")
+    pytest.importorskip("transformers")
+    from model_utils.concat_dataset import ConcatTokensDataset
+    return ConcatTokensDataset
+
+
+def packed(dataset):
+    # Yielded sequences are views into a ring buffer that is reused
+    return [sequence.tolist() for sequence in dataset]
+
+
+def test_concat_dataset_packs_documents_across_batches(concat_dataset):
+    docs = documents([1, 2, 3], [4, 5], [6, 7, 8, 9])
+    dataset = concat_dataset(docs, WhitespaceTokenizer(), max_length=4, wrap=True,
+                             tokenizer_batch_size=2, ring_windows=2)
+    assert packed(dataset) == [[1, 2, 3, EOS], [4, 5, EOS, 6], [7, 8, 9, EOS]]
+
+    # Without wrapping, the rest of the document that completes a sequence is dropped
+    dataset = concat_dataset(docs, WhitespaceTokenizer(), max_length=4, wrap=False,
+                             tokenizer_batch_size=2, ring_windows=2)
+    assert packed(dataset) == [[1, 2, 3, EOS], [4, 5, EOS, 6]]
+
+
+def test_concat_dataset_resumes_at_saved_position(concat_dataset):
+    docs = documents(*[list(range(1, 2 + i % 5)) for i in range(20)])
+
+    def dataset():
+        return concat_dataset(docs, WhitespaceTokenizer(), max_length=5, wrap=True,
+                              tokenizer_batch_size=3, ring_windows=2)
+
+    expected = packed(dataset())
+    for consumed in (1, 4, len(expected) - 1):
+        first = dataset()
+        stream = iter(first)
+        for _ in range(consumed):
+            next(stream)
+        resumed = dataset()
+        resumed.load_state_dict(first.state_dict())
+        assert packed(resumed) == expected[consumed:]
+
+
+def test_collate_packed_delimits_documents():
+    first = packed_sample(np.array([5, 6, EOS, 7, EOS, 8, 9, 10]), EOS)
+    assert first["position_ids"].tolist() == [0, 1, 2, 0, 1, 0, 1, 2]
+    assert first["cu_seqlens"].tolist() == [0, 3, 5, 8]
+
+    batch = collate_packed([first, packed_sample(np.array([1, 2, 3, EOS]), EOS)])
+    assert batch["cu_seq_lens_q"].tolist() == [0, 3, 5, 8, 12]
+    assert batch["max_length_q"] == 4
+    assert batch["input_ids"].tolist() == [[5, 6, EOS, 7, EOS, 8, 9, 10, 1, 2, 3, EOS]]
+    # The first token of every document is not predicted from the previous one
+    ignore = IGNORE_INDEX
+    assert batch["labels"].tolist() == [[ignore, 6, EOS, ignore, EOS, ignore, 9, 10, ignore, 2, 3, EOS]]
+
+
+def token_dir(tmp_path, num_tokens=250, shard_tokens=40):
+    # Every token is its position in the stream, so a window is known by its first token
+    writer = TokenShardWriter(str(tmp_path), np.uint32, shard_tokens)
+    writer.write(np.arange(num_tokens))
+    writer.close()
+    return str(tmp_path)
+
+
+def test_memmap_dataset_streams_yield_equal_disjoint_windows(tmp_path, monkeypatch):
+    data_dir = token_dir(tmp_path)  # 62 windows of 4 tokens
+    world_size, num_workers = 3, 2
+    streams = []
+    for rank in range(world_size):
+        for worker_id in range(num_workers):
+            # Every dataloader worker iterates its own copy of the dataset
+            dataset = MemmapTokenDataset(data_dir, 4, rank, world_size, num_workers=num_workers)
+            monkeypatch.setattr(memmap_dataset, "get_worker_info",
+                                lambda: types.SimpleNamespace(num_workers=num_workers, id=worker_id))
+            streams.append([int(window[0]) for window in dataset])
+        assert len(dataset) == 20
+    # 62 windows over 6 streams: the 2 last of the epoch's order are dropped
+    assert [len(stream) for stream in streams] == [10] * 6
+    starts = [start for stream in streams for start in stream]
+    assert len(set(starts)) == len(starts)
+    assert set(starts) <= set(range(0, 248, 4))
+
+
+def test_memmap_dataset_resumes_in_the_same_order(tmp_path):
+    data_dir = token_dir(tmp_path)
+    expected = [window.tolist() for window in MemmapTokenDataset(data_dir, 4, 1, 3)]
+    assert len(expected) == 20
+
+    first = MemmapTokenDataset(data_dir, 4, 1, 3)
+    stream = iter(first)
+    for _ in range(7):
+        next(stream)
+    resumed = MemmapTokenDataset(data_dir, 4, 1, 3)
+    resumed.load_state_dict(first.state_dict())
+    assert [window.tolist() for window in resumed] == expected[7:]
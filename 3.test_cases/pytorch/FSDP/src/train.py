@@ -3,7 +3,7 @@
 
 import functools
 import math
-import time
+import os
 
 import torch
 from torch import optim
@@ -13,6 +13,7 @@ import torch.utils.data
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from datasets import load_dataset
 
+from torch.distributed.device_mesh import init_device_mesh
 from torch.distributed.fsdp import fully_shard, MixedPrecisionPolicy, CPUOffloadPolicy
 from torch.utils.data import DataLoader
 
@@ -20,8 +21,12 @@ from model_utils.train_utils import (get_model_config,
                                    compute_num_params,
                                    get_transformer_layer,
                                    get_learning_rate_scheduler,
-                                   create_streaming_dataloader)
-from model_utils.checkpoint import save_checkpoint, load_checkpoint
+                                   create_streaming_dataloader,
+                                   create_memmap_dataloader)
+from model_utils.checkpoint import save_checkpoint, load_checkpoint, AsyncCheckpointer
+from model_utils.tiered_checkpoint import TieredCheckpointer
+from model_utils.checkpoint_catalog import CheckpointCatalog
+from model_utils.step_metrics import StepMetrics, gpu_peak_tflops, model_flops_per_token, summarize
 from model_utils.arguments import parse_args
 
 import logging
@@ -33,6 +38,13 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+def compute_loss(model, input_data):
+    """Forward pass for either a plain token batch or a packed varlen batch."""
+    if isinstance(input_data, dict):
+        # Packed documents: position ids and cu_seq_lens keep them from attending to each other
+        return model(**input_data)["loss"]
+    return model(input_ids=input_data, attention_mask=None, labels=input_data)["loss"]
+
 def eval_model(model, dataloader, num_batches):
     """Eval step."""
     model = model.eval()
@@ -44,7 +56,7 @@ def eval_model(model, dataloader, num_batches):
             if batch_idx >= num_batches:
                 break
 
-            loss += model(input_ids=input_data, attention_mask=None, labels=input_data)["loss"]
+            loss += compute_loss(model, input_data)
             n_batches += 1
 
     if n_batches > 0:
@@ -71,35 +83,63 @@ def train(
         global_rank,
         world_size,
         total_steps=0,
-        start_batch_index=0
+        start_batch_index=0,
+        dataloader_restored=False,
+        checkpointer=None,
+        tiered=None,
+        catalog=None
     ):
     model.train()
+    checkpoint_stalls = []
+    metrics = StepMetrics(model_flops_per_token(model_config, num_params, args.max_context_width),
+                          peak_tflops=args.gpu_peak_tflops or gpu_peak_tflops(),
+                          report_every=args.logging_freq)
     for index in range(args.epochs):
-        for batch_idx, input_data in enumerate(train_dataloader):
+        # A restored dataloader already continues at start_batch_index
+        first_batch = start_batch_index if dataloader_restored else 0
+        for batch_idx, input_data in enumerate(train_dataloader, start=first_batch):
             if batch_idx < start_batch_index:
                 continue
+            num_tokens = input_data["input_ids"].numel() if isinstance(input_data, dict) else input_data.numel()
+            metrics.start(num_tokens)
             optimizer.zero_grad(set_to_none=True)
-            step_start = time.time()
-            loss = model(input_ids=input_data, attention_mask=None, labels=input_data)["loss"]
+            loss = compute_loss(model, input_data)
+            metrics.mark()
             loss.backward()
+            metrics.mark()
             torch.nn.utils.clip_grad_norm_(model.parameters(), args.grad_clip)
+            metrics.mark()
             optimizer.step()
             lr_scheduler.step()
+            metrics.mark()
+            metrics.end(loss)
             total_steps += 1
-            loss_metric = loss.item()
-            step_time = time.time() - step_start
-            sample_processed = input_data.shape[0] * world_size
-            throughput = sample_processed / step_time
-            loss_scalar = loss.item()
-            current_lr = lr_scheduler.get_lr()
-            if global_rank==0 and batch_idx%args.logging_freq==0:
-                logger.info(
-                    "Batch %d Loss: %.5f, Speed: %.2f samples/sec, lr: %.6f",
-                    batch_idx,
-                    loss_scalar,
-                    throughput,
-                    current_lr,
-                )
+            if metrics.ready():
+                # The only host sync of the window
+                summary = summarize(metrics.report())
+                if global_rank == 0:
+                    mean = summary["mean"]
+                    mfu = metrics.mfu(summary["tokens_per_sec"] / world_size)
+                    logger.info(
+                        "Batch %d Loss: %.5f, Speed: %.2f samples/sec, lr: %.6f",
+                        batch_idx,
+                        mean["loss"],
+                        summary["tokens_per_sec"] / args.max_context_width,
+                        lr_scheduler.get_lr(),
+                    )
+                    logger.info(
+                        "Step %.1f ms (data wait %.1f, GPU idle %.1f, forward %.1f, backward %.1f, "
+                        "collective %.1f, optimizer %.1f), %.0f tokens/sec, MFU %s",
+                        mean["step"], mean["data"], mean["idle"], mean["forward"], mean["backward"],
+                        mean["collective"], mean["optimizer"], summary["tokens_per_sec"],
+                        f"{mfu:.1%}" if mfu is not None else "n/a (set --gpu_peak_tflops)",
+                    )
+                    logger.info(
+                        "Straggler rank %d: other ranks waited %.1f ms/step for it, %s-bound "
+                        "(data wait %.1f ms vs median %.1f ms)",
+                        summary["straggler"], summary["waited"], summary["straggler_cause"],
+                        summary["straggler_data"], summary["median_data"],
+                    )
             if args.validation_freq and not total_steps % args.validation_freq:
                 val_loss, val_ppl = eval_model(
                     model, val_dataloader, args.validation_batches
@@ -111,6 +151,7 @@ def train(
                             batch_idx,
                             val_loss,
                         )
+                metrics.interrupt()
             if args.checkpoint_dir and not total_steps % args.checkpoint_freq:
                 user_content = {
                     "cli_args": args.__dict__,
@@ -121,36 +162,50 @@ def train(
                 }
                 sub_dir = f"{args.model_type}-{total_steps}steps"
 
-                save_checkpoint(
+                checkpoint_stalls.append(save_checkpoint(
                     model,
                     optimizer,
                     lr_scheduler,
                     user_content,
                     args.checkpoint_dir,
                     sub_dir,
-                )
+                    train_dataloader,
+                    checkpointer,
+                    tiered,
+                    catalog,
+                ))
+                metrics.interrupt()
             if total_steps >= args.max_steps:
                 break
+        start_batch_index = 0
+        dataloader_restored = False
+    if global_rank == 0 and checkpoint_stalls:
+        logger.info(
+            "Checkpoint stall (%s): %.2fs mean, %.2fs total over %d checkpoints",
+            "tiered" if tiered else "async" if checkpointer else "blocking",
+            sum(checkpoint_stalls) / len(checkpoint_stalls),
+            sum(checkpoint_stalls),
+            len(checkpoint_stalls),
+        )
             
 
-def main(args):
-    dist.init_process_group()
-    global_rank = dist.get_rank()
-    device = global_rank % torch.cuda.device_count()
-    world_size = dist.get_world_size()
-    
-    if args.bf16:
-        dtype = torch.bfloat16
-    else:
-        dtype = torch.get_default_dtype()
-    
-    model_config = get_model_config(args)
-    if global_rank == 0:
-        logger.info("Creating Model with FSDP2")
-    
+def build_model(args, model_config, global_rank, world_size, mesh=None):
+    """Create the model on the meta device and shard it with FSDP2.
+
+    With --sharding_strategy=hybrid, parameters are sharded within groups of
+    --hsdp_shard_size ranks (a node by default) and replicated across them,
+    on mesh if one is given or on a new device mesh otherwise.
+    Returns the model and its number of parameters.
+    """
+    model_kwargs = {}
+    if args.document_masking:
+        if not args.bf16:
+            raise ValueError("--document_masking uses flash-attention varlen kernels, which require --bf16=1")
+        model_kwargs["attn_implementation"] = "flash_attention_2"
+
     # Initialize model on meta device
     with torch.device("meta"):
-        model = AutoModelForCausalLM.from_config(model_config)
+        model = AutoModelForCausalLM.from_config(model_config, **model_kwargs)
     
     num_params = compute_num_params(model)
     if global_rank == 0:
@@ -161,7 +216,7 @@ def main(args):
     transformer_layer = get_transformer_layer(args.model_type)
 
     # Configure FSDP2 options
-    fsdp_kwargs = {}
+    fsdp_kwargs = {"reshard_after_forward": bool(args.reshard_after_forward)}
     
     # Mixed precision policy
     if args.bf16:
@@ -171,12 +226,17 @@ def main(args):
         )
     
     # Sharding strategy
-    if args.sharding_strategy == "full":
-        fsdp_kwargs["reshard_after_forward"] = True
+    if args.sharding_strategy == "hybrid" and mesh is not None:
+        fsdp_kwargs["mesh"] = mesh
     elif args.sharding_strategy == "hybrid":
-        # For hybrid sharding, need 2D device mesh
-        fsdp_kwargs["reshard_after_forward"] = True
-    else:
+        # 2D mesh: replicate across groups, shard within a group
+        shard_size = args.hsdp_shard_size or int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+        if world_size % shard_size:
+            raise ValueError(f"--hsdp_shard_size={shard_size} does not divide the world size {world_size}")
+        fsdp_kwargs["mesh"] = init_device_mesh(
+            "cuda", (world_size // shard_size, shard_size), mesh_dim_names=("replicate", "shard")
+        )
+    elif args.sharding_strategy != "full":
         raise NotImplementedError("Available sharding strategies are full and hybrid")
     
     # CPU offload
@@ -184,12 +244,18 @@ def main(args):
         fsdp_kwargs["offload_policy"] = CPUOffloadPolicy()
     
     # Apply fully_shard to transformer layers first
-    for module in model.modules():
-        if isinstance(module, transformer_layer):
-            fully_shard(module, **fsdp_kwargs)
+    layers = [module for module in model.modules() if isinstance(module, transformer_layer)]
+    for module in layers:
+        fully_shard(module, **fsdp_kwargs)
     
     # Apply fully_shard to root model
     fully_shard(model, **fsdp_kwargs)
+
+    if args.prefetch_depth > 0:
+        # Explicitly prefetch the all-gathers of the next layers, in place of the implicit one
+        for i, layer in enumerate(layers):
+            layer.set_modules_to_forward_prefetch(layers[i + 1:i + 1 + args.prefetch_depth])
+            layer.set_modules_to_backward_prefetch(layers[max(0, i - args.prefetch_depth):i][::-1])
     
     # Move model from meta device to CUDA
     model.to_empty(device=torch.device("cuda"))
@@ -203,7 +269,11 @@ def main(args):
             apply_activation_checkpointing,
             checkpoint_wrapper,
         )
-        check_fn = lambda submodule: isinstance(submodule, transformer_layer)
+        # Selective checkpointing: a fraction of the layers, spread evenly
+        ratio = args.activation_checkpointing_ratio
+        checkpointed = {id(layer) for i, layer in enumerate(layers)
+                        if math.floor((i + 1) * ratio) > math.floor(i * ratio)}
+        check_fn = lambda submodule: id(submodule) in checkpointed
         wrapper_fn = functools.partial(
             checkpoint_wrapper, checkpoint_impl=CheckpointImpl.NO_REENTRANT
         )
@@ -215,6 +285,26 @@ def main(args):
         from torch.distributed.algorithms._checkpoint.checkpoint_wrapper import offload_wrapper
         model = offload_wrapper(model)
 
+    return model, num_params
+
+
+def main(args):
+    dist.init_process_group()
+    global_rank = dist.get_rank()
+    device = global_rank % torch.cuda.device_count()
+    world_size = dist.get_world_size()
+    
+    if args.bf16:
+        dtype = torch.bfloat16
+    else:
+        dtype = torch.get_default_dtype()
+    
+    model_config = get_model_config(args)
+    if global_rank == 0:
+        logger.info("Creating Model with FSDP2")
+    
+    model, num_params = build_model(args, model_config, global_rank, world_size)
+
     # Optimizer with DTensor parameters
     optimizer = optim.AdamW(
         model.parameters(), 
@@ -228,6 +318,57 @@ def main(args):
 
     lr_scheduler = get_learning_rate_scheduler(optimizer, args)
 
+    if args.dataset_format == "memmap":
+        train_dataloader = create_memmap_dataloader(os.path.join(args.dataset, "train"),
+                                                    global_rank=global_rank,
+                                                    world_size=world_size,
+                                                    batch_size=args.train_batch_size,
+                                                    max_context_width=args.max_context_width,
+                                                    seed=args.seed,
+                                                    document_masking=bool(args.document_masking))
+
+        val_dataloader = create_memmap_dataloader(os.path.join(args.dataset, "validation"),
+                                                  global_rank=global_rank,
+                                                  world_size=world_size,
+                                                  batch_size=args.val_batch_size,
+                                                  max_context_width=args.max_context_width,
+                                                  seed=args.seed,
+                                                  document_masking=bool(args.document_masking))
+        token_vocab_size = train_dataloader.dataset.index.get("vocab_size", 0)
+        if token_vocab_size > args.vocab_size:
+            raise ValueError(f"Token shards use a {token_vocab_size} token vocabulary but --vocab_size is {args.vocab_size}")
+    else:
+        train_dataloader = create_streaming_dataloader(args.dataset, 
+                                                       args.tokenizer, 
+                                                       name=args.dataset_config_name, 
+                                                       batch_size=args.train_batch_size, 
+                                                       max_context_width=args.max_context_width,
+                                                       split='train',
+                                                       document_masking=bool(args.document_masking))
+        
+        val_dataloader = create_streaming_dataloader(args.dataset, 
+                                                      args.tokenizer, 
+                                                      name=args.dataset_config_name, 
+                                                      batch_size=args.val_batch_size, 
+                                                      max_context_width=args.max_context_width,
+                                                      split='validation',
+                                                      document_masking=bool(args.document_masking))
+
+    catalog = CheckpointCatalog(keep_last=args.checkpoints_to_keep,
+                                keep_every=args.keep_checkpoint_every,
+                                verify=args.verify_checkpoint)
+    tiered = None
+    if args.local_checkpoint_dir:
+        if args.async_checkpoint and global_rank == 0:
+            logger.warning("--local_checkpoint_dir writes checkpoints synchronously to local storage; "
+                           "ignoring --async_checkpoint")
+        tiered = TieredCheckpointer(args.local_checkpoint_dir,
+                                    args.checkpoint_dir,
+                                    drain_mbps=args.checkpoint_drain_mbps,
+                                    keep_local=args.local_checkpoints_to_keep,
+                                    catalog=catalog)
+    checkpointer = AsyncCheckpointer(catalog) if args.async_checkpoint and tiered is None else None
+
     if args.resume_from_checkpoint:
         (
             model,
@@ -235,28 +376,21 @@ def main(args):
             lr_scheduler,
             total_steps,
             start_batch_index,
+            dataloader_restored,
         ) = load_checkpoint(model, 
                             optimizer, 
                             lr_scheduler, 
                             args.resume_from_checkpoint, 
                             args.model_type,
-                            device)
+                            device,
+                            train_dataloader,
+                            tiered,
+                            catalog)
     else:
         total_steps = 0
         start_batch_index = 0
-    
-    train_dataloader = create_streaming_dataloader(args.dataset, 
-                                                   args.tokenizer, 
-                                                   name=args.dataset_config_name, 
-                                                   batch_size=args.train_batch_size, 
-                                                   split='train')
-    
-    val_dataloader = create_streaming_dataloader(args.dataset, 
-                                                  args.tokenizer, 
-                                                  name=args.dataset_config_name, 
-                                                  batch_size=args.val_batch_size, 
-                                                  split='validation')
-    
+        dataloader_restored = False
+
     train(model, 
           optimizer, 
           train_dataloader,
@@ -268,7 +402,19 @@ def main(args):
           global_rank, 
           world_size,
           total_steps,
-          start_batch_index)
+          start_batch_index,
+          dataloader_restored,
+          checkpointer,
+          tiered,
+          catalog)
+
+    if checkpointer is not None:
+        # The last checkpoint must be on storage before the job exits
+        checkpointer.finish()
+    if tiered is not None:
+        # Drain the last local checkpoints to durable storage before exiting
+        tiered.finish()
+    catalog.finish()
   
     dist.destroy_process_group()
 
@@ -1,6 +1,30 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+"""Audit the performance-relevant settings of a PyTorch environment.
+
+Collects PyTorch backend flags (TF32, SDP backends, cuDNN), NCCL_* / FI_* and
+threading environment variables, CPU affinity, hugepages and NUMA settings into
+one JSON report. The report can be diffed against a golden profile for the
+instance type, or against the report of another container build, and settings
+known to cost throughput are flagged.
+
+Usage:
+    python pytorch-screen.py                                  # key=value listing and findings
+    python pytorch-screen.py --json -o node.json              # structured report
+    python pytorch-screen.py --write-profile profiles/p5.48xlarge.json
+    python pytorch-screen.py --profile profiles/              # diff against profiles/<instance>.json
+    python pytorch-screen.py --compare old-build.json         # diff against another report
+"""
+
+import argparse
+import glob
+import json
+import os
+import socket
+import sys
+from datetime import datetime, timezone
+
 import torch
 
 try:
@@ -10,36 +34,310 @@ try:
 except ModuleNotFoundError:
     pass
 
-print(f"{torch.cuda.is_available()=}")
-print(f"{torch.version.cuda=}")
-print(f"{torch.backends.cuda.is_built()=}")
-print(f"{torch.backends.cuda.matmul.allow_tf32=}")
-print(f"{torch.backends.cuda.matmul.allow_fp16_reduced_precision_reduction=}")
-print(f"{torch.backends.cuda.cufft_plan_cache=}")
-print(f"{torch.backends.cuda.preferred_linalg_library(backend=None)=}")
-print(f"{torch.backends.cuda.flash_sdp_enabled()=}")
-print(f"{torch.backends.cuda.math_sdp_enabled()=}")
-
-print(f"{torch.backends.cudnn.version()=}")
-print(f"{torch.backends.cudnn.is_available()=}")
-print(f"{torch.backends.cudnn.enabled=}")
-print(f"{torch.backends.cudnn.allow_tf32=}")
-print(f"{torch.backends.cudnn.deterministic=}")
-print(f"{torch.backends.cudnn.benchmark=}")
-print(f"{torch.backends.cudnn.benchmark_limit=}")
-
-print(f"{torch.backends.mkl.is_available()=}")
-print(f"{torch.backends.mkldnn.is_available()=}")
-
-print(f"{torch.backends.openmp.is_available()=}")
-try:
-    print(f"{torch.backends.opt_einsum.is_available()=}")
-    print(f"{torch.backends.opt_einsum.get_opt_einsum()=}")
-    print(f"{torch.backends.opt_einsum.enabled=}")
-    print(f"{torch.backends.opt_einsum.strategy=}")
-except AttributeError:
-    pass
+# Environment variables captured in the report, by prefix
+ENV_PREFIXES = ("NCCL_", "FI_", "TORCH_", "PYTORCH_", "CUDA_", "NVIDIA_TF32_", "OMP_", "MKL_", "KMP_", "GOMP_")
+
+# Environment variables that must match between builds even when the
+# golden profile does not list them
+DRIFT_ENV_PREFIXES = ("env.NCCL_", "env.FI_")
+
+# (setting, values that cost throughput, explanation)
+PERF_RULES = [
+    ("torch.cuda.matmul.allow_tf32", (False,),
+     "TF32 disabled for matmuls; FP32 GEMMs bypass tensor cores on Ampere and newer"),
+    ("torch.cudnn.allow_tf32", (False,),
+     "TF32 disabled for cuDNN convolutions"),
+    ("torch.float32_matmul_precision", ("highest",),
+     "float32 matmul precision is 'highest'; TF32 tensor cores are not used"),
+    ("torch.cudnn.deterministic", (True,),
+     "cuDNN restricted to deterministic algorithms"),
+    ("torch.deterministic_algorithms", (True,),
+     "torch.use_deterministic_algorithms(True) forces slower kernels"),
+    ("torch.cudnn.enabled", (False,),
+     "cuDNN disabled"),
+    ("torch.sdp.flash", (False,),
+     "Flash attention SDP backend disabled"),
+    ("torch.sdp.mem_efficient", (False,),
+     "Memory-efficient attention SDP backend disabled"),
+    ("env.NVIDIA_TF32_OVERRIDE", ("0",),
+     "NVIDIA_TF32_OVERRIDE=0 disables TF32 in cuBLAS/cuDNN regardless of the PyTorch flags"),
+    ("env.CUDA_LAUNCH_BLOCKING", ("1",),
+     "Kernel launches are synchronous"),
+    ("env.NCCL_DEBUG", ("TRACE",),
+     "NCCL trace logging on the hot path"),
+    ("env.NCCL_P2P_DISABLE", ("1",),
+     "NVLink/PCIe peer-to-peer disabled for NCCL"),
+    ("env.NCCL_SHM_DISABLE", ("1",),
+     "NCCL shared memory transport disabled"),
+    ("env.NCCL_NET_GDR_LEVEL", ("0", "LOC"),
+     "GPUDirect RDMA disabled for NCCL"),
+    ("env.NCCL_BLOCKING_WAIT", ("1",),
+     "Host blocks on every NCCL collective"),
+    ("env.TORCH_NCCL_BLOCKING_WAIT", ("1",),
+     "Host blocks on every NCCL collective"),
+    ("env.FI_EFA_USE_DEVICE_RDMA", ("0",),
+     "EFA device RDMA disabled; GPU buffers are staged through host memory"),
+    ("env.FI_PROVIDER", ("tcp", "sockets", "tcp;ofi_rxm"),
+     "Libfabric uses a TCP provider instead of EFA"),
+    ("numa.balancing", (1,),
+     "Automatic NUMA balancing migrates pages of pinned training processes"),
+]
+
+
+def _read(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def _bracketed(value):
+    """Return the selected entry of a sysfs choice such as 'always [madvise] never'."""
+    if value and "[" in value:
+        return value[value.index("[") + 1:value.index("]")]
+    return value
+
+
+def _cpu_ranges(cpus):
+    """Format a CPU set as a cpulist string, e.g. {0, 1, 2, 5} -> '0-2,5'."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(f"{a}-{b}" if a != b else f"{a}" for a, b in ranges)
+
+
+def _parse_cpulist(text):
+    cpus = set()
+    for part in (text or "").split(","):
+        if "-" in part:
+            a, b = part.split("-")
+            cpus.update(range(int(a), int(b) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+
+def _safe(fn, default=None):
+    try:
+        return fn()
+    except (AttributeError, RuntimeError, TypeError):
+        return default
+
+
+def instance_type():
+    """EC2 instance type from DMI (no metadata service call), or 'unknown'."""
+    return os.environ.get("INSTANCE_TYPE") or _read("/sys/devices/virtual/dmi/id/product_name", "unknown")
+
+
+def collect_torch():
+    cuda = torch.backends.cuda
+    cudnn = torch.backends.cudnn
+    settings = {
+        "version": torch.__version__,
+        "cuda.available": torch.cuda.is_available(),
+        "cuda.version": torch.version.cuda,
+        "cuda.device_count": torch.cuda.device_count(),
+        "cuda.device_name": _safe(lambda: torch.cuda.get_device_name(0)) if torch.cuda.is_available() else None,
+        "cuda.capability": _safe(lambda: ".".join(map(str, torch.cuda.get_device_capability(0))))
+        if torch.cuda.is_available() else None,
+        "cuda.matmul.allow_tf32": cuda.matmul.allow_tf32,
+        "cuda.matmul.allow_fp16_reduced_precision_reduction": cuda.matmul.allow_fp16_reduced_precision_reduction,
+        "cuda.matmul.allow_bf16_reduced_precision_reduction":
+            _safe(lambda: cuda.matmul.allow_bf16_reduced_precision_reduction),
+        "cuda.preferred_linalg_library": str(_safe(lambda: cuda.preferred_linalg_library(backend=None))),
+        "float32_matmul_precision": _safe(torch.get_float32_matmul_precision),
+        "sdp.flash": _safe(cuda.flash_sdp_enabled),
+        "sdp.mem_efficient": _safe(cuda.mem_efficient_sdp_enabled),
+        "sdp.math": _safe(cuda.math_sdp_enabled),
+        "sdp.cudnn": _safe(lambda: cuda.cudnn_sdp_enabled()),
+        "cudnn.version": cudnn.version(),
+        "cudnn.available": cudnn.is_available(),
+        "cudnn.enabled": cudnn.enabled,
+        "cudnn.allow_tf32": cudnn.allow_tf32,
+        "cudnn.deterministic": cudnn.deterministic,
+        "cudnn.benchmark": cudnn.benchmark,
+        "cudnn.benchmark_limit": _safe(lambda: cudnn.benchmark_limit),
+        "deterministic_algorithms": torch.are_deterministic_algorithms_enabled(),
+        "num_threads": torch.get_num_threads(),
+        "num_interop_threads": torch.get_num_interop_threads(),
+        "mkl.available": torch.backends.mkl.is_available(),
+        "mkldnn.available": torch.backends.mkldnn.is_available(),
+        "openmp.available": torch.backends.openmp.is_available(),
+        "distributed.available": torch.distributed.is_available(),
+        "distributed.mpi_available": _safe(torch.distributed.is_mpi_available, False),
+        "distributed.nccl_available": _safe(torch.distributed.is_nccl_available, False),
+        "nccl.version": _safe(lambda: ".".join(map(str, torch.cuda.nccl.version()))),
+    }
+    return settings
+
+
+def collect_env():
+    return {key: value for key, value in sorted(os.environ.items()) if key.startswith(ENV_PREFIXES)}
+
+
+def collect_cpu():
+    affinity = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else set()
+    return {
+        "count": os.cpu_count(),
+        "affinity": _cpu_ranges(affinity),
+        "affinity_count": len(affinity),
+        "governor": _read("/sys/devices/system/cpu/cpu0/cpufreq/scaling_governor"),
+    }
+
+
+def collect_memory():
+    meminfo = {}
+    for line in (_read("/proc/meminfo", "") or "").splitlines():
+        key, _, value = line.partition(":")
+        meminfo[key] = value.strip()
+    return {
+        "transparent_hugepage.enabled": _bracketed(_read("/sys/kernel/mm/transparent_hugepage/enabled")),
+        "transparent_hugepage.defrag": _bracketed(_read("/sys/kernel/mm/transparent_hugepage/defrag")),
+        "hugepages.total": int(meminfo["HugePages_Total"]) if "HugePages_Total" in meminfo else None,
+        "hugepages.size": meminfo.get("Hugepagesize"),
+    }
+
+
+def collect_numa():
+    affinity = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else set()
+    nodes = sorted(glob.glob("/sys/devices/system/node/node[0-9]*"), key=lambda p: int(p.rsplit("node", 1)[1]))
+    spanned = [
+        int(path.rsplit("node", 1)[1]) for path in nodes
+        if _parse_cpulist(_read(os.path.join(path, "cpulist"))) & affinity
+    ]
+    balancing = _read("/proc/sys/kernel/numa_balancing")
+    return {
+        "nodes": len(nodes),
+        "affinity_nodes": ",".join(map(str, spanned)),
+        "balancing": int(balancing) if balancing is not None else None,
+    }
+
+
+def collect_report():
+    """Collect every audited setting into one report."""
+    return {
+        "hostname": socket.gethostname(),
+        "instance_type": instance_type(),
+        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "settings": {
+            "torch": collect_torch(),
+            "env": collect_env(),
+            "cpu": collect_cpu(),
+            "memory": collect_memory(),
+            "numa": collect_numa(),
+        },
+    }
+
+
+def flatten(settings):
+    """Flatten report settings to {'torch.cudnn.benchmark': False, 'env.NCCL_DEBUG': 'INFO', ...}."""
+    return {f"{group}.{key}": value for group, values in settings.items() for key, value in values.items()}
+
+
+def check_rules(flat):
+    """Return findings for settings known to cost throughput."""
+    findings = []
+    for key, bad_values, message in PERF_RULES:
+        if key in flat and flat[key] in bad_values:
+            findings.append({"setting": key, "value": flat[key], "message": message})
+
+    threads = flat.get("torch.num_threads")
+    cpus = flat.get("cpu.affinity_count")
+    if threads and cpus and threads > cpus:
+        findings.append({"setting": "torch.num_threads", "value": threads,
+                         "message": f"{threads} intra-op threads oversubscribe the {cpus} CPUs this process may use"})
+    if "env.OMP_NUM_THREADS" not in flat and flat.get("torch.cuda.device_count", 0) > 1:
+        findings.append({"setting": "env.OMP_NUM_THREADS", "value": None,
+                         "message": "OMP_NUM_THREADS unset; every rank on the node starts a thread per core"})
+    return findings
+
+
+def diff_settings(expected, actual, strict_prefixes=()):
+    """Compare flattened settings; a None expectation means the setting must be unset.
+
+    Keys missing from `expected` are only compared when they start with one of
+    strict_prefixes, so a partial golden profile still catches new NCCL/FI
+    variables appearing in a build.
+    """
+    differences = []
+    for key in sorted(set(expected) | set(actual)):
+        if key not in expected and not key.startswith(strict_prefixes):
+            continue
+        want = expected.get(key)
+        have = actual.get(key)
+        if want != have:
+            differences.append({"setting": key, "expected": want, "actual": have})
+    return differences
+
+
+def load_profile(path, instance):
+    """Load a golden profile file, or <instance>.json when path is a directory."""
+    if os.path.isdir(path):
+        path = os.path.join(path, f"{instance}.json")
+    with open(path) as f:
+        profile = json.load(f)
+    # Profiles may be a full report or a plain {setting: value} mapping
+    return flatten(profile["settings"]) if "settings" in profile else profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit performance-relevant PyTorch environment settings")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("-o", "--output", help="Also write the JSON report to this file")
+    parser.add_argument("--profile", help="Golden profile file, or a directory of <instance-type>.json profiles")
+    parser.add_argument("--compare", help="Report of another environment to diff against (all settings)")
+    parser.add_argument("--write-profile", help="Save the current settings as a golden profile")
+    parser.add_argument("--fail-on-drift", action="store_true",
+                        help="Exit 1 when settings differ from the profile or comparison report")
+    args = parser.parse_args()
+
+    report = collect_report()
+    flat = flatten(report["settings"])
+    report["findings"] = check_rules(flat)
+
+    if args.profile:
+        try:
+            expected = load_profile(args.profile, report["instance_type"])
+        except (OSError, ValueError) as e:
+            print(f"Error: cannot load profile for {report['instance_type']}: {e}")
+            sys.exit(2)
+        report["profile_drift"] = diff_settings(expected, flat, DRIFT_ENV_PREFIXES)
+    if args.compare:
+        try:
+            with open(args.compare) as f:
+                other = flatten(json.load(f)["settings"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            parser.error(f"--compare: {args.compare} is not a readable pytorch-screen report: {e!r}")
+        report["compare_drift"] = diff_settings(other, flat, ("",))
+
+    if args.write_profile:
+        os.makedirs(os.path.dirname(os.path.abspath(args.write_profile)), exist_ok=True)
+        with open(args.write_profile, "w") as f:
+            json.dump(flat, f, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        # Bypass rich, which would add highlighting escapes to the JSON
+        sys.stdout.write(json.dumps(report, indent=2) + "\n")
+    else:
+        print(f"{report['hostname']} ({report['instance_type']})")
+        for key, value in flat.items():
+            print(f"{key}={value}")
+        for finding in report["findings"]:
+            print(f"[PERF] {finding['setting']}={finding['value']}: {finding['message']}")
+        for name in ("profile_drift", "compare_drift"):
+            for diff in report.get(name, []):
+                print(f"[DRIFT] {diff['setting']}: expected {diff['expected']!r}, got {diff['actual']!r}")
+
+    drift = report.get("profile_drift", []) + report.get("compare_drift", [])
+    sys.exit(1 if args.fail_on_drift and drift else 0)
+
 
-print(f"{torch.distributed.is_available()=}")
-print(f"{torch.distributed.is_mpi_available()=}")
-print(f"{torch.distributed.is_nccl_available()=}")
+if __name__ == "__main__":
+    main()
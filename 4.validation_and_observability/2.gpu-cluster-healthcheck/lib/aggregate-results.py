@@ -4,15 +4,23 @@
 Reads individual check result JSON files from a results directory and
 produces a consolidated cluster-level report with per-node status.
 
+Node directories are scanned and loaded on a thread pool. With --state-file,
+a per-node fingerprint (check file names, sizes and mtimes) and the parsed
+node summary are cached between runs, so only nodes whose results changed
+are read again.
+
 Usage:
     python3 aggregate-results.py --results-dir /tmp/gpu-healthcheck-12345
     python3 aggregate-results.py --results-dir /tmp/gpu-healthcheck-12345 --format table
+    python3 aggregate-results.py --results-root /shared/healthcheck-results/sweeps \
+        --latest-per-host --state-file /shared/healthcheck-results/aggregate-state.json
 """
 
 import argparse
 import glob
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 SEVERITY_PRIORITY = {
@@ -33,6 +41,9 @@ ACTIONS = {
     "PASS":    "No action required",
 }
 
+STATE_VERSION = 1
+DEFAULT_WORKERS = 32
+
 
 def load_results(results_dir: str) -> list:
     """Load all check result JSON files from a results directory."""
@@ -53,6 +64,79 @@ def load_results(results_dir: str) -> list:
     return results
 
 
+def node_fingerprint(results_dir: str) -> list:
+    """Return sorted [name, size, mtime_ns] entries for a node's check files.
+
+    Only directory metadata is read, which is far cheaper than opening every
+    file on a shared filesystem. A missing directory has an empty fingerprint.
+    """
+    entries = []
+    try:
+        with os.scandir(results_dir) as it:
+            for entry in it:
+                if entry.name.startswith("check-") and entry.name.endswith(".json"):
+                    st = entry.stat()
+                    entries.append([entry.name, st.st_size, st.st_mtime_ns])
+    except OSError:
+        return []
+    return sorted(entries)
+
+
+def find_node_dirs(roots: list, workers: int = DEFAULT_WORKERS) -> list:
+    """Find every directory containing check-*.json files below roots.
+
+    Directory levels are scanned breadth-first with one os.scandir call per
+    directory spread over a thread pool.
+    """
+    node_dirs = []
+
+    def scan(path):
+        subdirs, has_checks = [], False
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.startswith("check-") and entry.name.endswith(".json"):
+                        has_checks = True
+        except OSError:
+            pass
+        return path, has_checks, subdirs
+
+    pending = list(roots)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending:
+            next_level = []
+            for path, has_checks, subdirs in executor.map(scan, pending):
+                if has_checks:
+                    node_dirs.append(path)
+                next_level.extend(subdirs)
+            pending = next_level
+    return sorted(node_dirs)
+
+
+def load_state(state_file: str) -> dict:
+    """Load the incremental aggregation state, or an empty one."""
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    if state.get("version") != STATE_VERSION:
+        return {}
+    return state.get("nodes", {})
+
+
+def save_state(state_file: str, nodes: dict) -> None:
+    """Atomically write the incremental aggregation state."""
+    directory = os.path.dirname(os.path.abspath(state_file))
+    os.makedirs(directory, exist_ok=True)
+    tmp_file = f"{state_file}.tmp.{os.getpid()}"
+    with open(tmp_file, "w") as f:
+        json.dump({"version": STATE_VERSION, "nodes": nodes}, f)
+    os.replace(tmp_file, state_file)
+
+
 def aggregate_node_results(results: list) -> dict:
     """Aggregate results for a single node."""
     node_summary = {
@@ -145,11 +229,55 @@ def aggregate_node_results(results: list) -> dict:
     return node_summary
 
 
-def aggregate_cluster(results_dirs: list) -> dict:
+def summarize_nodes(results_dirs: list, workers: int = DEFAULT_WORKERS,
+                    state: dict = None) -> dict:
+    """Return {results_dir: {"fingerprint", "summary"}} for every node.
+
+    Entries in state whose fingerprint still matches are reused as-is; all
+    other nodes are loaded and aggregated in parallel.
+    """
+    state = state or {}
+
+    def summarize(results_dir):
+        fingerprint = node_fingerprint(results_dir)
+        cached = state.get(results_dir)
+        if cached and cached.get("fingerprint") == fingerprint:
+            return results_dir, cached
+        summary = aggregate_node_results(load_results(results_dir))
+        return results_dir, {"fingerprint": fingerprint, "summary": summary}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return dict(executor.map(summarize, results_dirs))
+
+
+def latest_per_host(nodes: dict) -> list:
+    """Keep only the most recently written results directory per hostname."""
+    latest = {}
+    for results_dir, node in nodes.items():
+        hostname = node["summary"]["hostname"] or results_dir
+        newest = max((entry[2] for entry in node["fingerprint"]), default=0)
+        if hostname not in latest or newest > latest[hostname][0]:
+            latest[hostname] = (newest, results_dir)
+    return sorted(results_dir for _, results_dir in latest.values())
+
+
+def aggregate_cluster(results_dirs: list, workers: int = DEFAULT_WORKERS,
+                      state_file: str = None, dedupe_hosts: bool = False) -> dict:
     """Aggregate results across multiple nodes into cluster summary."""
+    state = load_state(state_file) if state_file else {}
+    nodes = summarize_nodes(results_dirs, workers, state)
+    if state_file:
+        save_state(state_file, nodes)
+    if dedupe_hosts:
+        results_dirs = latest_per_host(nodes)
+    return build_cluster([nodes[results_dir]["summary"] for results_dir in results_dirs])
+
+
+def build_cluster(node_summaries: list) -> dict:
+    """Combine per-node summaries into the cluster summary."""
     cluster = {
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "node_count": len(results_dirs),
+        "node_count": len(node_summaries),
         "nodes": [],
         "overall_status": "PASS",
         "overall_severity": "PASS",
@@ -163,9 +291,7 @@ def aggregate_cluster(results_dirs: list) -> dict:
 
     max_severity = 0
 
-    for results_dir in results_dirs:
-        results = load_results(results_dir)
-        node_summary = aggregate_node_results(results)
+    for node_summary in node_summaries:
         cluster["nodes"].append(node_summary)
 
         if node_summary["overall_status"] == "FAIL":
@@ -241,12 +367,32 @@ def main():
     parser = argparse.ArgumentParser(
         description="Aggregate GPU health check results into cluster summary"
     )
-    parser.add_argument(
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
         "--results-dir",
-        required=True,
         nargs="+",
         help="One or more results directories to aggregate",
     )
+    source.add_argument(
+        "--results-root",
+        nargs="+",
+        help="Aggregate every directory containing check-*.json below these roots",
+    )
+    parser.add_argument(
+        "--latest-per-host",
+        action="store_true",
+        help="Report only the most recent results directory for each hostname",
+    )
+    parser.add_argument(
+        "--state-file",
+        help="Cache node summaries here and only re-read nodes whose results changed",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Threads used to scan and load results (default: {DEFAULT_WORKERS})",
+    )
     parser.add_argument(
         "--format",
         choices=["json", "table"],
@@ -259,7 +405,13 @@ def main():
     )
     args = parser.parse_args()
 
-    cluster = aggregate_cluster(args.results_dir)
+    if args.results_root:
+        results_dirs = find_node_dirs(args.results_root, args.workers)
+    else:
+        results_dirs = args.results_dir
+
+    cluster = aggregate_cluster(results_dirs, args.workers, args.state_file,
+                                args.latest_per_host)
 
     if args.format == "table":
         output = format_table(cluster)
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""Fan GPU health checks out to many nodes and aggregate results as they arrive.
+
+gpu-healthcheck.sh runs on every node through a transport (srun, ssh, or a
+custom launcher command), with at most --max-parallel nodes in flight. A new
+node starts as soon as any node finishes, so a sweep takes about as long as
+its slowest node rather than the sum of fixed-size batches.
+
+Check results are read from the JSON lines gpu-healthcheck.sh prints with
+--json, so no shared filesystem is needed. They are written to
+<output-dir>/<node>/check-*.json, and the cluster summary in
+<output-dir>/cluster-summary.json is rewritten after every node. A node is
+stopped at its first ISOLATE result, since the instance is replaced anyway.
+
+Usage:
+    python3 fanout-healthcheck.py --nodelist 'p5-[001-512]' --suite lightweight --max-parallel 64
+    python3 fanout-healthcheck.py --nodes node1 node2 --transport ssh --output-dir /tmp/sweep
+    python3 fanout-healthcheck.py --nodes a b --launcher './fake-node.sh {node}' --output-dir /tmp/test
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+LIB_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HEALTHCHECK = os.path.join(os.path.dirname(LIB_DIR), "gpu-healthcheck.sh")
+
+
+def _load_lib(filename: str):
+    """Import a sibling lib/ script whose file name is not a valid module name."""
+    name = os.path.splitext(filename)[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, os.path.join(LIB_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+aggregate = _load_lib("aggregate-results.py")
+
+# Launcher templates; {node} is replaced with the target hostname
+TRANSPORTS = {
+    "srun": "srun --nodes=1 --ntasks=1 --nodelist={node} --kill-on-bad-exit=1",
+    "ssh": "ssh -o BatchMode=yes {node}",
+    "local": "",
+}
+
+DEFAULT_MAX_PARALLEL = 32
+
+
+def expand_nodelist(nodelist: str) -> list:
+    """Expand a Slurm hostlist expression such as p5-[001-004] via scontrol."""
+    result = subprocess.run(
+        ["scontrol", "show", "hostnames", nodelist],
+        stdout=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+    return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+
+
+def build_command(launcher: str, node: str, healthcheck_args: list) -> list:
+    return [arg.format(node=node) for arg in shlex.split(launcher)] + healthcheck_args
+
+
+def parse_result_line(line: str):
+    """Return the check result dict for a gpu-healthcheck.sh --json line, else None."""
+    line = line.strip()
+    if not line.startswith("{"):
+        return None
+    try:
+        result = json.loads(line)
+    except ValueError:
+        return None
+    return result if isinstance(result, dict) and "check" in result else None
+
+
+def write_check_result(node_dir: str, result: dict) -> None:
+    """Store a streamed check result where aggregate-results.py expects it."""
+    safe_name = "".join(c if c.isalnum() or c in "._-" else "-" for c in result["check"])
+    tmp_file = os.path.join(node_dir, f".check-{safe_name}.json.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(result, f)
+    os.replace(tmp_file, os.path.join(node_dir, f"check-{safe_name}.json"))
+
+
+def _signal_group(proc: subprocess.Popen, sig: int) -> None:
+    """Signal the launcher and everything it started."""
+    try:
+        os.killpg(proc.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def run_node(node: str, command: list, node_dir: str, timeout: float = None) -> dict:
+    """Run the health check on one node, stopping it at the first ISOLATE result.
+
+    Returns {"node", "exit_code", "early_exit", "timed_out"}; the check
+    results themselves are written to node_dir as they arrive.
+    """
+    os.makedirs(node_dir, exist_ok=True)
+    outcome = {"node": node, "exit_code": None, "early_exit": False, "timed_out": False}
+
+    with open(os.path.join(node_dir, "healthcheck.log"), "w") as log:
+        try:
+            proc = subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL, universal_newlines=True,
+                start_new_session=True,
+            )
+        except OSError as e:
+            log.write(f"Failed to launch {command}: {e}\n")
+            outcome["exit_code"] = 127
+            return outcome
+
+        timer = None
+        if timeout:
+            def on_timeout():
+                outcome["timed_out"] = True
+                _signal_group(proc, signal.SIGKILL)
+            timer = threading.Timer(timeout, on_timeout)
+            timer.start()
+
+        try:
+            for line in proc.stdout:
+                log.write(line)
+                result = parse_result_line(line)
+                if result is None:
+                    continue
+                write_check_result(node_dir, result)
+                if result.get("severity") == "ISOLATE":
+                    outcome["early_exit"] = True
+                    _signal_group(proc, signal.SIGTERM)
+                    break
+        finally:
+            if timer:
+                timer.cancel()
+            proc.stdout.close()
+            outcome["exit_code"] = proc.wait()
+
+    if outcome["timed_out"]:
+        write_check_result(node_dir, {
+            "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "hostname": node,
+            "check": "fanout-timeout",
+            "status": "FAIL",
+            "details": f"Node did not finish within {timeout:.0f}s",
+            "severity": "RESET",
+        })
+    return outcome
+
+
+def write_cluster_summary(path: str, summaries: dict, nodes: list) -> dict:
+    """Atomically write the cluster summary for the nodes finished so far."""
+    cluster = aggregate.build_cluster([summaries[node] for node in nodes if node in summaries])
+    cluster["nodes_pending"] = len(nodes) - len(summaries)
+    tmp_file = f"{path}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(cluster, f, indent=2)
+    os.replace(tmp_file, path)
+    return cluster
+
+
+def fan_out(nodes: list, launcher: str, healthcheck_args: list, output_dir: str,
+            max_parallel: int = DEFAULT_MAX_PARALLEL, node_timeout: float = None) -> dict:
+    """Run the health check on every node with a bounded concurrency window."""
+    summary_file = os.path.join(output_dir, "cluster-summary.json")
+    summaries = {}
+    cluster = write_cluster_summary(summary_file, summaries, nodes)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+        futures = {
+            executor.submit(
+                run_node, node, build_command(launcher, node, healthcheck_args),
+                os.path.join(output_dir, node), node_timeout,
+            ): node
+            for node in nodes
+        }
+        for future in as_completed(futures):
+            node = futures[future]
+            outcome = future.result()
+            node_summary = aggregate.aggregate_node_results(
+                aggregate.load_results(os.path.join(output_dir, node)))
+            if not node_summary["hostname"]:
+                node_summary["hostname"] = node
+            summaries[node] = node_summary
+            cluster = write_cluster_summary(summary_file, summaries, nodes)
+
+            note = ""
+            if outcome["early_exit"]:
+                note = " (stopped at first ISOLATE result)"
+            elif outcome["timed_out"]:
+                note = " (timed out)"
+            print(f"[{len(summaries)}/{len(nodes)}] {node}: {node_summary['overall_status']} "
+                  f"severity={node_summary['overall_severity']} exit={outcome['exit_code']}{note}",
+                  flush=True)
+
+    return cluster
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run GPU health checks on many nodes concurrently and aggregate the results"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--nodes",
+        nargs="+",
+        help="Hostnames to check",
+    )
+    source.add_argument(
+        "--nodelist",
+        help="Slurm hostlist expression, expanded with scontrol show hostnames",
+    )
+    source.add_argument(
+        "--nodes-file",
+        help="File with one hostname per line",
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--suite",
+        choices=["lightweight", "intensive"],
+        default="lightweight",
+        help="Check suite to run on every node (default: lightweight)",
+    )
+    mode.add_argument(
+        "--check",
+        help="Run a single check (0-6 or by name) instead of a suite",
+    )
+    parser.add_argument(
+        "--transport",
+        choices=sorted(TRANSPORTS),
+        default="srun",
+        help="How to reach each node (default: srun)",
+    )
+    parser.add_argument(
+        "--launcher",
+        help="Custom launcher command template with a {node} placeholder; overrides --transport",
+    )
+    parser.add_argument(
+        "--healthcheck",
+        default=DEFAULT_HEALTHCHECK,
+        help="Path of gpu-healthcheck.sh on the nodes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=f"/tmp/gpu-healthcheck-fanout-{datetime.now().strftime('%Y%m%d-%H%M%S')}",
+        help="Directory for per-node results and the cluster summary",
+    )
+    parser.add_argument(
+        "--max-parallel",
+        type=int,
+        default=DEFAULT_MAX_PARALLEL,
+        help=f"Maximum number of nodes checked at once (default: {DEFAULT_MAX_PARALLEL})",
+    )
+    parser.add_argument(
+        "--node-timeout",
+        type=float,
+        help="Kill a node's checks after this many seconds",
+    )
+    parser.add_argument(
+        "--exclusive",
+        action="store_true",
+        help="Confirm exclusive node access (required for the intensive suite)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Pass --dry-run to gpu-healthcheck.sh",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "table"],
+        default="table",
+        help="Final summary format on stdout (default: table)",
+    )
+    args = parser.parse_args()
+
+    if args.nodelist:
+        nodes = expand_nodelist(args.nodelist)
+    elif args.nodes_file:
+        with open(args.nodes_file) as f:
+            nodes = [line.strip() for line in f if line.strip()]
+    else:
+        nodes = args.nodes
+    nodes = list(dict.fromkeys(nodes))
+    if not nodes:
+        print("ERROR: no nodes to check", file=sys.stderr)
+        sys.exit(1)
+
+    healthcheck_args = ["bash", args.healthcheck, "--json"]
+    if args.check is not None:
+        healthcheck_args += ["--check", args.check]
+    else:
+        healthcheck_args += ["--suite", args.suite]
+    if args.exclusive:
+        healthcheck_args.append("--exclusive")
+    if args.dry_run:
+        healthcheck_args.append("--dry-run")
+
+    launcher = args.launcher if args.launcher is not None else TRANSPORTS[args.transport]
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    cluster = fan_out(nodes, launcher, healthcheck_args, args.output_dir,
+                      args.max_parallel, args.node_timeout)
+
+    if args.format == "table":
+        print(aggregate.format_table(cluster))
+    else:
+        print(json.dumps(cluster, indent=2))
+    print(f"Results: {args.output_dir}", file=sys.stderr)
+    sys.exit(0 if cluster["overall_status"] == "PASS" else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""Record GPU health check results over time and detect degrading GPUs.
+
+Every ingest appends one row per (node, GPU, test, timestamp) to an SQLite
+history database. Node-level check verdicts are stored with gpu_id -1;
+per-GPU DCGM results come from the dcgm-l*-raw.json files kept next to the
+check results, together with the numeric measurement DCGM reports for the
+test (memory bandwidth, PCIe bandwidth, power, SM GFLOPS).
+
+The trend report flags GPUs whose measurements drift down across sweeps or
+whose DCGM warning level rises, before they reach an ISOLATE verdict.
+
+Usage:
+    python3 health-history.py --db history.db ingest --results-root /shared/healthcheck-results
+    python3 health-history.py --db history.db trend --window 6 --drop-pct 5
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import re
+import sqlite3
+import statistics
+import sys
+from datetime import datetime, timezone
+
+LIB_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_lib(filename: str):
+    """Import a sibling lib/ script whose file name is not a valid module name."""
+    name = os.path.splitext(filename)[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, os.path.join(LIB_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+dcgm = _load_lib("parse-dcgm-results.py")
+aggregate = _load_lib("aggregate-results.py")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    hostname      TEXT NOT NULL,
+    instance_type TEXT,
+    gpu_id        INTEGER NOT NULL,
+    test          TEXT NOT NULL,
+    timestamp     TEXT NOT NULL,
+    status        TEXT,
+    severity      TEXT,
+    warning_level INTEGER,
+    value         REAL,
+    unit          TEXT,
+    UNIQUE (hostname, gpu_id, test, timestamp)
+);
+CREATE INDEX IF NOT EXISTS results_series
+    ON results (test, hostname, gpu_id, timestamp);
+"""
+
+# DCGM reports measurements in the free-form info text, e.g.
+# "GPU 0 Maximum Memory Bandwidth: 2876.23 GB/s" or "relative stress performance: 15240 gflops"
+MEASUREMENT_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(GB/s|gflops|W)\b", re.IGNORECASE)
+
+# Tests where a lower measurement is worse and therefore tracked for drift
+TREND_TESTS = [
+    "memory_bandwidth", "membw", "pcie", "sm_stress", "targeted_stress", "sm_perf",
+]
+
+DCGM_RAW_FILES = {
+    "dcgm-l2-raw.json": 2,
+    "dcgm-l4-raw.json": 4,
+}
+
+NODE_GPU_ID = -1
+
+
+def open_db(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def parse_measurement(info) -> tuple:
+    """Return the first (value, unit) measurement in DCGM info text, or (None, None)."""
+    if isinstance(info, list):
+        info = " ".join(str(item) for item in info)
+    match = MEASUREMENT_PATTERN.search(str(info or ""))
+    if not match:
+        return None, None
+    return float(match.group(1)), match.group(2)
+
+
+def _gpu_id(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return NODE_GPU_ID
+
+
+def _file_timestamp(path: str) -> str:
+    mtime = os.path.getmtime(path)
+    return datetime.fromtimestamp(mtime, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def node_rows(results_dir: str) -> list:
+    """Build history rows for one node results directory."""
+    checks = aggregate.load_results(results_dir)
+    hostname = next((c["hostname"] for c in checks if c.get("hostname")), "")
+    instance_type = next((c["instance_type"] for c in checks if c.get("instance_type")), "")
+    if not hostname:
+        hostname = os.path.basename(os.path.normpath(results_dir))
+
+    rows = []
+    check_times = {}
+    for check in checks:
+        name = check.get("check", check.get("_source_file", "unknown"))
+        timestamp = check.get("timestamp") or _file_timestamp(
+            os.path.join(results_dir, check["_source_file"]))
+        check_times[check["_source_file"]] = timestamp
+        rows.append((hostname, instance_type, NODE_GPU_ID, name, timestamp,
+                     check.get("status"), check.get("severity"), None, None, None))
+
+    for raw_file, level in DCGM_RAW_FILES.items():
+        path = os.path.join(results_dir, raw_file)
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path) as f:
+                classified = dcgm.classify_results(dcgm.parse_dcgm_json(f.read()), level)
+        except (OSError, ValueError) as e:
+            print(f"Warning: skipping {path}: {e}", file=sys.stderr)
+            continue
+
+        # Use the verdict time of the matching check so GPU rows line up
+        # with the node row of the same sweep.
+        check_file = next((name for name in check_times if f"-l{level}" in name), None)
+        timestamp = check_times.get(check_file) or _file_timestamp(path)
+        for test in classified["test_summary"]:
+            for gpu in test["gpu_details"]:
+                value, unit = parse_measurement(gpu.get("info"))
+                rows.append((hostname, instance_type, _gpu_id(gpu["gpu_id"]), test["name"],
+                             timestamp, gpu["status"], gpu.get("severity"),
+                             gpu["warning_level"], value, unit))
+    return rows
+
+
+def ingest(conn: sqlite3.Connection, results_dirs: list) -> int:
+    """Insert rows for every results directory, ignoring ones already recorded."""
+    before = conn.total_changes
+    with conn:
+        for results_dir in results_dirs:
+            conn.executemany(
+                "INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                node_rows(results_dir),
+            )
+    return conn.total_changes - before
+
+
+def _slope(values: list) -> float:
+    """Least-squares slope of values against their index."""
+    n = len(values)
+    mean_x = (n - 1) / 2
+    mean_y = sum(values) / n
+    num = sum((i - mean_x) * (v - mean_y) for i, v in enumerate(values))
+    den = sum((i - mean_x) ** 2 for i in range(n))
+    return num / den if den else 0.0
+
+
+def detect_trends(conn: sqlite3.Connection, tests: list = None, window: int = 5,
+                  min_points: int = 3, drop_pct: float = 5.0) -> list:
+    """Flag GPUs whose measurements drift down or whose warning level rises.
+
+    For each (hostname, gpu, test) series, the last `window` sweeps are
+    compared: a GPU is flagged when its latest value is at least drop_pct
+    below the median of the earlier sweeps and the fitted slope is negative,
+    or when its latest DCGM warning level is above every earlier one.
+    """
+    tests = tests or TREND_TESTS
+    # The latest sweep is compared against at least one earlier one
+    min_points = max(min_points, 2)
+    placeholders = ",".join("?" * len(tests))
+    cursor = conn.execute(
+        f"""SELECT hostname, gpu_id, test, timestamp, value, warning_level
+            FROM results
+            WHERE gpu_id >= 0 AND test IN ({placeholders})
+            ORDER BY hostname, gpu_id, test, timestamp""",
+        tests,
+    )
+
+    series = {}
+    for hostname, gpu_id, test, timestamp, value, warning_level in cursor:
+        series.setdefault((hostname, gpu_id, test), []).append(
+            (timestamp, value, warning_level or 0))
+
+    findings = []
+    for (hostname, gpu_id, test), points in series.items():
+        points = points[-window:]
+        if len(points) < min_points:
+            continue
+        latest_time, latest_value, latest_level = points[-1]
+        reasons = []
+
+        values = [p[1] for p in points if p[1] is not None]
+        if len(values) >= min_points and len(values) >= 2 and points[-1][1] is not None:
+            baseline = statistics.median(values[:-1])
+            if baseline > 0:
+                drop = (baseline - latest_value) / baseline * 100
+                slope_pct = _slope(values) / baseline * 100
+                if drop >= drop_pct and slope_pct < 0:
+                    reasons.append(
+                        f"{test} {latest_value:g} is {drop:.1f}% below median {baseline:g} "
+                        f"({slope_pct:+.1f}%/sweep over {len(values)} sweeps)")
+
+        earlier_levels = [p[2] for p in points[:-1]]
+        if earlier_levels and latest_level > max(earlier_levels):
+            reasons.append(f"{test} warning level rose to {latest_level}")
+
+        if reasons:
+            findings.append({
+                "hostname": hostname,
+                "gpu_id": gpu_id,
+                "test": test,
+                "timestamp": latest_time,
+                "reasons": reasons,
+            })
+
+    return sorted(findings, key=lambda f: (f["hostname"], f["gpu_id"], f["test"]))
+
+
+def format_trends(findings: list) -> str:
+    if not findings:
+        return "No degrading GPUs detected"
+    lines = [f"{len(findings)} GPU series trending toward failure:"]
+    for finding in findings:
+        lines.append(f"  [MONITOR] {finding['hostname']} GPU {finding['gpu_id']} "
+                     f"(last sweep {finding['timestamp']})")
+        for reason in finding["reasons"]:
+            lines.append(f"      {reason}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="GPU health check history store and degradation trend detector"
+    )
+    parser.add_argument(
+        "--db",
+        required=True,
+        help="SQLite history database (created if missing)",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    ingest_parser = subparsers.add_parser("ingest", help="Record node results directories")
+    source = ingest_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--results-dir",
+        nargs="+",
+        help="One or more node results directories",
+    )
+    source.add_argument(
+        "--results-root",
+        nargs="+",
+        help="Record every directory containing check-*.json below these roots",
+    )
+
+    trend_parser = subparsers.add_parser("trend", help="Report GPUs drifting toward failure")
+    trend_parser.add_argument(
+        "--tests",
+        nargs="+",
+        default=TREND_TESTS,
+        help="DCGM tests to analyze (default: %(default)s)",
+    )
+    trend_parser.add_argument(
+        "--window",
+        type=int,
+        default=5,
+        help="Number of most recent sweeps per GPU to consider (default: 5)",
+    )
+    trend_parser.add_argument(
+        "--min-points",
+        type=int,
+        default=3,
+        help="Minimum sweeps needed before a GPU is evaluated (default: 3)",
+    )
+    trend_parser.add_argument(
+        "--drop-pct",
+        type=float,
+        default=5.0,
+        help="Flag a drop of at least this percentage below the GPU's median (default: 5)",
+    )
+    trend_parser.add_argument(
+        "--format",
+        choices=["json", "table"],
+        default="table",
+        help="Output format (default: table)",
+    )
+    args = parser.parse_args()
+    if args.command == "trend" and args.min_points < 2:
+        parser.error("--min-points must be at least 2")
+
+    conn = open_db(args.db)
+    try:
+        if args.command == "ingest":
+            if args.results_root:
+                results_dirs = aggregate.find_node_dirs(args.results_root)
+            else:
+                results_dirs = args.results_dir
+            added = ingest(conn, results_dirs)
+            print(f"Recorded {added} rows from {len(results_dirs)} results directories")
+            return
+
+        findings = detect_trends(conn, args.tests, args.window, args.min_points, args.drop_pct)
+        if args.format == "json":
+            print(json.dumps(findings, indent=2))
+        else:
+            print(format_trends(findings))
+        # Non-zero exit lets cron wrappers alert on degrading GPUs
+        sys.exit(1 if findings else 0)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
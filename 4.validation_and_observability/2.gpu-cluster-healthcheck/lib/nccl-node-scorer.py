@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""Find the weakest nodes from pairwise / small-group NCCL all_reduce results.
+
+A multi-node all_reduce only tells whether the cluster as a whole is fast
+enough. This scorer runs (or ingests) all_reduce_perf on many small groups
+of nodes, each node paired with different partners in every round, and
+scores each node by the median bus bandwidth of the tests it took part in.
+A node with a slow EFA link is slow with every partner, while its partners
+are only slow once, so its median stands out. Nodes are compared to their
+peers with a robust z-score (median / MAD) and the verdict is written as a
+check-nccl-node-score.json result per node, which aggregate-results.py
+picks up like any other check.
+
+Usage:
+    # Inside an allocation: 3 rounds of pairwise tests, then score
+    salloc -N 16 --exclusive
+    python3 nccl-node-scorer.py run --rounds 3 --output-dir /shared/nccl-score
+
+    # Score existing all_reduce_perf outputs
+    python3 nccl-node-scorer.py score /shared/nccl-score/raw --output-dir /shared/nccl-score
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+LIB_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# nccl_to_csv.py lives with the NCCL test micro-benchmarks in this repository
+DEFAULT_NCCL_TESTS_DIR = os.path.normpath(
+    os.path.join(LIB_DIR, "..", "..", "..", "micro-benchmarks", "nccl-tests"))
+
+CHECK_NAME = "nccl-node-score"
+
+# Consistency factor that makes the MAD comparable to a standard deviation
+MAD_SCALE = 1.4826
+
+
+def load_nccl_to_csv(nccl_tests_dir: str):
+    """Import nccl_to_csv.py from the NCCL tests directory."""
+    path = os.path.join(nccl_tests_dir, "nccl_to_csv.py")
+    if not os.path.exists(path):
+        print(f"ERROR: {path} not found; set --nccl-tests-dir", file=sys.stderr)
+        sys.exit(1)
+    spec = importlib.util.spec_from_file_location("nccl_to_csv", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def expand_nodelist(nodelist: str) -> list:
+    result = subprocess.run(
+        ["scontrol", "show", "hostnames", nodelist],
+        stdout=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+    return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+
+
+def schedule_groups(nodes: list, group_size: int, rounds: int, seed: int = 0) -> list:
+    """Return `rounds` lists of disjoint node groups.
+
+    Pairs follow the round-robin (circle) schedule so every round pairs each
+    node with a new partner; larger groups are drawn from a seeded shuffle.
+    A node left without a partner joins the last group of its round.
+    """
+    nodes = sorted(nodes)
+    schedule = []
+    for round_index in range(rounds):
+        if group_size == 2:
+            ring = nodes if len(nodes) % 2 == 0 else nodes + [None]
+            count = len(ring)
+            rotation = round_index % max(1, count - 1)
+            rotated = [ring[0]] + ring[1:][rotation:] + ring[1:][:rotation]
+            pairs = [[rotated[i], rotated[count - 1 - i]] for i in range(count // 2)]
+            groups = [[n for n in pair if n is not None] for pair in pairs]
+        else:
+            order = list(nodes)
+            random.Random(seed + round_index).shuffle(order)
+            groups = [order[i:i + group_size] for i in range(0, len(order), group_size)]
+
+        singles = [node for group in groups if len(group) < 2 for node in group]
+        groups = [group for group in groups if len(group) >= 2]
+        if groups:
+            groups[-1].extend(singles)
+        schedule.append(groups)
+    return schedule
+
+
+def run_group(hosts: list, output_file: str, gpus_per_node: int, container: str = None,
+              min_bytes: str = "64M", max_bytes: str = "1G", timeout: int = 600) -> int:
+    """Run all_reduce_perf on one group of nodes through srun, saving its output."""
+    command = [
+        "srun", f"--nodes={len(hosts)}", "--ntasks-per-node=1",
+        f"--nodelist={','.join(hosts)}",
+    ]
+    if container:
+        command.append(f"--container-image={container}")
+    command += ["all_reduce_perf", "-b", min_bytes, "-e", max_bytes, "-f", "2",
+                "-g", str(gpus_per_node)]
+
+    with open(output_file, "w") as f:
+        try:
+            return subprocess.run(command, stdout=f, stderr=subprocess.STDOUT,
+                                  timeout=timeout).returncode
+        except subprocess.TimeoutExpired:
+            f.write(f"\nTimed out after {timeout}s\n")
+            return 124
+
+
+def run_rounds(schedule: list, raw_dir: str, gpus_per_node: int, container: str = None,
+               timeout: int = 600) -> list:
+    """Run every round; the groups within a round are disjoint and run concurrently.
+
+    Returns (output file, group) pairs.
+    """
+    os.makedirs(raw_dir, exist_ok=True)
+    outputs = []
+    for round_index, groups in enumerate(schedule):
+        files = [os.path.join(raw_dir, f"round{round_index}-{'-'.join(group)}.out")
+                 for group in groups]
+        print(f"Round {round_index + 1}/{len(schedule)}: {len(groups)} groups", file=sys.stderr)
+        with ThreadPoolExecutor(max_workers=max(1, len(groups))) as executor:
+            list(executor.map(
+                lambda args: run_group(*args, gpus_per_node, container, timeout=timeout),
+                zip(groups, files)))
+        outputs.extend(zip(files, groups))
+    return outputs
+
+
+def group_busbw(nccl_to_csv, path: str, min_size: int, hosts: list = None) -> tuple:
+    """Return (hosts, peak busbw GB/s) of one all_reduce_perf output.
+
+    hosts defaults to the host names found in the output. The peak is taken
+    over message sizes >= min_size, where bandwidth rather than latency
+    dominates; smaller sizes are used only if none qualify.
+    """
+    rows, metadata = nccl_to_csv.parse_nccl_run(path)
+    hosts = hosts or metadata["Hosts"]
+    if not rows or len(hosts) < 2:
+        return hosts, None
+    large = [row for row in rows if row["Size_Bytes"] >= min_size] or rows
+    return hosts, max(max(row["OOP_BusBW_GBps"], row["IP_BusBW_GBps"]) for row in large)
+
+
+def robust_zscores(values: dict) -> dict:
+    """z-score of each value against the median and MAD of all values."""
+    center = statistics.median(values.values())
+    mad = statistics.median(abs(v - center) for v in values.values()) * MAD_SCALE
+    if mad == 0:
+        spread = statistics.pstdev(values.values()) if len(values) > 1 else 0.0
+        mad = spread or 1.0
+    return {node: (value - center) / mad for node, value in values.items()}
+
+
+def score_nodes(results: list, warn_z: float = 2.0, fail_z: float = 3.0,
+                fail_severity: str = "ISOLATE", failed_groups: list = (),
+                min_drop_pct: float = 5.0) -> dict:
+    """Score every node from (hosts, busbw) group results.
+
+    Returns {hostname: {"busbw_gbps", "zscore", "tests", "status", "severity"}}.
+    A node is only flagged when it is also at least min_drop_pct below the
+    peer median, so run-to-run jitter in a very uniform cluster (tiny MAD)
+    is not reported. Nodes that only appear in groups that produced no
+    results are failed with RESET severity.
+    """
+    per_node = {}
+    for hosts, busbw in results:
+        for host in hosts:
+            per_node.setdefault(host, []).append(busbw)
+
+    medians = {node: statistics.median(values) for node, values in per_node.items()}
+    zscores = robust_zscores(medians) if medians else {}
+    threshold = statistics.median(medians.values()) * (1 - min_drop_pct / 100) if medians else 0
+
+    scores = {}
+    for node, busbw in medians.items():
+        z = zscores[node]
+        status, severity = "PASS", ""
+        if busbw > threshold:
+            pass
+        elif z <= -fail_z:
+            status, severity = "FAIL", fail_severity
+        elif z <= -warn_z:
+            status, severity = "WARN", "MONITOR"
+        scores[node] = {
+            "busbw_gbps": busbw,
+            "zscore": z,
+            "tests": len(per_node[node]),
+            "status": status,
+            "severity": severity,
+        }
+
+    for hosts in failed_groups:
+        for host in hosts:
+            if host not in scores:
+                scores[host] = {
+                    "busbw_gbps": None,
+                    "zscore": None,
+                    "tests": 0,
+                    "status": "FAIL",
+                    "severity": "RESET",
+                }
+    return scores
+
+
+def write_node_results(scores: dict, output_dir: str, instance_type: str = "") -> None:
+    """Write one check-nccl-node-score.json per node in the aggregator schema."""
+    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    for node, score in scores.items():
+        node_dir = os.path.join(output_dir, node)
+        os.makedirs(node_dir, exist_ok=True)
+        if score["busbw_gbps"] is None:
+            details = "No successful all_reduce results for this node"
+        else:
+            details = (f"Median busbw {score['busbw_gbps']:.1f} GB/s over {score['tests']} tests, "
+                       f"z-score {score['zscore']:+.2f} against peers")
+        result = {
+            "timestamp": timestamp,
+            "hostname": node,
+            "instance_type": instance_type,
+            "check": CHECK_NAME,
+            "status": score["status"],
+            "details": details,
+            "severity": score["severity"],
+            "busbw_gbps": score["busbw_gbps"],
+            "zscore": score["zscore"],
+        }
+        path = os.path.join(node_dir, f"check-{CHECK_NAME}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(result, f)
+        os.replace(f"{path}.tmp", path)
+
+
+def format_scores(scores: dict) -> str:
+    lines = [f"{'Node':<32} {'busbw GB/s':>11} {'z-score':>8} {'Tests':>6}  Verdict"]
+    ordered = sorted(scores.items(), key=lambda item: (
+        item[1]["zscore"] is not None, item[1]["zscore"] or 0))
+    for node, score in ordered:
+        busbw = "-" if score["busbw_gbps"] is None else f"{score['busbw_gbps']:.1f}"
+        z = "-" if score["zscore"] is None else f"{score['zscore']:+.2f}"
+        verdict = score["status"] + (f" ({score['severity']})" if score["severity"] else "")
+        lines.append(f"{node:<32} {busbw:>11} {z:>8} {score['tests']:>6}  {verdict}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Score nodes by NCCL all_reduce bus bandwidth against their peers"
+    )
+    parser.add_argument(
+        "--output-dir",
+        required=True,
+        help="Per-node check-nccl-node-score.json results are written below this directory",
+    )
+    parser.add_argument(
+        "--nccl-tests-dir",
+        default=os.environ.get("NCCL_TESTS_DIR", DEFAULT_NCCL_TESTS_DIR),
+        help="Directory containing nccl_to_csv.py (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--min-size",
+        type=int,
+        default=64 * 1024 * 1024,
+        help="Smallest message size in bytes used for the bandwidth score (default: 64 MiB)",
+    )
+    parser.add_argument(
+        "--warn-z",
+        type=float,
+        default=2.0,
+        help="Flag nodes this many MADs below the median as WARN/MONITOR (default: 2)",
+    )
+    parser.add_argument(
+        "--fail-z",
+        type=float,
+        default=3.0,
+        help="Fail nodes this many MADs below the median (default: 3)",
+    )
+    parser.add_argument(
+        "--min-drop-pct",
+        type=float,
+        default=5.0,
+        help="Only flag nodes at least this far below the peer median, in percent (default: 5)",
+    )
+    parser.add_argument(
+        "--fail-severity",
+        choices=["ISOLATE", "REBOOT", "RESET", "MONITOR"],
+        default="ISOLATE",
+        help="Severity assigned to failed nodes (default: ISOLATE)",
+    )
+    parser.add_argument(
+        "--instance-type",
+        default=os.environ.get("INSTANCE_TYPE", ""),
+        help="Instance type recorded in the results",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser("run", help="Run pairwise/small-group tests, then score")
+    source = run_parser.add_mutually_exclusive_group()
+    source.add_argument(
+        "--nodes",
+        nargs="+",
+        help="Nodes to test (default: the current Slurm allocation)",
+    )
+    source.add_argument(
+        "--nodelist",
+        help="Slurm hostlist expression of the nodes to test",
+    )
+    run_parser.add_argument(
+        "--group-size",
+        type=int,
+        default=2,
+        help="Nodes per all_reduce test (default: 2)",
+    )
+    run_parser.add_argument(
+        "--rounds",
+        type=int,
+        default=3,
+        help="Rounds with different partners; each node is tested once per round (default: 3)",
+    )
+    run_parser.add_argument(
+        "--gpus-per-node",
+        type=int,
+        default=int(os.environ.get("EXPECTED_GPU_COUNT", 8)),
+        help="GPUs per node passed to all_reduce_perf -g (default: 8)",
+    )
+    run_parser.add_argument(
+        "--container",
+        default=os.environ.get("NCCL_CONTAINER"),
+        help="Pyxis container image with all_reduce_perf (default: $NCCL_CONTAINER, else local binary)",
+    )
+    run_parser.add_argument(
+        "--timeout",
+        type=int,
+        default=600,
+        help="Timeout in seconds for each group test (default: 600)",
+    )
+    run_parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Shuffle seed for groups larger than two nodes",
+    )
+
+    score_parser = subparsers.add_parser("score", help="Score existing all_reduce_perf outputs")
+    score_parser.add_argument(
+        "inputs",
+        nargs="+",
+        help="all_reduce_perf output files, directories or glob patterns",
+    )
+    args = parser.parse_args()
+
+    nccl_to_csv = load_nccl_to_csv(args.nccl_tests_dir)
+
+    if args.command == "run":
+        if args.nodelist:
+            nodes = expand_nodelist(args.nodelist)
+        elif args.nodes:
+            nodes = args.nodes
+        elif os.environ.get("SLURM_JOB_NODELIST"):
+            nodes = expand_nodelist(os.environ["SLURM_JOB_NODELIST"])
+        else:
+            print("ERROR: pass --nodes/--nodelist or run inside a Slurm allocation", file=sys.stderr)
+            sys.exit(1)
+        if len(nodes) < 2 or args.group_size < 2:
+            print("ERROR: need at least 2 nodes and --group-size >= 2", file=sys.stderr)
+            sys.exit(1)
+        schedule = schedule_groups(nodes, args.group_size, args.rounds, args.seed)
+        # Slurm node names are used as-is rather than the hostnames in the output
+        outputs = run_rounds(schedule, os.path.join(args.output_dir, "raw"),
+                             args.gpus_per_node, args.container, args.timeout)
+        expected_groups = [group for groups in schedule for group in groups]
+    else:
+        outputs = [(path, None) for path in nccl_to_csv.expand_inputs(args.inputs)]
+        expected_groups = []
+
+    results = []
+    for path, group in outputs:
+        hosts, busbw = group_busbw(nccl_to_csv, path, args.min_size, group)
+        if busbw is None:
+            print(f"Warning: no all_reduce results in {path}", file=sys.stderr)
+        else:
+            results.append((hosts, busbw))
+
+    tested = {host for hosts, _ in results for host in hosts}
+    failed_groups = [group for group in expected_groups if not set(group) <= tested]
+    scores = score_nodes(results, args.warn_z, args.fail_z, args.fail_severity, failed_groups,
+                         args.min_drop_pct)
+    if not scores:
+        print("ERROR: no usable all_reduce results", file=sys.stderr)
+        sys.exit(1)
+
+    write_node_results(scores, args.output_dir, args.instance_type)
+    print(format_scores(scores))
+    sys.exit(1 if any(score["status"] == "FAIL" for score in scores.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,18 @@
 """Parse DCGM diagnostic JSON output into severity classification.
 
 Reads dcgmi diag -j output from stdin and produces a structured JSON report
-with per-GPU results, overall severity, and recommended actions.
+with per-GPU results, overall severity, and recommended actions. Input is
+streamed, so several concatenated dcgmi outputs (e.g. a whole node sweep)
+can be classified in one process with --all.
 
 Usage:
     dcgmi diag -r 2 -j | python3 parse-dcgm-results.py --level 2
     dcgmi diag -r 4 -j | python3 parse-dcgm-results.py --level 4
+    cat sweep/*/dcgm-l2-raw.json | python3 parse-dcgm-results.py --level 2 --all
 """
 
 import argparse
+import itertools
 import json
 import sys
 from datetime import datetime, timezone
@@ -48,38 +52,100 @@ DCGM_TEST_NAMES = {
     "membw": "Memory Bandwidth",
 }
 
+# Stream read size and how close to the end of the buffer a decode error must
+# be to be treated as an incomplete document rather than invalid JSON
+CHUNK_SIZE = 1 << 16
+TRUNCATION_WINDOW = 16
+
+
+def read_chunks(stream, chunk_size: int = CHUNK_SIZE):
+    """Yield successive text chunks from a file-like object."""
+    return iter(lambda: stream.read(chunk_size), "")
+
+
+def _is_truncated(error: json.JSONDecodeError, buffer: str) -> bool:
+    """Whether a decode error may only be due to the document not being complete yet."""
+    return (
+        error.msg.startswith("Unterminated string")
+        or len(buffer) - error.pos <= TRUNCATION_WINDOW
+    )
+
+
+def iter_dcgm_json(chunks):
+    """Yield every JSON object found in a stream of text chunks.
+
+    dcgmi may emit non-JSON text before, between or after its JSON payloads,
+    and several dcgmi outputs may be concatenated. Text before each object
+    is skipped, each object is decoded with JSONDecoder.raw_decode as soon
+    as it is complete, and consumed text is dropped from the buffer, so
+    memory is bounded by the largest single document. A partial document is
+    only re-decoded once the buffer has doubled, which keeps the total work
+    linear in the input size.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ""
+    retry_at = 0
+    exhausted = False
+
+    while True:
+        start = buffer.find("{")
+        buffer = buffer[start:] if start != -1 else ""
+
+        if buffer and (exhausted or len(buffer) >= retry_at):
+            try:
+                document, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError as e:
+                if not exhausted and _is_truncated(e, buffer):
+                    retry_at = 2 * len(buffer)
+                else:
+                    # Not the start of a valid document -- look for the next "{"
+                    buffer = buffer[1:]
+                    retry_at = 0
+                    continue
+            else:
+                yield document
+                buffer = buffer[end:]
+                retry_at = 0
+                continue
+
+        if exhausted:
+            return
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+        else:
+            buffer += chunk
+
 
 def parse_dcgm_json(raw_input: str) -> dict:
-    """Parse the JSON portion from dcgmi output.
+    """Parse the first JSON object from dcgmi output.
 
     dcgmi may emit non-JSON text before the JSON payload.
-    This function extracts and parses the JSON content.
     """
-    # Try parsing the full input first
-    try:
-        return json.loads(raw_input)
-    except json.JSONDecodeError:
-        pass
-
-    # Look for JSON object boundaries
-    start = raw_input.find("{")
-    if start == -1:
+    document = next(iter_dcgm_json([raw_input]), None)
+    if document is None:
         raise ValueError("No JSON object found in dcgmi output")
+    return document
 
-    # Find matching closing brace
-    depth = 0
-    for i, ch in enumerate(raw_input[start:], start):
-        if ch == "{":
-            depth += 1
-        elif ch == "}":
-            depth -= 1
-            if depth == 0:
-                try:
-                    return json.loads(raw_input[start : i + 1])
-                except json.JSONDecodeError:
-                    break
 
-    raise ValueError("Unable to parse JSON from dcgmi output")
+def iter_dcgm_tests(dcgm_data: dict):
+    """Yield {"category", "test"} entries from any supported DCGM JSON layout."""
+    # DCGM output structure varies by version; handle common formats
+    if "DCGM GPU Diagnostic" in dcgm_data:
+        diag_root = dcgm_data["DCGM GPU Diagnostic"]
+        for category in diag_root.get("test_categories", []):
+            cat_name = category.get("category", "unknown")
+            for test in category.get("tests", []):
+                yield {"category": cat_name, "test": test}
+    elif "categories" in dcgm_data:
+        for category in dcgm_data["categories"]:
+            cat_name = category.get("category", "unknown")
+            for test in category.get("tests", []):
+                yield {"category": cat_name, "test": test}
+    elif "tests" in dcgm_data:
+        for test in dcgm_data["tests"]:
+            yield {"category": "unknown", "test": test}
 
 
 def classify_results(dcgm_data: dict, diag_level: int) -> dict:
@@ -108,37 +174,8 @@ def classify_results(dcgm_data: dict, diag_level: int) -> dict:
 
     max_severity_level = 0
 
-    # Navigate DCGM JSON structure
-    # DCGM output structure varies by version; handle common formats
-    tests = []
-
-    if "DCGM GPU Diagnostic" in dcgm_data:
-        diag_root = dcgm_data["DCGM GPU Diagnostic"]
-        if "test_categories" in diag_root:
-            for category in diag_root["test_categories"]:
-                cat_name = category.get("category", "unknown")
-                for test in category.get("tests", []):
-                    tests.append({
-                        "category": cat_name,
-                        "test": test,
-                    })
-    elif "categories" in dcgm_data:
-        for category in dcgm_data["categories"]:
-            cat_name = category.get("category", "unknown")
-            for test in category.get("tests", []):
-                tests.append({
-                    "category": cat_name,
-                    "test": test,
-                })
-    elif "tests" in dcgm_data:
-        for test in dcgm_data["tests"]:
-            tests.append({
-                "category": "unknown",
-                "test": test,
-            })
-
     # Process each test
-    for test_entry in tests:
+    for test_entry in iter_dcgm_tests(dcgm_data):
         test = test_entry["test"]
         test_name = test.get("name", "unknown")
         human_name = DCGM_TEST_NAMES.get(test_name, test_name)
@@ -237,6 +274,18 @@ def classify_results(dcgm_data: dict, diag_level: int) -> dict:
     return result
 
 
+def error_result(message: str) -> dict:
+    """Result reported when no DCGM output could be parsed."""
+    return {
+        "error": message,
+        "status": "FAIL",
+        "severity": "RESET",
+        "overall_status": "FAIL",
+        "overall_severity": "RESET",
+        "overall_action": ACTIONS["RESET"],
+    }
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Parse DCGM diagnostic JSON output into severity classification"
@@ -248,36 +297,39 @@ def main():
         default=2,
         help="DCGM diagnostic level (default: 2)",
     )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Classify every JSON document in the input and print one result per line",
+    )
     args = parser.parse_args()
 
-    raw_input = sys.stdin.read().strip()
-    if not raw_input:
-        print(json.dumps({
-            "error": "No input received",
-            "status": "FAIL",
-            "severity": "RESET",
-            "overall_status": "FAIL",
-            "overall_severity": "RESET",
-            "overall_action": ACTIONS["RESET"],
-        }), file=sys.stdout)
+    chunks = read_chunks(sys.stdin)
+    first_chunk = next((chunk for chunk in chunks if chunk.strip()), None)
+    if first_chunk is None:
+        print(json.dumps(error_result("No input received")), file=sys.stdout)
         sys.exit(1)
 
-    try:
-        dcgm_data = parse_dcgm_json(raw_input)
-    except ValueError as e:
-        print(json.dumps({
-            "error": str(e),
-            "status": "FAIL",
-            "severity": "RESET",
-            "overall_status": "FAIL",
-            "overall_severity": "RESET",
-            "overall_action": ACTIONS["RESET"],
-        }), file=sys.stdout)
+    documents = iter_dcgm_json(itertools.chain([first_chunk], chunks))
+    if args.all:
+        count = 0
+        for index, dcgm_data in enumerate(documents):
+            result = classify_results(dcgm_data, args.level)
+            result["document"] = index
+            print(json.dumps(result))
+            count += 1
+        if count == 0:
+            print(json.dumps(error_result("No JSON object found in dcgmi output")))
+            sys.exit(1)
+        return
+
+    dcgm_data = next(documents, None)
+    if dcgm_data is None:
+        print(json.dumps(error_result("No JSON object found in dcgmi output")), file=sys.stdout)
         sys.exit(1)
 
     result = classify_results(dcgm_data, args.level)
     print(json.dumps(result, indent=2))
 
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,36 @@
+import importlib.util
+import os
+
+import pytest
+
+spec = importlib.util.spec_from_file_location(
+    "health_history", os.path.join(os.path.dirname(os.path.abspath(__file__)), "health-history.py"))
+health_history = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(health_history)
+
+
+def _record(conn, hostname, values, test="memory_bandwidth", levels=None):
+    levels = levels or [0] * len(values)
+    with conn:
+        conn.executemany(
+            "INSERT INTO results (hostname, gpu_id, test, timestamp, value, warning_level)"
+            " VALUES (?, 0, ?, ?, ?, ?)",
+            [(hostname, test, f"2024-01-0{i + 1}T00:00:00Z", value, level)
+             for i, (value, level) in enumerate(zip(values, levels))])
+
+
+@pytest.mark.parametrize("min_points", [0, 1, 2])
+def test_trend_skips_host_with_single_run(min_points):
+    conn = health_history.open_db(":memory:")
+    _record(conn, "node-1", [100.0], levels=[2])
+    assert health_history.detect_trends(conn, ["memory_bandwidth"], min_points=min_points) == []
+
+
+def test_trend_flags_drop_and_rising_warning_level():
+    conn = health_history.open_db(":memory:")
+    _record(conn, "node-1", [100.0, 101.0, 99.0, 80.0])
+    _record(conn, "node-2", [100.0, 100.0], levels=[0, 1])
+    findings = health_history.detect_trends(conn, ["memory_bandwidth"], min_points=2)
+    assert [finding["hostname"] for finding in findings] == ["node-1", "node-2"]
+    assert "below median" in findings[0]["reasons"][0]
+    assert findings[1]["reasons"] == ["memory_bandwidth warning level rose to 1"]
@@ -1,39 +1,163 @@
-import pandas as pd
-import matplotlib.pyplot as plt
+import argparse
+import os
+import re
+import sys
+
 import numpy as np
-import seaborn as sns
-
-# Read CSV
-all_reduce_df = pd.read_csv('./all_reduce.csv')
-
-# Convert duration to float
-all_reduce_df[['duration_ms','unit']] = all_reduce_df['Duration'].str.split(' ',expand = True)
-all_reduce_df['duration_ms']=all_reduce_df['duration_ms'].astype('float')
-
-# Filter by Message Size
-one_df_1GB = all_reduce_df.loc[all_reduce_df['Message_Size']=='1,073,741,824',]
-one_df_2GB = all_reduce_df.loc[all_reduce_df['Message_Size']=='2,147,483,648',]
-
-NCCL_Test_allreduce_1GB = 53.361
-NCCL_Test_allreduce_2GB = 92.866
-
-fig, (ax1, ax2) = plt.subplots(2, 1)
-ax1.hist(one_df_1GB['duration_ms'], density=True, bins=100)  # density=False would make counts
-ax1.set_ylabel('Probability')
-ax1.set_xlabel('Duration ms')
-ax1.set_xlim([20, 220])
-ax1.axvline(NCCL_Test_allreduce_1GB, color='k', linestyle='dashed', linewidth=1)
-ax1.set_title('All Reduce:Sum Message Size = 1GB')
-ax1.legend(['NCCL Test Reported Time', 'NCCL Test Iterations'])
-
-ax2.hist(one_df_2GB['duration_ms'], density=True, bins=100)  # density=False would make counts
-ax2.set_ylabel('Probability')
-ax2.set_xlabel('Duration ms')
-ax2.set_xlim([20, 220])
-ax2.axvline(NCCL_Test_allreduce_2GB, color='k', linestyle='dashed', linewidth=1)
-ax2.set_title('All Reduce:Sum Message Size = 2GB')
-ax2.legend(['NCCL Test Reported Time', 'NCCL Test Iterations'])
-
-plt.tight_layout()
-
-plt.savefig('all_reduce_sum.png')
\ No newline at end of file
+import pandas as pd
+
+# nccl_to_csv.py lives with the nccl-tests micro-benchmarks
+NCCL_TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '..', '..', '..', 'micro-benchmarks', 'nccl-tests')
+sys.path.insert(0, os.path.normpath(NCCL_TESTS_DIR))
+from nccl_to_csv import parse_nccl_run  # noqa: E402
+
+# ncclDevKernel_AllReduce_Sum_f32_TREE_LL(...) -> allreduce
+KERNEL_PATTERN = re.compile(r'nccl(?:Dev)?Kernel_([A-Za-z]+)')
+
+DURATION_UNITS_MS = {'ns': 1e-6, 'us': 1e-3, 'μs': 1e-3, 'ms': 1.0, 's': 1e3}
+
+PERCENTILES = [50, 90, 99]
+
+
+def parse_durations_ms(durations):
+    """Convert Nsight Events View durations such as '93.882 ms' to float ms."""
+    if pd.api.types.is_numeric_dtype(durations):
+        return durations.astype('float')
+    parts = durations.astype(str).str.strip().str.split(r'\s+', n=1, expand=True)
+    values = pd.to_numeric(parts[0].str.replace(',', ''), errors='coerce')
+    units = parts[1].fillna('ms') if parts.shape[1] > 1 else pd.Series('ms', index=durations.index)
+    return values * units.map(DURATION_UNITS_MS)
+
+
+def load_kernel_csv(path, collective=None):
+    """Load one exported NCCL kernel CSV as (collective, size_bytes, duration_ms) rows.
+
+    The collective is taken from the kernel Name column unless given
+    explicitly; message sizes may be comma formatted.
+    """
+    df = pd.read_csv(path)
+    if collective is not None:
+        collectives = pd.Series(collective.lower(), index=df.index)
+    else:
+        collectives = df['Name'].astype(str).str.extract(KERNEL_PATTERN, expand=False).str.lower()
+    sizes = pd.to_numeric(df['Message_Size'].astype(str).str.replace(',', ''), errors='coerce')
+    out = pd.DataFrame({
+        'collective': collectives,
+        'size_bytes': sizes,
+        'duration_ms': parse_durations_ms(df['Duration']),
+    })
+    return out.dropna().astype({'size_bytes': 'int64'})
+
+
+def duration_stats(kernels):
+    """Per (collective, message size) percentiles and tail-to-median ratios."""
+    grouped = kernels.groupby(['collective', 'size_bytes'])['duration_ms']
+    stats = grouped.quantile([p / 100 for p in PERCENTILES]).unstack()
+    stats.columns = [f'p{p}_ms' for p in PERCENTILES]
+    stats['max_ms'] = grouped.max()
+    stats['calls'] = grouped.size()
+    stats['p99_over_p50'] = stats['p99_ms'] / stats['p50_ms']
+    stats['max_over_p50'] = stats['max_ms'] / stats['p50_ms']
+    return stats.reset_index()
+
+
+def load_reference_times(paths):
+    """Return reference times in ms from nccl-tests output, indexed by (collective, size_bytes).
+
+    Uses the out-of-place time; when several outputs cover the same
+    collective and size the fastest one is kept.
+    """
+    frames = []
+    for path in paths:
+        rows, metadata = parse_nccl_run(path)
+        if not rows or not metadata['Collective']:
+            print(f"Warning: no nccl-tests results found in {path}", file=sys.stderr)
+            continue
+        frame = pd.DataFrame(rows)[['Size_Bytes', 'OOP_Time_us']]
+        frame['collective'] = metadata['Collective'].lower()
+        frames.append(frame)
+    if not frames:
+        return pd.Series(dtype='float')
+    refs = pd.concat(frames).rename(columns={'Size_Bytes': 'size_bytes'})
+    refs['reference_ms'] = refs['OOP_Time_us'] / 1000
+    return refs.groupby(['collective', 'size_bytes'])['reference_ms'].min()
+
+
+def add_reference(stats, references):
+    if references.empty:
+        stats = stats.assign(reference_ms=np.nan)
+    else:
+        stats = stats.join(references, on=['collective', 'size_bytes'])
+    stats['p50_over_reference'] = stats['p50_ms'] / stats['reference_ms']
+    return stats
+
+
+def plot_distributions(kernels, stats, output, bins=100):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(len(stats), 1, figsize=(8, 3 * len(stats)), squeeze=False)
+    groups = kernels.groupby(['collective', 'size_bytes'])['duration_ms']
+    for ax, row in zip(axes[:, 0], stats.itertuples(index=False)):
+        ax.hist(groups.get_group((row.collective, row.size_bytes)), density=True, bins=bins)
+        ax.axvline(row.p99_ms, color='r', linestyle='dotted', linewidth=1, label='p99')
+        if not np.isnan(row.reference_ms):
+            ax.axvline(row.reference_ms, color='k', linestyle='dashed', linewidth=1,
+                       label='NCCL Test Reported Time')
+        ax.set_ylabel('Probability')
+        ax.set_xlabel('Duration ms')
+        ax.set_title(f'{row.collective} Message Size = {row.size_bytes:,} bytes')
+        ax.legend()
+
+    plt.tight_layout()
+    plt.savefig(output)
+    plt.close(fig)
+
+
+def analyze_job(path, references, output_dir, collective=None, min_calls=1, plot=True):
+    kernels = load_kernel_csv(path, collective)
+    stats = duration_stats(kernels)
+    stats = stats[stats['calls'] >= min_calls]
+    stats = add_reference(stats, references)
+
+    job = os.path.splitext(os.path.basename(path))[0]
+    report = os.path.join(output_dir, f'{job}_durations.csv')
+    stats.to_csv(report, index=False, float_format='%.3f')
+
+    print(f"\n{job}: {len(kernels)} kernels")
+    print(stats.to_string(index=False, float_format=lambda v: f'{v:.3f}'))
+    print(f"Report written to {report}")
+
+    if plot and not stats.empty:
+        image = os.path.join(output_dir, f'{job}_durations.png')
+        plot_distributions(kernels, stats, image)
+        print(f"Plot written to {image}")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Duration distribution of NCCL kernels per collective and message size")
+    parser.add_argument('csv', nargs='*', default=['./all_reduce.csv'],
+                        help='Kernel CSVs exported from the Nsight Events View, one per job '
+                             '(columns Name, Duration, Message_Size; default: ./all_reduce.csv)')
+    parser.add_argument('-r', '--nccl-tests-output', nargs='+', default=[],
+                        help='nccl-tests output files whose reported times are overlaid as reference')
+    parser.add_argument('-c', '--collective', type=str, default=None,
+                        help='Collective for every row, when the CSV has no kernel Name column')
+    parser.add_argument('-o', '--output-dir', type=str, default='.',
+                        help='Directory for the per-job reports (default: %(default)s)')
+    parser.add_argument('--min-calls', type=int, default=1,
+                        help='Skip message sizes with fewer calls (default: %(default)s)')
+    parser.add_argument('--no-plot', action='store_true',
+                        help='Only write the CSV report')
+
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    references = load_reference_times(args.nccl_tests_output)
+    for path in args.csv:
+        analyze_job(path, references, args.output_dir, args.collective, args.min_calls,
+                    plot=not args.no_plot)
@@ -1,110 +1,172 @@
 import argparse
-import subprocess
-import sqlite3
-import pandas as pd
 import ast
-
-def replace_id_with_value(main_df, str_df, id_column, value_col_name=None):
-    """Replace the values in 'id_column' of 'main_df' with the corresponding
-    string value stored in 'str_df'.
-
-    Parameters
-    ----------
-    main_df : dataframe
-        Dataframe containing 'id_column'.
-    str_df : dataframe
-        Dataframe 'StringId' that maps IDs to string values.
-    id_column : str
-        Name of the column that should be replaced with the corresponding
-        string values.
-    value_col_name : str, optional
-        Name of the column that contains the string value of 'id_column'.
-        If not specified, the 'id_column' will be retained as the column name.
-    """
-    renamed_str_df = str_df.rename(columns={"id": id_column})
-    merged_df = main_df.merge(renamed_str_df, on=id_column, how="left")
-
-    # Drop the original 'id_column' column.
-    merged_df = merged_df.drop(columns=[id_column])
-    # Rename the 'value' column.
-    value_col_name = value_col_name or id_column
-    return merged_df.rename(columns={"value": value_col_name})
-
-def combine_text_fields(nvtx_df, str_df):
-    """Combine the 'text' and 'textId' fields of the NVTX dataframe.
-
-    This function simplifies the lookup process for accessing the event
-    message. The 'text' field corresponds to the NVTX event message passed
-    through 'nvtxDomainRegisterString', while the 'textId' field corresponds
-    to the other case. By merging these fields, we streamline the process of
-    retrieving the message.
+import csv
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# NVTX payload events emitted by NCCL carry the call arguments in jsonText
+NCCL_NVTX_EVENT_TYPE = 59
+
+NCCL_OPERATIONS = ['ncclAllReduce', 'ncclAllGather', 'ncclReduceScatter', 'ncclBroadcast']
+
+DEFAULT_NSYS = "/fsxl/nsight-efa/target-linux-x64/nsys"
+
+# Filtering and de-duplication happen inside SQLite, so only one row per
+# distinct (operation, payload) pair with its occurrence count reaches
+# Python. The text/textId merge mirrors nsys: registered strings live in
+# StringIds, everything else in the 'text' column.
+NCCL_PAYLOAD_QUERY = """
+SELECT name, jsonText, COUNT(*) AS calls
+FROM (
+    SELECT COALESCE(s.value, e.text) AS name, e.jsonText AS jsonText
+    FROM NVTX_EVENTS AS e
+    LEFT JOIN StringIds AS s ON e.textId = s.id
+    WHERE e.eventType = ? AND e.jsonText IS NOT NULL
+)
+WHERE name IN ({placeholders})
+GROUP BY name, jsonText
+"""
+
+
+def export_sqlite(report, nsys=DEFAULT_NSYS, force=False):
+    """Export an .nsys-rep report to SQLite and return the .sqlite path.
+
+    The export is skipped when a .sqlite file newer than the report
+    already exists, unless force is set.
     """
-    if not nvtx_df["textId"].notnull().any():
-        return nvtx_df.copy()
-
-    nvtx_textId_df = replace_id_with_value(
-        nvtx_df, str_df, "textId", "textStr"
-    )
-    mask = ~nvtx_textId_df["textStr"].isna()
-    nvtx_textId_df.loc[mask, "text"] = nvtx_textId_df.loc[mask, "textStr"]
-    return nvtx_textId_df.drop(columns=["textStr"])
-
-
-# Create the parser
-parser = argparse.ArgumentParser()
-
-parser.add_argument('-n', '--name', type=str, help='Nsight Report Name')
+    sqlite_file_name = os.path.splitext(report)[0] + '.sqlite'
+    if (not force and os.path.exists(sqlite_file_name)
+            and os.path.getmtime(sqlite_file_name) >= os.path.getmtime(report)):
+        return sqlite_file_name
 
-args = parser.parse_args()
+    subprocess.run([nsys, "export",
+                    "--type", "sqlite",
+                    "--force-overwrite", "true",
+                    "--include-blobs", "true",
+                    "--include-json", "true",
+                    "--output", sqlite_file_name,
+                    report], check=True, stdout=subprocess.DEVNULL)
+    return sqlite_file_name
 
-subprocess.run(["/fsxl/nsight-efa/target-linux-x64/nsys", "export",
-                "--type", "sqlite",
-                "--force-overwrite", "true",
-                "--include-blobs", "true",
-                "--include-json", "true",
-                args.name ])
 
-sqlite_file_name = args.name.split('.')[0]+'.sqlite'
+def find_reports(report_dir):
+    """Return the sorted .nsys-rep files found under report_dir."""
+    reports = []
+    for root, _, names in os.walk(report_dir):
+        reports.extend(os.path.join(root, name) for name in names if name.endswith('.nsys-rep'))
+    return sorted(reports)
 
-print(sqlite_file_name)
 
-conn = sqlite3.connect(sqlite_file_name)
+def export_reports(reports, nsys=DEFAULT_NSYS, jobs=4, force=False):
+    """Export many reports with at most jobs concurrent nsys processes.
 
-nvtx_df = pd.read_sql_query("SELECT * FROM NVTX_EVENTS", conn)
-
-str_df = pd.read_sql_query("SELECT * FROM StringIds", conn)
-
-df = combine_text_fields(nvtx_df, str_df)
-
-nccl_msg_size_df = df.loc[df['eventType']==59,['text','jsonText']].drop_duplicates()
-
-#print(nccl_msg_size_df)
-
-nccl_operations = ['ncclAllReduce','ncclAllGather','ncclReduceScatter','ncclBroadcast']
-
-final_df = pd.DataFrame(columns=['NCCL Operation','Message Size Bytes', 'Reduction Operation'])
-rows_list = []
-for one_operation in nccl_operations:
-    one_df = nccl_msg_size_df.loc[nccl_msg_size_df['text']==one_operation,]
-
-    for index, row in one_df.iterrows():
-        tmp_dict =  ast.literal_eval(row['jsonText'])
-
-        if one_operation == 'ncclAllGather':
-            tmp_dict['Reduction operation'] = 'None'
+    Returns the .sqlite paths in the same order as reports.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        return list(executor.map(lambda report: export_sqlite(report, nsys, force), reports))
 
-        if one_operation == 'ncclBroadcast':
-            tmp_dict['Reduction operation'] = 'None'
-            tmp_dict['Message size [bytes]'] = tmp_dict['Bytes']
 
-        new_row = {'NCCL Operation': one_operation,
-                   'Message Size Bytes': tmp_dict['Message size [bytes]'],
-                   'Reduction Operation': tmp_dict['Reduction operation']
-                   }
-        rows_list.append(new_row)
+def parse_payload(json_text):
+    """Parse an NVTX jsonText payload, falling back to Python literal syntax."""
+    try:
+        return json.loads(json_text)
+    except ValueError:
+        return ast.literal_eval(json_text)
 
-final_df = pd.DataFrame(rows_list)
 
-print(final_df)
+def iter_nccl_payloads(conn, operations=NCCL_OPERATIONS, batch_size=10000):
+    """Yield (operation, payload dict, calls) for distinct NCCL NVTX payloads.
 
-conn.close()
\ No newline at end of file
+    Rows are streamed with fetchmany so memory stays bounded by batch_size
+    regardless of report size.
+    """
+    query = NCCL_PAYLOAD_QUERY.format(placeholders=",".join("?" * len(operations)))
+    cursor = conn.execute(query, [NCCL_NVTX_EVENT_TYPE, *operations])
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for operation, json_text, calls in rows:
+            yield operation, parse_payload(json_text), calls
+
+
+def aggregate_message_sizes(conn, operations=NCCL_OPERATIONS, batch_size=10000):
+    """Return {operation: Counter({(message size bytes, reduction op): calls})}."""
+    histograms = defaultdict(Counter)
+    for operation, payload, calls in iter_nccl_payloads(conn, operations, batch_size):
+        size = payload.get('Message size [bytes]', payload.get('Bytes'))
+        if size is None:
+            continue
+        reduction = payload.get('Reduction operation', 'None')
+        histograms[operation][(int(size), reduction)] += calls
+    return histograms
+
+
+def print_histograms(histograms, operations=NCCL_OPERATIONS, file=sys.stdout):
+    print(f"{'NCCL Operation':<20} {'Message Size Bytes':>20} {'Reduction Operation':<20} {'Calls':>10}",
+          file=file)
+    for operation in operations:
+        for (size, reduction), calls in sorted(histograms.get(operation, {}).items()):
+            print(f"{operation:<20} {size:>20} {reduction:<20} {calls:>10}", file=file)
+
+
+def write_histograms_csv(histograms, path, operations=NCCL_OPERATIONS):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['NCCL Operation', 'Message Size Bytes', 'Reduction Operation', 'Calls'])
+        for operation in operations:
+            for (size, reduction), calls in sorted(histograms.get(operation, {}).items()):
+                writer.writerow([operation, size, reduction, calls])
+
+
+if __name__ == "__main__":
+    # Create the parser
+    parser = argparse.ArgumentParser()
+
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-n', '--name', type=str,
+                        help='Nsight Report Name (.nsys-rep, or an already exported .sqlite)')
+    source.add_argument('-d', '--report-dir', type=str,
+                        help='Directory of per-rank .nsys-rep reports to export and aggregate')
+    parser.add_argument('--nsys', type=str, default=DEFAULT_NSYS,
+                        help=f'Path to the nsys binary used for the export (default: {DEFAULT_NSYS})')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='Concurrent nsys exports in --report-dir mode (default: %(default)s)')
+    parser.add_argument('--force-export', action='store_true',
+                        help='Re-export reports even when a newer .sqlite already exists')
+    parser.add_argument('--operations', nargs='+', default=NCCL_OPERATIONS,
+                        help='NCCL NVTX ranges to extract (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='Rows fetched from SQLite per batch (default: %(default)s)')
+    parser.add_argument('--csv', type=str, default=None,
+                        help='Also write the message size histogram to this CSV file')
+
+    args = parser.parse_args()
+
+    if args.report_dir:
+        reports = find_reports(args.report_dir)
+        if not reports:
+            print(f"No .nsys-rep reports found in {args.report_dir}")
+            sys.exit(1)
+        sqlite_files = export_reports(reports, args.nsys, args.jobs, args.force_export)
+    elif args.name.endswith('.sqlite'):
+        sqlite_files = [args.name]
+    else:
+        sqlite_files = [export_sqlite(args.name, args.nsys, args.force_export)]
+
+    histograms = defaultdict(Counter)
+    for sqlite_file_name in sqlite_files:
+        print(sqlite_file_name)
+        conn = sqlite3.connect(sqlite_file_name)
+        for operation, counts in aggregate_message_sizes(conn, args.operations, args.batch_size).items():
+            histograms[operation].update(counts)
+        conn.close()
+
+    print_histograms(histograms, args.operations)
+    if args.csv:
+        write_histograms_csv(histograms, args.csv, args.operations)
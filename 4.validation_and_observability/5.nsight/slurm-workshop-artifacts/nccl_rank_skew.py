@@ -0,0 +1,203 @@
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import statistics
+import sys
+from array import array
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from get_nccl_msg_size import DEFAULT_NSYS, export_reports, find_reports
+
+# NCCL GPU kernels, e.g. ncclDevKernel_AllReduce_Sum_f32_RING_LL or the
+# older ncclKernel_AllReduce_RING_LL_Sum_float naming.
+NCCL_KERNEL_PATTERN = re.compile(r'^nccl(?:Dev)?Kernel_([A-Za-z]+)')
+
+# Report names produced by nsys-slurm-exec, e.g. ..._rank%q{SLURM_PROCID}_...
+RANK_PATTERN = re.compile(r'rank[_-]?(\d+)')
+
+NCCL_KERNEL_QUERY = """
+SELECT k.start, k.end, s.value
+FROM CUPTI_ACTIVITY_KIND_KERNEL AS k
+JOIN StringIds AS s ON k.shortName = s.id
+WHERE s.value LIKE 'ncclDevKernel%' OR s.value LIKE 'ncclKernel%'
+ORDER BY k.start
+"""
+
+SESSION_START_QUERY = "SELECT utcEpochNs FROM TARGET_INFO_SESSION_START_TIME"
+
+
+def rank_of(path, default):
+    """Return the rank encoded in a report file name, or default."""
+    match = RANK_PATTERN.search(os.path.basename(path))
+    return int(match.group(1)) if match else default
+
+
+def session_start_ns(conn):
+    """Epoch time in ns at which the report's session started, or None if the export lacks it."""
+    try:
+        row = conn.execute(SESSION_START_QUERY).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def load_nccl_intervals(sqlite_file_name, batch_size=10000):
+    """Return ({collective: (starts, ends)}, aligned) of NCCL kernels in launch order.
+
+    The n-th kernel of a collective on a rank is that collective's
+    sequence number n, which is how kernels are matched across ranks.
+    Report timestamps are relative to the report's own session start, so
+    they are shifted by the session start time to epoch ns; aligned is
+    False when the export does not record it. Intervals are kept in
+    compact int64 arrays.
+    """
+    intervals = defaultdict(lambda: (array('q'), array('q')))
+    conn = sqlite3.connect(sqlite_file_name)
+    try:
+        offset = session_start_ns(conn)
+        shift = offset or 0
+        cursor = conn.execute(NCCL_KERNEL_QUERY)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for start, end, name in rows:
+                match = NCCL_KERNEL_PATTERN.match(name)
+                if not match:
+                    continue
+                starts, ends = intervals[match.group(1)]
+                starts.append(start + shift)
+                ends.append(end + shift)
+    finally:
+        conn.close()
+    return dict(intervals), offset is not None
+
+
+def compute_skew(rank_intervals, aligned=True):
+    """Match kernels by (collective, sequence number) across ranks.
+
+    rank_intervals maps rank -> {collective: (starts, ends)}. For every
+    sequence number present on all ranks, returns a record with the start
+    skew (latest minus earliest launch), the duration skew (slowest minus
+    fastest rank) and the rank that launched last. The last rank to arrive
+    is the straggler; the others wait for it inside the kernel, so it
+    usually also has the shortest kernel duration.
+
+    Start times are only comparable across reports on a common clock
+    (epoch time of hosts kept in sync, e.g. by chrony). When they are not
+    aligned, start_skew_ns and late_rank are None.
+    """
+    records = []
+    collectives = set()
+    for intervals in rank_intervals.values():
+        collectives.update(intervals)
+
+    for collective in sorted(collectives):
+        per_rank = {rank: intervals.get(collective, (array('q'), array('q')))
+                    for rank, intervals in rank_intervals.items()}
+        count = min(len(starts) for starts, _ in per_rank.values())
+        for seq in range(count):
+            starts = {rank: per_rank[rank][0][seq] for rank in per_rank}
+            durations = {rank: per_rank[rank][1][seq] - per_rank[rank][0][seq] for rank in per_rank}
+            late_rank = max(starts, key=starts.get) if aligned else None
+            slow_rank = max(durations, key=durations.get)
+            fast_rank = min(durations, key=durations.get)
+            records.append({
+                'collective': collective,
+                'seq': seq,
+                'start_skew_ns': starts[late_rank] - min(starts.values()) if aligned else None,
+                'duration_skew_ns': durations[slow_rank] - durations[fast_rank],
+                'late_rank': late_rank,
+                'slowest_rank': slow_rank,
+                'fastest_rank': fast_rank,
+            })
+    return records
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def print_skew_summary(records, top=10, file=sys.stdout):
+    by_collective = defaultdict(list)
+    for record in records:
+        by_collective[record['collective']].append(record)
+
+    print(f"{'Collective':<16} {'Calls':>7} {'p50 skew us':>12} {'p99 skew us':>12} {'max skew us':>12}"
+          f"  Most frequent late ranks", file=file)
+    for collective, items in sorted(by_collective.items()):
+        skews = [item['duration_skew_ns'] / 1000 for item in items]
+        late = Counter(item['late_rank'] for item in items if item['late_rank'] is not None).most_common(3)
+        late_str = ", ".join(f"rank {rank} ({calls}x)" for rank, calls in late) or "n/a (no session start time)"
+        print(f"{collective:<16} {len(items):>7} {statistics.median(skews):>12.1f} "
+              f"{percentile(skews, 99):>12.1f} {max(skews):>12.1f}  {late_str}", file=file)
+
+    worst = sorted(records, key=lambda record: -record['duration_skew_ns'])[:top]
+    if worst:
+        print(f"\nTop {len(worst)} calls by duration skew:", file=file)
+        for record in worst:
+            late = (f"late rank {record['late_rank']} (start +{record['start_skew_ns'] / 1000:.1f} us), "
+                    if record['late_rank'] is not None else "")
+            print(f"  {record['collective']} #{record['seq']}: skew {record['duration_skew_ns'] / 1000:.1f} us, "
+                  f"{late}slowest rank {record['slowest_rank']}, fastest rank {record['fastest_rank']}", file=file)
+
+
+def write_skew_csv(records, path):
+    fieldnames = ['collective', 'seq', 'start_skew_ns', 'duration_skew_ns',
+                  'late_rank', 'slowest_rank', 'fastest_rank']
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge NCCL kernel timelines across per-rank Nsight reports and report per-collective skew")
+    parser.add_argument('-d', '--report-dir', type=str, required=True,
+                        help='Directory of per-rank .nsys-rep reports')
+    parser.add_argument('--nsys', type=str, default=DEFAULT_NSYS,
+                        help=f'Path to the nsys binary used for the export (default: {DEFAULT_NSYS})')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='Concurrent nsys exports and SQLite readers (default: %(default)s)')
+    parser.add_argument('--force-export', action='store_true',
+                        help='Re-export reports even when a newer .sqlite already exists')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of worst calls to list (default: %(default)s)')
+    parser.add_argument('--csv', type=str, default=None,
+                        help='Also write per-call skew records to this CSV file')
+
+    args = parser.parse_args()
+
+    reports = find_reports(args.report_dir)
+    if len(reports) < 2:
+        print(f"Need at least two .nsys-rep reports in {args.report_dir}, found {len(reports)}")
+        sys.exit(1)
+
+    sqlite_files = export_reports(reports, args.nsys, args.jobs, args.force_export)
+    ranks = [rank_of(report, index) for index, report in enumerate(reports)]
+    if len(set(ranks)) != len(ranks):
+        ranks = list(range(len(reports)))
+
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        loaded = list(executor.map(load_nccl_intervals, sqlite_files))
+    rank_intervals = {rank: intervals for rank, (intervals, _) in zip(ranks, loaded)}
+    aligned = all(rank_aligned for _, rank_aligned in loaded)
+    if not aligned:
+        print("Some reports have no session start time; reporting duration skew only")
+
+    records = compute_skew(rank_intervals, aligned)
+    if not records:
+        print("No NCCL kernels common to all ranks were found")
+        sys.exit(1)
+
+    print_skew_summary(records, args.top)
+    if args.csv:
+        write_skew_csv(records, args.csv)
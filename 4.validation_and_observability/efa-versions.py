@@ -3,100 +3,240 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-import subprocess
+import argparse
+import json
+import os
 import re
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
 from prettytable import PrettyTable
-import argparse
 
-def get_efa_installer_version(container=[]):
-    try:
-        version = subprocess.check_output(container + ['cat', '/opt/amazon/efa_installed_packages'])
-        version = version.decode('utf-8')
-        version = re.search(r'# EFA installer version: (\d+\.\d+\.\d+)', version).group(1)
-        return version
-    except Exception as e:
-        print(f'Error: {e}')
-        return None
+# Packages reported for every target, in table order
+PACKAGES = [
+    ('efa_installer', 'EFA installer version:'),
+    ('nccl', 'NCCL Version'),
+    ('libfabric', 'Libfabric Version'),
+    ('aws_ofi_nccl', 'AWS OFI NCCL version:'),
+    ('nvidia_driver', 'Nvidia Driver'),
+    ('cuda', 'CUDA Version:'),
+]
 
-def get_libfabric_version(container=[]):
-    try:
-        version = subprocess.check_output(container + ['fi_info', '--version'])
-        version = version.decode('utf-8')
-        version = re.search(r'libfabric: (\d+\.\d+\.\d+)', version).group(1)
-        return version
-    except Exception as e:
-        print(f'Error: {e}')
-        return None
+# Scans a shared library for the aws-ofi-nccl version through mmap instead of
+# piping the whole file through strings. Runs inside the target, so it only
+# uses double quotes to survive the single-quoted shell embedding below.
+OFI_SCAN_PY = r'''
+import mmap, re, sys
+with open(sys.argv[1], "rb") as f:
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        match = re.search(rb"aws-ofi-nccl (\d+\.\d+\.\d+)", m)
+        print(match.group(1).decode() if match else "")
+'''
 
-def get_nccl_version(container=[]):
-    try:
-        version = subprocess.check_output(container + ['locate', 'nccl'])
-        version = version.decode('utf-8')
-        print(version)
-        version = re.search(r'/usr/local/cuda-12.8/lib/libnccl.so.(\d+\.\d+\.\d+)', version).group(1)
-        return version
-    except Exception as e:
-        print(f'Error: {e}')
-        return None
+# All probes run in one shell per target, so a container is started only
+# once. libnccl and libnccl-net are located through the ld.so cache.
+PROBE_SCRIPT = r'''
+scan_ofi() {
+    if command -v python3 > /dev/null 2>&1; then
+        python3 -c '%s' "$1"
+    else
+        grep -aoE "aws-ofi-nccl [0-9]+\.[0-9]+\.[0-9]+" "$1" | head -n 1
+    fi
+}
+echo "@@efa_installer"
+cat /opt/amazon/efa_installed_packages 2>/dev/null
+echo "@@libfabric"
+fi_info --version 2>/dev/null
+echo "@@nccl"
+ldconfig -p 2>/dev/null | awk '/libnccl\.so/ {print $NF}' | while read -r lib; do readlink -f "$lib"; done
+echo "@@aws_ofi_nccl"
+for lib in $(ldconfig -p 2>/dev/null | awk '/libnccl-net/ {print $NF}') \
+           $(cat /etc/ld.so.conf.d/100_ofinccl.conf 2>/dev/null | sed 's|$|/libnccl-net.so|') \
+           /opt/amazon/ofi-nccl/lib/libnccl-net.so /opt/aws-ofi-nccl/lib/libnccl-net.so; do
+    if [ -f "$lib" ]; then
+        scan_ofi "$lib"
+        break
+    fi
+done
+echo "@@nvidia_driver"
+nvidia-smi --query-gpu=driver_version --format=csv,noheader 2>/dev/null | head -n 1
+echo "@@cuda"
+(nvcc --version || /usr/local/cuda/bin/nvcc --version) 2>/dev/null
+''' % OFI_SCAN_PY.strip()
+
+VERSION_PATTERNS = {
+    'efa_installer': re.compile(r'# EFA installer version: (\d+\.\d+\.\d+)'),
+    'libfabric': re.compile(r'libfabric: (\d+\.\d+\.\d+)'),
+    'nccl': re.compile(r'libnccl\.so\.(\d+\.\d+\.\d+)'),
+    'aws_ofi_nccl': re.compile(r'(\d+\.\d+\.\d+)'),
+    'nvidia_driver': re.compile(r'(\d+\.\d+(?:\.\d+)?)'),
+    'cuda': re.compile(r', V(\d+\.\d+\.\d+)'),
+}
 
-def get_aws_ofi_nccl_version(container=[]):
+DEFAULT_CACHE_FILE = os.path.expanduser('~/.cache/efa-versions/images.json')
+
+# The driver seen inside a container is the host's, so it is never cached per image
+HOST_PACKAGES = {'nvidia_driver'}
+
+
+def parse_probe_output(output):
+    """Split the probe script output into sections and extract one version per package."""
+    sections = {}
+    current = None
+    for line in output.splitlines():
+        if line.startswith('@@'):
+            current = line[2:].strip()
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+
+    versions = {}
+    for package, pattern in VERSION_PATTERNS.items():
+        match = pattern.search('\n'.join(sections.get(package, [])))
+        versions[package] = match.group(1) if match else None
+    return versions
+
+
+def run_probe(command, timeout=300):
     try:
-        lib_path = subprocess.check_output(container + ['cat', '/etc/ld.so.conf.d/100_ofinccl.conf']).decode().strip()
-        version = subprocess.check_output(container + ['strings', f'{lib_path}/libnccl-net.so'])
-        version = version.decode('utf-8')
-        version = re.search(r'NET/OFI Initializing aws-ofi-nccl (\d+\.\d+\.\d+)', version).group(1)
-        return version
-    except Exception as e:
-        print(f'Error: {e}')
-        return None
+        output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                timeout=timeout, check=False).stdout
+        return parse_probe_output(output.decode('utf-8', errors='replace'))
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return {package: None for package in VERSION_PATTERNS}
+
+
+def probe_local(_target=None, timeout=300):
+    return run_probe(['sh', '-c', PROBE_SCRIPT], timeout)
+
+
+def probe_host(host, timeout=300):
+    return run_probe(['ssh', '-o', 'BatchMode=yes', host, 'sh', '-c', _shell_quote(PROBE_SCRIPT)], timeout)
 
-def get_cuda_driver_version(container=[]):
+
+def probe_image(image, timeout=300):
+    return run_probe(['docker', 'run', '--rm', '--gpus=all', '--entrypoint', 'sh', image,
+                      '-c', PROBE_SCRIPT], timeout)
+
+
+def _shell_quote(text):
+    return "'" + text.replace("'", "'\"'\"'") + "'"
+
+
+def image_digest(image):
+    """Return the local image ID (content digest) of a container image, or None."""
     try:
-        version = subprocess.check_output(container + ['nvidia-smi'])
-        version = version.decode('utf-8')
-        version = re.search(r'Driver Version: (\d+\.\d+\.\d+)', version).group(1)
-        return version
-    except Exception as e:
-        print(f'Error: {e}')
+        return subprocess.check_output(
+            ['docker', 'image', 'inspect', '--format', '{{.Id}}', image],
+            stderr=subprocess.DEVNULL).decode().strip() or None
+    except (OSError, subprocess.CalledProcessError):
         return None
 
-def get_cuda_version(container=[]):
+
+def load_cache(cache_file):
     try:
-        version = subprocess.check_output(container + ['nvcc', '--version'])
-        version = version.decode('utf-8')
-        version = re.search(r', V(\d+\.\d+\.\d+)', version).group(1)
-        return version
-    except Exception as e:
-        print(f'Error: {e}')
-        return None
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache_file, cache):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = f'{cache_file}.tmp.{os.getpid()}'
+    with open(tmp_file, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_file, cache_file)
+
+
+def inventory(hosts=(), images=(), include_local=True, jobs=8, cache_file=DEFAULT_CACHE_FILE,
+              timeout=300):
+    """Probe the local machine, remote hosts and container images concurrently.
+
+    Returns an ordered {target: {package: version}} matrix. Container images
+    are cached by image digest, so an unchanged image is never started twice.
+    """
+    cache = load_cache(cache_file) if cache_file else {}
+    targets = []
+    if include_local:
+        targets.append(('local', probe_local, None))
+    targets += [(host, probe_host, host) for host in hosts]
+
+    image_targets = []
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        digests = list(executor.map(image_digest, images))
+    for image, digest in zip(images, digests):
+        if digest and digest in cache:
+            image_targets.append((image, digest, cache[digest]))
+        else:
+            image_targets.append((image, digest, None))
+            targets.append((image, probe_image, image))
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = [(name, executor.submit(probe, arg, timeout)) for name, probe, arg in targets]
+        probed = {name: future.result() for name, future in futures}
+
+    matrix = {}
+    for name in ['local'] * include_local + list(hosts):
+        matrix[name] = probed[name]
+    for image, digest, cached in image_targets:
+        versions = dict(cached) if cached is not None else probed[image]
+        if cached is None and digest:
+            cache[digest] = {k: v for k, v in versions.items() if k not in HOST_PACKAGES}
+        if 'local' in matrix:
+            versions['nvidia_driver'] = matrix['local']['nvidia_driver']
+        # The driver is a host package: unknown for a cached image without a local probe
+        versions.setdefault('nvidia_driver', None)
+        matrix[image] = versions
+
+    if cache_file:
+        save_cache(cache_file, cache)
+    return matrix
+
 
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='This script checks the versions of NCCL, EFA, Libfabric and CUDA. ')
-    parser.add_argument('-c', '--container-image', type=str, help='Container image to get versions from.')
+    parser.add_argument('-c', '--container-image', type=str, nargs='+', default=[],
+                        help='Container images to get versions from.')
+    parser.add_argument('--hosts', type=str, nargs='+', default=[],
+                        help='Remote hosts to probe over ssh.')
+    parser.add_argument('--no-local', action='store_true',
+                        help='Do not probe the local machine.')
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help='Number of targets probed concurrently (default: %(default)s).')
+    parser.add_argument('--timeout', type=int, default=300,
+                        help='Timeout in seconds for each target (default: %(default)s).')
+    parser.add_argument('--cache-file', type=str, default=DEFAULT_CACHE_FILE,
+                        help='Image digest cache (default: %(default)s).')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Probe every container image even if its digest is cached.')
+    parser.add_argument('--json', type=str, default=None,
+                        help='Write the version matrix as JSON to this file ("-" for stdout).')
     args = parser.parse_args()
 
     if args.container_image:
-        table = PrettyTable(["Package", "Local", "Container"])
-        print(f'Getting versions from container image {args.container_image}.')
-        container=['docker', 'run', '--gpus=all', args.container_image]
-        table.add_row(["EFA installer version:", get_efa_installer_version(), get_efa_installer_version(container)])
-        table.add_row(['NCCL Version', get_nccl_version(), get_nccl_version(container)])
-        table.add_row(['Libfabric Version', get_libfabric_version(), get_libfabric_version(container)])
-        table.add_row(["AWS OFI NCCL version:", get_aws_ofi_nccl_version(), get_aws_ofi_nccl_version(container)])
-        table.add_row(['Nvidia Driver', get_cuda_driver_version(), get_cuda_driver_version(container)])
-        table.add_row(["CUDA Version:", get_cuda_version(), get_cuda_version(container)])
+        print(f'Getting versions from container images {", ".join(args.container_image)}.', file=sys.stderr)
+
+    matrix = inventory(args.hosts, args.container_image, not args.no_local, args.jobs,
+                       None if args.no_cache else args.cache_file, args.timeout)
+
+    if args.json == '-':
+        print(json.dumps(matrix, indent=2))
     else:
-        table = PrettyTable(["Package", "Version"])
-        table.add_row(["EFA installer version:", get_efa_installer_version(),])
-        table.add_row(['NCCL Version', get_nccl_version()])
-        table.add_row(['Libfabric Version', get_libfabric_version()])
-        table.add_row(["AWS OFI NCCL version:", get_aws_ofi_nccl_version()])
-        table.add_row(['Nvidia Driver', get_cuda_driver_version()])
-        table.add_row(["CUDA Version:", get_cuda_version()])
-
-    table.align = "l"  # Align the columns to the left
-    table.padding_width = 2  # Set the padding width for each cell
-    table.hrules = 1  # Add horizontal rules between rows
-
-    print(table)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(matrix, f, indent=2)
+
+        targets = list(matrix)
+        table = PrettyTable(["Package"] + [t.capitalize() if t == 'local' else t for t in targets])
+        for package, label in PACKAGES:
+            table.add_row([label] + [matrix[t].get(package) for t in targets])
+
+        table.align = "l"  # Align the columns to the left
+        table.padding_width = 2  # Set the padding width for each cell
+        table.hrules = 1  # Add horizontal rules between rows
+
+        print(table)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+NCCL Bandwidth History and Regression Comparator
+Keeps an append-only SQLite store of parsed nccl-tests runs and flags bus
+bandwidth regressions per message size against the last N matching runs.
+
+Record runs (already ingested files are skipped):
+    python nccl_history.py ingest logs/ --instance-type p5en.48xlarge
+
+Compare a new run against history (exit code 1 on regression):
+    python nccl_history.py compare logs/nccl-tests-container_4242.out \\
+        --instance-type p5en.48xlarge --min-size 256M --max-size 8G
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import time
+
+from nccl_to_csv import expand_inputs, parse_nccl_run
+
+DEFAULT_DB = "nccl_history.db"
+
+# Scale factor turning the median absolute deviation into a standard deviation
+# estimate for normally distributed samples.
+MAD_SCALE = 1.4826
+
+SIZE_SUFFIXES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file TEXT NOT NULL UNIQUE,
+    job_id TEXT,
+    ingested_at REAL NOT NULL,
+    instance_type TEXT NOT NULL,
+    nodes INTEGER,
+    collective TEXT,
+    nccl_version TEXT,
+    ofi_nccl_version TEXT,
+    avg_busbw REAL
+);
+CREATE INDEX IF NOT EXISTS runs_key
+    ON runs (instance_type, nodes, collective, run_id);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    size_bytes INTEGER NOT NULL,
+    oop_time_us REAL,
+    oop_busbw REAL,
+    ip_time_us REAL,
+    ip_busbw REAL
+);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_id, size_bytes);
+"""
+
+
+def parse_size(value):
+    """Parse a message size such as 1048576, 256M or 8G into bytes"""
+    value = str(value).strip().upper().rstrip('B')
+    if value and value[-1] in SIZE_SUFFIXES:
+        return int(float(value[:-1]) * SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+
+def format_size(size_bytes):
+    """Format a byte count using the largest binary unit that divides it"""
+    for suffix, factor in sorted(SIZE_SUFFIXES.items(), key=lambda item: -item[1]):
+        if size_bytes >= factor and size_bytes % factor == 0:
+            return f"{size_bytes // factor}{suffix}"
+    return str(size_bytes)
+
+
+def size_bucket(size_bytes):
+    """Round a message size down to a power of two so sweeps with different step factors line up"""
+    if size_bytes <= 0:
+        return 0
+    return 1 << (size_bytes.bit_length() - 1)
+
+
+def open_db(path):
+    """Open (and create if needed) the history database"""
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def record_run(conn, rows, metadata, instance_type):
+    """Append one parsed run to the store; returns run_id or None if already present"""
+    try:
+        cursor = conn.execute(
+            "INSERT INTO runs (file, job_id, ingested_at, instance_type, nodes, collective,"
+            " nccl_version, ofi_nccl_version, avg_busbw) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(metadata['File']), metadata['Job_ID'], time.time(), instance_type,
+             metadata['Nodes'], metadata['Collective'], metadata['NCCL_Version'],
+             metadata['OFI_NCCL_Version'], metadata['Avg_BusBW_GBps']))
+    except sqlite3.IntegrityError:
+        return None
+
+    run_id = cursor.lastrowid
+    conn.executemany(
+        "INSERT INTO results (run_id, size_bytes, oop_time_us, oop_busbw, ip_time_us, ip_busbw)"
+        " VALUES (?, ?, ?, ?, ?, ?)",
+        [(run_id, row['Size_Bytes'], row['OOP_Time_us'], row['OOP_BusBW_GBps'],
+          row['IP_Time_us'], row['IP_BusBW_GBps']) for row in rows])
+    return run_id
+
+
+def ingest(conn, files, instance_type):
+    """Parse and record every file that is not already in the store"""
+    known = {row[0] for row in conn.execute("SELECT file FROM runs")}
+    added = 0
+    for path in files:
+        if os.path.abspath(path) in known:
+            continue
+        rows, metadata = parse_nccl_run(path)
+        if not rows:
+            continue
+        with conn:
+            if record_run(conn, rows, metadata, instance_type) is not None:
+                added += 1
+    return added
+
+
+def load_run_busbw(conn, run_id, metric):
+    """Return {size_bucket: busbw} for one stored run"""
+    column = 'ip_busbw' if metric == 'ip' else 'oop_busbw'
+    return {size_bucket(size): busbw for size, busbw in conn.execute(
+        f"SELECT size_bytes, {column} FROM results WHERE run_id = ?", (run_id,))}
+
+
+def baseline_runs(conn, instance_type, nodes, collective, last_n, exclude_run_id=None,
+                  nccl_version=None, ofi_nccl_version=None):
+    """Return the run_ids of the last N runs matching the comparison key, newest first"""
+    query = ("SELECT run_id FROM runs WHERE instance_type = ? AND nodes IS ? AND collective IS ?"
+             " AND run_id IS NOT ?")
+    params = [instance_type, nodes, collective, exclude_run_id]
+    if nccl_version:
+        query += " AND nccl_version = ?"
+        params.append(nccl_version)
+    if ofi_nccl_version:
+        query += " AND ofi_nccl_version = ?"
+        params.append(ofi_nccl_version)
+    query += " ORDER BY run_id DESC LIMIT ?"
+    params.append(last_n)
+    return [row[0] for row in conn.execute(query, params)]
+
+
+def compare_busbw(candidate, baselines, min_size=0, max_size=None,
+                  threshold_pct=5.0, mad_threshold=3.0):
+    """Compare candidate busbw per size bucket against baseline runs
+
+    candidate is {size_bucket: busbw} and baselines is a list of such dicts.
+    A bucket is flagged as a regression when the candidate is more than
+    threshold_pct below the baseline median and, if the baseline has any
+    spread, its robust z-score (deviation / scaled MAD) is below
+    -mad_threshold.
+    """
+    report = []
+    for size in sorted(candidate):
+        if size < min_size or (max_size is not None and size > max_size):
+            continue
+        history = [run[size] for run in baselines if size in run]
+        if not history:
+            continue
+        median = statistics.median(history)
+        mad = statistics.median(abs(value - median) for value in history) * MAD_SCALE
+        value = candidate[size]
+        delta_pct = (value - median) / median * 100 if median else 0.0
+        robust_z = (value - median) / mad if mad else None
+        regression = delta_pct < -threshold_pct and (robust_z is None or robust_z < -mad_threshold)
+        report.append({
+            'size': size,
+            'busbw': value,
+            'median': median,
+            'mad': mad,
+            'delta_pct': delta_pct,
+            'robust_z': robust_z,
+            'samples': len(history),
+            'regression': regression,
+        })
+    return report
+
+
+def print_report(report, header):
+    print(header)
+    print(f"{'Size':>8} {'BusBW':>9} {'Median':>9} {'MAD':>7} {'Delta%':>8} {'RobustZ':>8} {'N':>3}  Status")
+    for entry in report:
+        robust_z = f"{entry['robust_z']:8.2f}" if entry['robust_z'] is not None else f"{'-':>8}"
+        status = "REGRESSION" if entry['regression'] else "ok"
+        print(f"{format_size(entry['size']):>8} {entry['busbw']:9.2f} {entry['median']:9.2f} "
+              f"{entry['mad']:7.2f} {entry['delta_pct']:8.2f} {robust_z} {entry['samples']:>3}  {status}")
+
+
+def cmd_ingest(args):
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("No input files found")
+        sys.exit(1)
+    conn = open_db(args.db)
+    added = ingest(conn, files, args.instance_type)
+    print(f"Recorded {added} new runs ({len(files) - added} skipped) in {args.db}")
+
+
+def cmd_compare(args):
+    conn = open_db(args.db)
+
+    if os.path.isfile(args.run):
+        rows, metadata = parse_nccl_run(args.run)
+        if not rows:
+            print(f"No NCCL performance data found in {args.run}")
+            sys.exit(1)
+        existing = conn.execute("SELECT run_id FROM runs WHERE file = ?",
+                                (os.path.abspath(args.run),)).fetchone()
+        run_id = existing[0] if existing else None
+        key = (args.instance_type, metadata['Nodes'], metadata['Collective'])
+        column = 'IP_BusBW_GBps' if args.metric == 'ip' else 'OOP_BusBW_GBps'
+        candidate = {size_bucket(row['Size_Bytes']): row[column] for row in rows}
+        versions = (metadata['NCCL_Version'], metadata['OFI_NCCL_Version'])
+    else:
+        found = conn.execute(
+            "SELECT run_id, instance_type, nodes, collective, nccl_version, ofi_nccl_version"
+            " FROM runs WHERE run_id = ?", (args.run,)).fetchone()
+        if not found:
+            print(f"Run {args.run} is neither a file nor a stored run id")
+            sys.exit(1)
+        run_id = found[0]
+        key = found[1:4]
+        candidate = load_run_busbw(conn, run_id, args.metric)
+        versions = found[4:6]
+
+    baseline_ids = baseline_runs(conn, *key, args.last, exclude_run_id=run_id,
+                                 nccl_version=args.baseline_nccl_version,
+                                 ofi_nccl_version=args.baseline_ofi_nccl_version)
+    if not baseline_ids:
+        print("No baseline runs found for instance type %s, %s nodes, collective %s" % key)
+        sys.exit(1)
+
+    baselines = [load_run_busbw(conn, baseline_id, args.metric) for baseline_id in baseline_ids]
+    report = compare_busbw(candidate, baselines,
+                           min_size=parse_size(args.min_size),
+                           max_size=parse_size(args.max_size) if args.max_size else None,
+                           threshold_pct=args.threshold, mad_threshold=args.mad_threshold)
+
+    print_report(report, f"{key[2]} on {key[1]}x {key[0]} (NCCL {versions[0]}, aws-ofi-nccl "
+                         f"{versions[1]}) vs last {len(baselines)} runs, {args.metric} busbw GB/s")
+
+    regressions = [entry for entry in report if entry['regression']]
+    if regressions:
+        print(f"\n{len(regressions)} message size(s) regressed")
+        sys.exit(1)
+    print("\nNo busbw regressions detected")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Store nccl-tests results and detect bus bandwidth regressions",
+    )
+    parser.add_argument(
+        "--db",
+        help=f"SQLite history database (default: {DEFAULT_DB})",
+        default=DEFAULT_DB
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Record NCCL output files in the store")
+    ingest_parser.add_argument("inputs", nargs="+", help="NCCL output files, directories or globs")
+    ingest_parser.add_argument(
+        "--instance-type",
+        help="EC2 instance type the runs were executed on",
+        required=True
+    )
+    ingest_parser.set_defaults(func=cmd_ingest)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare a run against stored history")
+    compare_parser.add_argument("run", help="NCCL output file or stored run id")
+    compare_parser.add_argument(
+        "--instance-type",
+        help="EC2 instance type of the run (required when comparing a file)",
+        default=None
+    )
+    compare_parser.add_argument("--last", type=int, default=10,
+                                help="Number of most recent matching runs to use as baseline (default: 10)")
+    compare_parser.add_argument("--metric", choices=["oop", "ip"], default="oop",
+                                help="Out-of-place or in-place bus bandwidth (default: oop)")
+    compare_parser.add_argument("--min-size", default="0",
+                                help="Smallest message size to compare, e.g. 256M (default: 0)")
+    compare_parser.add_argument("--max-size", default=None,
+                                help="Largest message size to compare, e.g. 8G (default: no limit)")
+    compare_parser.add_argument("--threshold", type=float, default=5.0,
+                                help="Minimum drop vs baseline median in percent (default: 5)")
+    compare_parser.add_argument("--mad-threshold", type=float, default=3.0,
+                                help="Robust z-score below which a drop is significant (default: 3)")
+    compare_parser.add_argument("--baseline-nccl-version", default=None,
+                                help="Only use baseline runs with this NCCL version")
+    compare_parser.add_argument("--baseline-ofi-nccl-version", default=None,
+                                help="Only use baseline runs with this aws-ofi-nccl version")
+    compare_parser.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    if args.command == "compare" and os.path.isfile(args.run) and not args.instance_type:
+        parser.error("--instance-type is required when comparing a file")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+NCCL Alpha-Beta Performance Model
+Fits piecewise latency + inverse-bandwidth (alpha-beta) models to nccl-tests
+output and predicts collective time for any message size and node count.
+
+Each (collective, node count) curve is split into contiguous message size
+segments, one per regime visible in the sweep (the LL / LL128 / Simple protocol
+transitions show up as kinks), and every segment is fitted as
+
+    time_us = alpha_us + size_bytes * beta_us_per_byte
+
+Fit models from one or more sweeps:
+    python nccl_perf_model.py fit logs/ --output nccl_model.json
+
+Predict a collective time:
+    python nccl_perf_model.py predict --model nccl_model.json \\
+        --collective allreduce --size 256M --nodes 32
+"""
+
+import argparse
+import json
+import math
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+from nccl_history import format_size, parse_size
+from nccl_to_csv import expand_inputs, parse_nccl_run
+
+# Bus bandwidth correction factors from nccl-tests (see README "Understanding
+# NCCL Bandwidth"), used to rescale the bandwidth term to another rank count.
+BUS_FACTORS = {
+    'allreduce': lambda n: 2 * (n - 1) / n,
+    'reducescatter': lambda n: (n - 1) / n,
+    'allgather': lambda n: (n - 1) / n,
+    'alltoall': lambda n: (n - 1) / n,
+    'gather': lambda n: (n - 1) / n,
+    'scatter': lambda n: (n - 1) / n,
+}
+
+
+def bus_factor(collective, nranks):
+    """Ratio of bus bandwidth to algorithm bandwidth for a collective"""
+    if nranks <= 1:
+        return 1.0
+    return BUS_FACTORS.get(collective, lambda n: 1.0)(nranks)
+
+
+def segment_costs(sizes, times, min_points=3):
+    """Weighted least squares fit of every contiguous segment at once
+
+    Minimises the sum of squared *relative* errors ((alpha + beta*s - t) / t)^2
+    so that microsecond latencies and multi-second transfers weigh equally.
+    Returns (cost, alpha, beta) matrices where entry [i, j] describes the fit
+    over points i..j-1; segments shorter than min_points get an infinite cost.
+    """
+    s = np.asarray(sizes, dtype=np.float64)
+    t = np.asarray(times, dtype=np.float64)
+    w = 1.0 / np.square(t)
+
+    def prefix(values):
+        return np.concatenate(([0.0], np.cumsum(values)))
+
+    sw, sws, swss = prefix(w), prefix(w * s), prefix(w * s * s)
+    swt, swst, swtt = prefix(w * t), prefix(w * s * t), prefix(w * t * t)
+
+    def span(p):
+        # p[j] - p[i] for every (i, j) pair
+        return p[np.newaxis, :] - p[:, np.newaxis]
+
+    W, S, SS = span(sw), span(sws), span(swss)
+    T, ST, TT = span(swt), span(swst), span(swtt)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        det = W * SS - S * S
+        beta = (W * ST - S * T) / det
+        alpha = (T - beta * S) / W
+        cost = (TT - 2 * alpha * T - 2 * beta * ST
+                + alpha * alpha * W + 2 * alpha * beta * S + beta * beta * SS)
+
+    n = len(s)
+    i, j = np.indices((n + 1, n + 1))
+    invalid = (j - i < min_points) | ~np.isfinite(cost) | (np.abs(det) <= 0)
+    cost = np.where(invalid, np.inf, np.maximum(cost, 0.0))
+    return cost, alpha, beta
+
+
+def fit_piecewise(sizes, times, max_segments=4, min_points=3):
+    """Fit a piecewise alpha-beta model to one size sweep
+
+    Breakpoints are placed by dynamic programming over the segment cost matrix
+    and the number of segments is chosen by the Bayesian information criterion,
+    so a single regime is not split just to chase noise.
+    """
+    order = np.argsort(sizes)
+    sizes = np.asarray(sizes, dtype=np.float64)[order]
+    times = np.asarray(times, dtype=np.float64)[order]
+    n = len(sizes)
+    if n < min_points:
+        raise ValueError(f"need at least {min_points} message sizes to fit, got {n}")
+
+    cost, alpha, beta = segment_costs(sizes, times, min_points)
+    max_segments = max(1, min(max_segments, n // min_points))
+
+    # best[k, j]: minimal cost of covering points 0..j-1 with k segments
+    best = np.full((max_segments + 1, n + 1), np.inf)
+    split = np.zeros((max_segments + 1, n + 1), dtype=np.int64)
+    best[0, 0] = 0.0
+    for k in range(1, max_segments + 1):
+        candidates = best[k - 1][:, np.newaxis] + cost
+        split[k] = np.argmin(candidates, axis=0)
+        best[k] = candidates[split[k], np.arange(n + 1)]
+
+    def bic(k):
+        return n * math.log(max(best[k, n], 1e-12) / n) + 3 * k * math.log(n)
+
+    num_segments = min((k for k in range(1, max_segments + 1) if np.isfinite(best[k, n])), key=bic)
+
+    bounds = []
+    end = n
+    for k in range(num_segments, 0, -1):
+        start = int(split[k, end])
+        bounds.append((start, end))
+        end = start
+    bounds.reverse()
+
+    segments = []
+    for start, end in bounds:
+        segments.append({
+            'min_size': int(sizes[start]),
+            'max_size': int(sizes[end - 1]),
+            'alpha_us': float(alpha[start, end]),
+            'beta_us_per_byte': float(beta[start, end]),
+        })
+    for segment in segments:
+        beta_value = segment['beta_us_per_byte']
+        segment['bandwidth_GBps'] = round(1e-3 / beta_value, 3) if beta_value > 0 else None
+
+    residual = float(np.sqrt(best[num_segments, n] / n))
+    return {'segments': segments, 'rms_relative_error': residual}
+
+
+def collect_sweeps(files, metric='oop'):
+    """Group parsed runs into {(collective, nodes): {size: [times]}}"""
+    column = 'IP_Time_us' if metric == 'ip' else 'OOP_Time_us'
+    sweeps = defaultdict(lambda: defaultdict(list))
+    for path in files:
+        rows, metadata = parse_nccl_run(path)
+        if not rows or metadata['Collective'] is None or metadata['Nodes'] is None:
+            continue
+        key = (metadata['Collective'], metadata['Nodes'])
+        for row in rows:
+            if row['Size_Bytes'] > 0 and row[column] > 0:
+                sweeps[key][row['Size_Bytes']].append(row[column])
+    return sweeps
+
+
+def fit_models(sweeps, gpus_per_node=8, max_segments=4):
+    """Fit one piecewise model per (collective, nodes) using the median time per size"""
+    models = []
+    for (collective, nodes), by_size in sorted(sweeps.items()):
+        sizes = np.fromiter(by_size.keys(), dtype=np.float64)
+        times = np.array([np.median(values) for values in by_size.values()])
+        try:
+            fit = fit_piecewise(sizes, times, max_segments=max_segments)
+        except ValueError as e:
+            print(f"Skipping {collective} on {nodes} nodes: {e}", file=sys.stderr)
+            continue
+        models.append({
+            'collective': collective,
+            'nodes': nodes,
+            'gpus_per_node': gpus_per_node,
+            'runs': max(len(values) for values in by_size.values()),
+            **fit,
+        })
+    return models
+
+
+def evaluate(model, size_bytes):
+    """Predict time in microseconds from a single fitted model"""
+    segments = model['segments']
+    chosen = segments[-1]
+    for current, following in zip(segments, segments[1:]):
+        # Switch segments at the geometric midpoint between the two sweeps points
+        boundary = math.sqrt(current['max_size'] * following['min_size'])
+        if size_bytes < boundary:
+            chosen = current
+            break
+    return chosen['alpha_us'] + size_bytes * chosen['beta_us_per_byte']
+
+
+def predict(models, collective, size_bytes, nodes):
+    """Predict collective time in microseconds for any message size and node count
+
+    Node counts that were measured use their own model. Other node counts are
+    interpolated log-linearly in log2(nodes) between the nearest measured
+    counts; with a single measured count the bandwidth term is rescaled by the
+    collective's bus factor.
+    """
+    candidates = sorted((m for m in models if m['collective'] == collective),
+                        key=lambda m: m['nodes'])
+    if not candidates:
+        raise KeyError(f"no model for collective {collective}")
+
+    for model in candidates:
+        if model['nodes'] == nodes:
+            return evaluate(model, size_bytes)
+
+    if len(candidates) == 1:
+        model = candidates[0]
+        gpus = model['gpus_per_node']
+        scale = bus_factor(collective, nodes * gpus) / bus_factor(collective, model['nodes'] * gpus)
+        return evaluate(model, size_bytes * scale)
+
+    below = [m for m in candidates if m['nodes'] < nodes]
+    above = [m for m in candidates if m['nodes'] > nodes]
+    if below and above:
+        low, high = below[-1], above[0]
+    elif above:
+        low, high = above[0], above[1]
+    else:
+        low, high = below[-2], below[-1]
+
+    x = math.log2(nodes)
+    x0, x1 = math.log2(low['nodes']), math.log2(high['nodes'])
+    y0 = math.log(max(evaluate(low, size_bytes), 1e-9))
+    y1 = math.log(max(evaluate(high, size_bytes), 1e-9))
+    return math.exp(y0 + (y1 - y0) * (x - x0) / (x1 - x0))
+
+
+def cmd_fit(args):
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("No input files found")
+        sys.exit(1)
+    sweeps = collect_sweeps(files, args.metric)
+    if not sweeps:
+        print("No NCCL performance data with collective and node count found")
+        sys.exit(1)
+    models = fit_models(sweeps, args.gpus_per_node, args.max_segments)
+
+    with open(args.output, 'w') as f:
+        json.dump({'metric': args.metric, 'models': models}, f, indent=2)
+
+    for model in models:
+        print(f"{model['collective']} on {model['nodes']} nodes "
+              f"({model['runs']} runs, rms relative error {model['rms_relative_error']:.3f}):")
+        for segment in model['segments']:
+            bandwidth = segment['bandwidth_GBps']
+            bandwidth = f"{bandwidth:.2f} GB/s" if bandwidth is not None else "n/a"
+            print(f"  {format_size(segment['min_size']):>6} - {format_size(segment['max_size']):<6} "
+                  f"alpha {segment['alpha_us']:9.2f} us  bandwidth {bandwidth}")
+    print(f"Model written to: {args.output}")
+
+
+def cmd_predict(args):
+    with open(args.model) as f:
+        models = json.load(f)['models']
+    try:
+        for size in args.size:
+            size_bytes = parse_size(size)
+            time_us = predict(models, args.collective, size_bytes, args.nodes)
+            algbw = size_bytes / time_us / 1e3
+            print(f"{args.collective} {format_size(size_bytes)} on {args.nodes} nodes: "
+                  f"{time_us:.1f} us (algbw {algbw:.2f} GB/s)")
+    except KeyError as e:
+        print(f"Error: {e.args[0]}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fit and query piecewise alpha-beta models of NCCL collectives",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fit_parser = subparsers.add_parser("fit", help="Fit models from nccl-tests output")
+    fit_parser.add_argument("inputs", nargs="+", help="NCCL output files, directories or globs")
+    fit_parser.add_argument("--output", default="nccl_model.json",
+                            help="Model JSON file to write (default: nccl_model.json)")
+    fit_parser.add_argument("--metric", choices=["oop", "ip"], default="oop",
+                            help="Out-of-place or in-place time (default: oop)")
+    fit_parser.add_argument("--gpus-per-node", type=int, default=8,
+                            help="GPUs (ranks) per node used in the sweeps (default: 8)")
+    fit_parser.add_argument("--max-segments", type=int, default=4,
+                            help="Maximum number of alpha-beta segments per curve (default: 4)")
+    fit_parser.set_defaults(func=cmd_fit)
+
+    predict_parser = subparsers.add_parser("predict", help="Predict collective time from a model")
+    predict_parser.add_argument("--model", required=True, help="Model JSON written by fit")
+    predict_parser.add_argument("--collective", required=True, help="Collective, e.g. allreduce")
+    predict_parser.add_argument("--size", required=True, nargs="+", help="Message size(s), e.g. 256M")
+    predict_parser.add_argument("--nodes", required=True, type=int, help="Number of nodes")
+    predict_parser.set_defaults(func=cmd_predict)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,73 +4,141 @@
 """
 Complete NCCL to CSV Converter
 Parses NCCL output and creates CSV files with results and summary
+
+Single file mode (CSV):
+    python nccl_to_csv.py nccl-tests-container_3480.out
+
+Streaming ingestion mode (Parquet / Arrow IPC, requires pyarrow):
+    python nccl_to_csv.py logs/ --output nccl_results.parquet
+    python nccl_to_csv.py 'logs/nccl-tests-*.out' --output nccl_results.arrow --workers 32
 """
 
-import re
+import argparse
 import csv
+import glob
+import os
+import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+# Pattern to match NCCL performance lines (flexible for different test types)
+# Handles both allreduce/reducescatter format and allgather/alltoall format
+# Note: alltoall uses N/A for in-place errors, so we handle that case
+DATA_PATTERN = re.compile(
+    r'^\s*(\d+)\s+(\d+)\s+(float|double|int|half)\s+(sum|prod|max|min|none)\s+(-?\d+)'
+    r'\s+(\d+\.?\d*)\s+(\d+\.?\d*)\s+(\d+\.?\d*)\s+(\d+|N/A)'
+    r'\s+(\d+\.?\d*)\s+(\d+\.?\d*)\s+(\d+\.?\d*)\s+(\d+|N/A)'
+)
+
+# Pattern to match average bandwidth line
+AVG_PATTERN = re.compile(r'# Avg bus bandwidth\s*:\s*(\d+\.?\d*)')
+
+# Launcher prefixes added in front of every line, e.g. "0: " from
+# `srun --label` or "[1,0]<stdout>:" from Open MPI `--tag-output`.
+LAUNCHER_PREFIX = re.compile(r'^\s*(?:\d+:|\[\d+,\d+\]<std(?:out|err)>:)')
+
+# Run metadata echoed by the sbatch scripts in slurm/topology-aware-nccl-tests
+# and printed by nccl-tests itself.
+TEST_TYPE_PATTERN = re.compile(r'Running NCCL (\w+) test')
+TEST_BINARY_PATTERN = re.compile(r'\b(\w+)_perf\b')
+HOSTNAME_PATTERN = re.compile(r'hostname=([\w.-]+)')
+RANK_HOST_PATTERN = re.compile(r'#\s+Rank\s+\d+\s+Group\s+\d+\s+Pid\s+\d+\s+on\s+([\w.-]+)')
+JOB_ID_PATTERN = re.compile(r'_(\d+)\.(?:out|log|txt)$')
+NCCL_VERSION_PATTERN = re.compile(r'(?:\| NCCL:|NCCL version)\s+(\d[\w.+-]*)')
+OFI_VERSION_PATTERN = re.compile(r'(?:AWS-OFI-NCCL:|aws-ofi-nccl)\s+v?(\d[\w.+-]*)')
+
+# Map nccl-tests binary names onto the collective names used by the sbatch scripts
+BINARY_TO_COLLECTIVE = {
+    'all_reduce': 'allreduce',
+    'all_gather': 'allgather',
+    'reduce_scatter': 'reducescatter',
+    'alltoall': 'alltoall',
+    'gather': 'gather',
+    'reduce': 'reduce',
+    'scatter': 'scatter',
+    'broadcast': 'broadcast',
+    'hypercube': 'hypercube',
+    'sendrecv': 'sendrecv',
+}
+
+RESULT_COLUMNS = [
+    'Size_Bytes', 'Size_KB', 'Size_MB', 'Count', 'Data_Type', 'Operation', 'Root',
+    'OOP_Time_us', 'OOP_AlgBW_GBps', 'OOP_BusBW_GBps', 'OOP_Errors',
+    'IP_Time_us', 'IP_AlgBW_GBps', 'IP_BusBW_GBps', 'IP_Errors',
+]
+RUN_COLUMNS = [
+    'File', 'Job_ID', 'Collective', 'Nodes', 'NCCL_Version', 'OFI_NCCL_Version', 'Avg_BusBW_GBps',
+]
+
+# Number of rows buffered before a record batch is flushed to the columnar output
+INGEST_BATCH_ROWS = 65536
+
+
+def strip_launcher_prefix(line):
+    """Remove srun/mpirun output labels so the data columns start the line"""
+    match = LAUNCHER_PREFIX.match(line)
+    if match:
+        return line[match.end():]
+    return line
+
+
+def parse_data_line(line):
+    """Parse a single nccl-tests result row, or return None for any other line
+
+    Non-data lines are rejected on their first character before the regex runs,
+    which keeps scanning large logs cheap.
+    """
+    stripped = strip_launcher_prefix(line).strip()
+    if not stripped or not stripped[0].isdigit():
+        return None
+
+    match = DATA_PATTERN.match(stripped)
+    if not match:
+        return None
+
+    size_bytes = int(match.group(1))
+    return {
+        'Size_Bytes': size_bytes,
+        'Size_KB': round(size_bytes / 1024, 2),
+        'Size_MB': round(size_bytes / (1024 * 1024), 2),
+        'Count': int(match.group(2)),
+        'Data_Type': match.group(3),
+        'Operation': match.group(4),
+        'Root': int(match.group(5)),
+        # Out-of-place metrics
+        'OOP_Time_us': float(match.group(6)),
+        'OOP_AlgBW_GBps': float(match.group(7)),
+        'OOP_BusBW_GBps': float(match.group(8)),
+        'OOP_Errors': 0 if match.group(9) == 'N/A' else int(match.group(9)),
+        # In-place metrics
+        'IP_Time_us': float(match.group(10)),
+        'IP_AlgBW_GBps': float(match.group(11)),
+        'IP_BusBW_GBps': float(match.group(12)),
+        'IP_Errors': 0 if match.group(13) == 'N/A' else int(match.group(13)),
+    }
+
+
 def parse_nccl_output(file_path):
     """Parse NCCL test output and extract performance data"""
     
     data = []
     avg_bandwidth = None
     
-    # Pattern to match NCCL performance lines (flexible for different test types)
-    # Handles both allreduce/reducescatter format and allgather/alltoall format
-    # Note: alltoall uses N/A for in-place errors, so we handle that case
-    pattern = r'^\s*(\d+)\s+(\d+)\s+(float|double|int|half)\s+(sum|prod|max|min|none)\s+(-?\d+)\s+(\d+\.?\d*)\s+(\d+\.?\d*)\s+(\d+\.?\d*)\s+(\d+|N/A)\s+(\d+\.?\d*)\s+(\d+\.?\d*)\s+(\d+\.?\d*)\s+(\d+|N/A)'
-    
-    # Pattern to match average bandwidth line
-    avg_pattern = r'# Avg bus bandwidth\s*:\s*(\d+\.?\d*)'
-    
     try:
-        with open(file_path, 'r') as f:
-            for line_num, line in enumerate(f, 1):
+        with open(file_path, 'r', errors='replace') as f:
+            for line in f:
                 # Check for performance data
-                match = re.match(pattern, line.strip())
-                if match:
-                    size_bytes = int(match.group(1))
-                    count = int(match.group(2))
-                    data_type = match.group(3)
-                    operation = match.group(4)
-                    root = int(match.group(5))
-                    
-                    # Out-of-place metrics
-                    oop_time_us = float(match.group(6))
-                    oop_algbw = float(match.group(7))
-                    oop_busbw = float(match.group(8))
-                    oop_error = 0 if match.group(9) == 'N/A' else int(match.group(9))
-                    
-                    # In-place metrics  
-                    ip_time_us = float(match.group(10))
-                    ip_algbw = float(match.group(11))
-                    ip_busbw = float(match.group(12))
-                    ip_error = 0 if match.group(13) == 'N/A' else int(match.group(13))
-                    
-                    data.append({
-                        'Size_Bytes': size_bytes,
-                        'Size_KB': round(size_bytes / 1024, 2),
-                        'Size_MB': round(size_bytes / (1024 * 1024), 2),
-                        'Count': count,
-                        'Data_Type': data_type,
-                        'Operation': operation,
-                        'Root': root,
-                        'OOP_Time_us': oop_time_us,
-                        'OOP_AlgBW_GBps': oop_algbw,
-                        'OOP_BusBW_GBps': oop_busbw,
-                        'OOP_Errors': oop_error,
-                        'IP_Time_us': ip_time_us,
-                        'IP_AlgBW_GBps': ip_algbw,
-                        'IP_BusBW_GBps': ip_busbw,
-                        'IP_Errors': ip_error
-                    })
+                row = parse_data_line(line)
+                if row is not None:
+                    data.append(row)
+                    continue
                 
                 # Check for average bandwidth
-                avg_match = re.search(avg_pattern, line)
-                if avg_match:
-                    avg_bandwidth = float(avg_match.group(1))
+                if 'Avg bus bandwidth' in line:
+                    avg_match = AVG_PATTERN.search(line)
+                    if avg_match:
+                        avg_bandwidth = float(avg_match.group(1))
     
     except FileNotFoundError:
         print(f"Error: File {file_path} not found")
@@ -85,6 +153,203 @@ def parse_nccl_output(file_path):
         
     return data, avg_bandwidth
 
+
+def parse_nccl_run(file_path):
+    """Parse one NCCL test output file into result rows plus run metadata
+
+    Returns a tuple (rows, metadata) where metadata holds the collective,
+    node count and sorted host names, Slurm job id, NCCL / aws-ofi-nccl
+    versions and reported average bus bandwidth. Unreadable files return an
+    empty row list instead of raising so that one bad log does not abort a
+    bulk ingestion.
+    """
+    rows = []
+    hosts = set()
+    metadata = {
+        'File': str(file_path),
+        'Job_ID': None,
+        'Collective': None,
+        'Nodes': None,
+        'NCCL_Version': None,
+        'OFI_NCCL_Version': None,
+        'Avg_BusBW_GBps': None,
+        'Hosts': [],
+    }
+
+    job_match = JOB_ID_PATTERN.search(os.path.basename(str(file_path)))
+    if job_match:
+        metadata['Job_ID'] = job_match.group(1)
+
+    try:
+        with open(file_path, 'r', errors='replace') as f:
+            for line in f:
+                row = parse_data_line(line)
+                if row is not None:
+                    rows.append(row)
+                    continue
+
+                if 'hostname=' in line:
+                    host_match = HOSTNAME_PATTERN.search(line)
+                    if host_match:
+                        hosts.add(host_match.group(1))
+                    _parse_versions(line, metadata)
+                elif 'Rank' in line:
+                    host_match = RANK_HOST_PATTERN.search(line)
+                    if host_match:
+                        hosts.add(host_match.group(1))
+                elif 'Avg bus bandwidth' in line:
+                    avg_match = AVG_PATTERN.search(line)
+                    if avg_match:
+                        metadata['Avg_BusBW_GBps'] = float(avg_match.group(1))
+                elif 'NCCL version' in line or 'aws-ofi-nccl' in line:
+                    _parse_versions(line, metadata)
+                elif metadata['Collective'] is None:
+                    if 'Running NCCL' in line:
+                        type_match = TEST_TYPE_PATTERN.search(line)
+                        if type_match:
+                            metadata['Collective'] = type_match.group(1)
+                    elif '_perf' in line:
+                        binary_match = TEST_BINARY_PATTERN.search(line)
+                        if binary_match and binary_match.group(1) in BINARY_TO_COLLECTIVE:
+                            metadata['Collective'] = BINARY_TO_COLLECTIVE[binary_match.group(1)]
+    except OSError as e:
+        print(f"Error reading file {file_path}: {e}", file=sys.stderr)
+        return [], metadata
+
+    if hosts:
+        metadata['Nodes'] = len(hosts)
+        metadata['Hosts'] = sorted(hosts)
+
+    return rows, metadata
+
+
+def _parse_versions(line, metadata):
+    """Record the first NCCL / aws-ofi-nccl version seen in a log line"""
+    if metadata['NCCL_Version'] is None:
+        version_match = NCCL_VERSION_PATTERN.search(line)
+        if version_match:
+            metadata['NCCL_Version'] = version_match.group(1)
+    if metadata['OFI_NCCL_Version'] is None:
+        version_match = OFI_VERSION_PATTERN.search(line)
+        if version_match:
+            metadata['OFI_NCCL_Version'] = version_match.group(1)
+
+
+def _parse_nccl_run_columns(file_path):
+    """Process pool worker: parse one file and return it column-oriented"""
+    rows, metadata = parse_nccl_run(file_path)
+    columns = {name: [row[name] for row in rows] for name in RESULT_COLUMNS}
+    for name in RUN_COLUMNS:
+        columns[name] = [metadata[name]] * len(rows)
+    return len(rows), columns
+
+
+def expand_inputs(inputs):
+    """Expand directories and glob patterns into a sorted list of files"""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, names in os.walk(item):
+                files.extend(os.path.join(root, name) for name in names
+                             if name.endswith(('.out', '.log', '.txt')))
+        elif glob.has_magic(item):
+            files.extend(path for path in glob.glob(item, recursive=True)
+                         if os.path.isfile(path))
+        elif os.path.isfile(item):
+            files.append(item)
+        else:
+            print(f"Warning: {item} not found, skipping", file=sys.stderr)
+    return sorted(set(files))
+
+
+def _arrow_schema(pa):
+    return pa.schema([
+        ('Size_Bytes', pa.int64()),
+        ('Size_KB', pa.float64()),
+        ('Size_MB', pa.float64()),
+        ('Count', pa.int64()),
+        ('Data_Type', pa.string()),
+        ('Operation', pa.string()),
+        ('Root', pa.int32()),
+        ('OOP_Time_us', pa.float64()),
+        ('OOP_AlgBW_GBps', pa.float64()),
+        ('OOP_BusBW_GBps', pa.float64()),
+        ('OOP_Errors', pa.int64()),
+        ('IP_Time_us', pa.float64()),
+        ('IP_AlgBW_GBps', pa.float64()),
+        ('IP_BusBW_GBps', pa.float64()),
+        ('IP_Errors', pa.int64()),
+        ('File', pa.string()),
+        ('Job_ID', pa.string()),
+        ('Collective', pa.string()),
+        ('Nodes', pa.int32()),
+        ('NCCL_Version', pa.string()),
+        ('OFI_NCCL_Version', pa.string()),
+        ('Avg_BusBW_GBps', pa.float64()),
+    ])
+
+
+def ingest_nccl_outputs(files, output, workers=None, batch_rows=INGEST_BATCH_ROWS):
+    """Parse many NCCL test outputs in parallel into one columnar file
+
+    Files are parsed on a process pool and results are streamed to a Parquet
+    (.parquet) or Arrow IPC (.arrow/.feather) writer in record batches of at
+    most batch_rows rows, so memory stays flat regardless of archive size.
+    Returns (files_with_data, total_rows).
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        print("Error: streaming ingestion requires pyarrow (pip install pyarrow)")
+        return None, None
+
+    schema = _arrow_schema(pa)
+    if str(output).endswith('.parquet'):
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(output, schema, compression='zstd')
+        write_batch = writer.write_table
+    else:
+        import pyarrow.ipc as ipc
+        sink = pa.OSFile(str(output), 'wb')
+        writer = ipc.new_file(sink, schema)
+        write_batch = writer.write_table
+
+    pending = {name: [] for name in schema.names}
+    pending_rows = 0
+    total_rows = 0
+    files_with_data = 0
+
+    def flush():
+        nonlocal pending, pending_rows
+        if pending_rows:
+            write_batch(pa.Table.from_pydict(pending, schema=schema))
+            pending = {name: [] for name in schema.names}
+            pending_rows = 0
+
+    workers = workers or os.cpu_count()
+    chunksize = max(1, min(64, len(files) // (workers * 4) or 1))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for num_rows, columns in executor.map(_parse_nccl_run_columns, files,
+                                                  chunksize=chunksize):
+                if not num_rows:
+                    continue
+                files_with_data += 1
+                total_rows += num_rows
+                pending_rows += num_rows
+                for name, values in columns.items():
+                    pending[name].extend(values)
+                if pending_rows >= batch_rows:
+                    flush()
+        flush()
+    finally:
+        writer.close()
+        if not str(output).endswith('.parquet'):
+            sink.close()
+
+    return files_with_data, total_rows
+
+
 def write_csv(data, filename):
     """Write data to CSV file"""
     
@@ -127,13 +392,8 @@ def create_summary_data(data, avg_bandwidth=None):
     
     return summary_data
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python nccl_to_excel.py <nccl_output_file>")
-        print("Example: python nccl_to_excel.py nccl-tests-container_3480.out")
-        sys.exit(1)
-    
-    input_file = sys.argv[1]
+def convert_single_file(input_file):
+    """Convert one NCCL output file into results and summary CSV files"""
     base_name = Path(input_file).stem
     
     print(f"Parsing NCCL output from: {input_file}")
@@ -170,5 +430,48 @@ def main():
     print(f"- {summary_file} (summary statistics)")
     print("\nYou can open these CSV files in Excel, LibreOffice Calc, or any spreadsheet application")
 
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert NCCL test output to CSV, or ingest many outputs into Parquet/Arrow",
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        help="NCCL output file, or directories / glob patterns when --output is set",
+    )
+    parser.add_argument(
+        "--output",
+        help="Columnar output file (.parquet or .arrow) enabling streaming ingestion mode",
+        default=None,
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of parser processes for ingestion (default: CPU count)",
+        type=int,
+        default=None,
+    )
+    args = parser.parse_args()
+
+    if args.output is None:
+        if len(args.inputs) != 1 or not os.path.isfile(args.inputs[0]):
+            print("Usage: python nccl_to_csv.py <nccl_output_file>")
+            print("       python nccl_to_csv.py <dir|glob> [...] --output results.parquet")
+            print("Example: python nccl_to_csv.py nccl-tests-container_3480.out")
+            sys.exit(1)
+        convert_single_file(args.inputs[0])
+        return
+
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("No input files found")
+        sys.exit(1)
+
+    print(f"Ingesting {len(files)} NCCL output files into: {args.output}")
+    files_with_data, total_rows = ingest_nccl_outputs(files, args.output, args.workers)
+    if files_with_data is None:
+        sys.exit(1)
+    print(f"Wrote {total_rows} rows from {files_with_data} files "
+          f"({len(files) - files_with_data} files had no performance data)")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
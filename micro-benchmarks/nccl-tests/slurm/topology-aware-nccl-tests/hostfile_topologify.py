@@ -7,119 +7,549 @@
 # `/opt/slurm/bin/scontrol show hostname $SLURM_NODELIST`, and sort it
 # so that adjoining ranks are as close as possible in the network
 # topology.  Default is to print to stdout, although an output file
-# can be specified.
+# can be specified.  A SLURM_HOSTFILE rank map for
+# `srun --distribution=arbitrary` can be written as well.
+#
+# With --select N the input is treated as a list of idle nodes (e.g.
+# `sinfo -N -h -t idle -o %N`) and the output is a comma separated
+# `sbatch --nodelist` of the N nodes that span the fewest switches.
+#
+# Hostnames are resolved concurrently, EC2 lookups run as parallel
+# batches with adaptive client-side retries, and the instance topology
+# is cached on disk (keyed by instance id, with a TTL) so repeat runs
+# on the same cluster only look up which instance holds each ip and do
+# not call DescribeInstanceTopology again.
 
 import boto3
 import argparse
+import json
+import os
 import sys
 import socket
 import time
-from collections import defaultdict
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
 
 # To avoid overwhelming the EC2 APIs with large requests, process only
 # pagination_count entries through the search loops at a time.
 pagination_count = 64
 max_retries = 5
 
+# Concurrency for hostname resolution and for EC2 API batches.  EC2
+# calls use botocore's adaptive retry mode, which backs off client-side
+# when the API starts throttling.
+dns_workers = 64
+api_workers = 4
+api_max_attempts = 10
+
+# Topology cache defaults.  Entries older than cache_ttl seconds are
+# ignored and refreshed from the EC2 APIs.
+default_cache_file = os.path.join(
+    os.path.expanduser("~"), ".cache", "hostfile_topologify", "topology-%s.json")
+default_cache_ttl = 24 * 3600
+cache_format_version = 1
+
+
+def resolve_hostname(hostname):
+    # translate hostname to private ip, since PCluster uses custom
+    # hostnames that the EC2 control plane doesn't see.  Retry with
+    # exponential backoff to ride out transient resolver errors.
+    delay = 0.25
+    for _ in range(max_retries):
+        try:
+            return socket.gethostbyname(socket.getfqdn(hostname))
+        except Exception as e:
+            print("Error getting ip address for %s: %s" % (hostname, e))
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+    return None
+
+
+def resolve_hostnames(hostnames, workers=None):
+    """Resolve all hostnames concurrently, exiting if any cannot be resolved."""
+    if not hostnames:
+        return {}
+
+    workers = min(workers or dns_workers, len(hostnames))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        ips = list(executor.map(resolve_hostname, hostnames))
+
+    hostname_to_ip = {}
+    for hostname, ip in zip(hostnames, ips):
+        if ip is None:
+            print("Error getting ip address for %s" % (hostname))
+            sys.exit(1)
+        hostname_to_ip[hostname] = ip
+    return hostname_to_ip
+
+
+def describe_instance_ids(ec2_client, ips):
+    """Return {instance_id: private_ip} for the instances currently holding a batch of ips."""
+    ip_set = set(ips)
+    instanceid_to_ip = {}
+
+    # build instanceid -> ip map by describing all the ips and
+    # matching ip to instance id.
+    #
+    # The network-interface.addresses filter happens *after*
+    # pagination, so we need to properly handle pagination here.
+    pagination_done = False
+    next_token = ""
+    while not pagination_done:
+        response = ec2_client.describe_instances(
+            Filters=[
+                {
+                    'Name': 'network-interface.addresses.private-ip-address',
+                    'Values': list(ips)
+                }
+            ],
+            MaxResults=pagination_count,
+            NextToken=next_token)
+
+        if 'NextToken' in response:
+            next_token = response['NextToken']
+        else:
+            pagination_done = True
+
+        for reservation in response['Reservations']:
+            for instance in reservation['Instances']:
+                instanceid = instance['InstanceId']
+                for network_interface in instance['NetworkInterfaces']:
+                    private_ip = network_interface['PrivateIpAddress']
+                    if private_ip in ip_set:
+                        instanceid_to_ip[instanceid] = private_ip
+
+    return instanceid_to_ip
+
+
+def describe_topology(ec2_client, instanceid_to_ip):
+    """Return {instance_id: (private_ip, network_nodes)} for a batch of instances."""
+    if not instanceid_to_ip:
+        return {}
+
+    topology = {}
+    pagination_done = False
+    next_token = ""
+    while not pagination_done:
+        response = ec2_client.describe_instance_topology(
+            InstanceIds=list(instanceid_to_ip.keys()),
+            NextToken=next_token)
+
+        if 'NextToken' in response:
+            next_token = response['NextToken']
+        else:
+            pagination_done = True
+
+        for instance in response['Instances']:
+            instanceid = instance['InstanceId']
+            if instanceid in instanceid_to_ip:
+                topology[instanceid] = (instanceid_to_ip[instanceid],
+                                        list(instance['NetworkNodes']))
+
+    return topology
+
+
+def load_topology_cache(cache_file, ttl):
+    """Return {instance_id: entry} for cache entries younger than ttl seconds."""
+    if cache_file is None or not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError) as e:
+        print("Ignoring unreadable topology cache %s: %s" % (cache_file, e))
+        return {}
+    if cache.get("version") != cache_format_version:
+        return {}
+
+    now = time.time()
+    return {
+        instanceid: entry
+        for instanceid, entry in cache.get("instances", {}).items()
+        if now - entry.get("timestamp", 0) < ttl
+    }
+
+
+def save_topology_cache(cache_file, entries):
+    """Atomically write the topology cache."""
+    if cache_file is None:
+        return
+    try:
+        cache_dir = os.path.dirname(os.path.abspath(cache_file))
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+        with open(tmp_file, "w") as f:
+            json.dump({"version": cache_format_version, "instances": entries}, f)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print("Unable to write topology cache %s: %s" % (cache_file, e))
+
+
+def resolve_topology(hostnames, region, cache_file=None, cache_ttl=default_cache_ttl):
+    """Map each hostname to its EC2 NetworkNodes list, in input order.
+
+    Hosts whose instance topology is not available (for example an
+    unsupported instance type) are left out of the result.
+    """
+    hostname_to_ip = resolve_hostnames(hostnames)
+    if not hostname_to_ip:
+        return {}
+
+    ec2_client = boto3.client(
+        'ec2', region,
+        config=Config(retries={'mode': 'adaptive', 'max_attempts': api_max_attempts}))
+
+    # The instance behind an ip is always looked up, since a replaced
+    # instance can reuse the ip of the old one; only the topology itself
+    # is served from the cache.
+    ips = list(dict.fromkeys(hostname_to_ip.values()))
+    batches = [ips[i:i + pagination_count] for i in range(0, len(ips), pagination_count)]
+    with ThreadPoolExecutor(max_workers=min(api_workers, len(batches))) as executor:
+        instance_batches = list(executor.map(lambda batch: describe_instance_ids(ec2_client, batch), batches))
+
+    cached = load_topology_cache(cache_file, cache_ttl)
+    ip_to_network_nodes = {}
+    missing = {}
+    for instanceid_to_ip in instance_batches:
+        for instanceid, ip in instanceid_to_ip.items():
+            entry = cached.get(instanceid)
+            if entry is not None and entry["ip"] == ip:
+                ip_to_network_nodes[ip] = entry["network_nodes"]
+            else:
+                missing[instanceid] = ip
+
+    if missing:
+        instanceids = list(missing)
+        batches = [{instanceid: missing[instanceid] for instanceid in instanceids[i:i + pagination_count]}
+                   for i in range(0, len(instanceids), pagination_count)]
+        with ThreadPoolExecutor(max_workers=min(api_workers, len(batches))) as executor:
+            results = list(executor.map(lambda batch: describe_topology(ec2_client, batch), batches))
+
+        now = time.time()
+        for topology in results:
+            for instanceid, (ip, network_nodes) in topology.items():
+                ip_to_network_nodes[ip] = network_nodes
+                cached[instanceid] = {
+                    "ip": ip,
+                    "network_nodes": network_nodes,
+                    "timestamp": now,
+                }
+        save_topology_cache(cache_file, cached)
+
+    return {
+        hostname: ip_to_network_nodes[ip]
+        for hostname, ip in hostname_to_ip.items()
+        if ip in ip_to_network_nodes
+    }
+
+
+def read_hostnames(input_file):
+    hostnames = []
+    for line in input_file:
+        hostname = line.strip()
+        if hostname:
+            hostnames.append(hostname)
+    return list(dict.fromkeys(hostnames))
+
+
+def build_topology_tree(host_topology):
+    """Build a nested {network_node: {...: [hostnames]}} tree.
+
+    host_topology maps hostname -> NetworkNodes list (spine first, leaf
+    switch last), as returned by describe_instance_topology.  Siblings
+    keep the order in which they are first seen.
+    """
+    tree = {}
+    for hostname, network_nodes in host_topology.items():
+        node = tree
+        for network_node in network_nodes[:-1]:
+            node = node.setdefault(network_node, {})
+        node.setdefault(network_nodes[-1], []).append(hostname)
+    return tree
+
+
+def flatten_topology_tree(tree):
+    """Depth-first traversal of a topology tree, returning hostnames."""
+    if isinstance(tree, list):
+        return list(tree)
+    order = []
+    for child in tree.values():
+        order.extend(flatten_topology_tree(child))
+    return order
+
+
+def _subtree_size(tree):
+    if isinstance(tree, list):
+        return len(tree)
+    return sum(_subtree_size(child) for child in tree.values())
+
+
+def edge_distance(network_nodes_a, network_nodes_b):
+    """Number of switch levels two hosts must climb to reach each other.
+
+    0 means the hosts share a leaf switch, len(NetworkNodes) means the
+    path crosses the top (spine) layer.
+    """
+    levels = max(len(network_nodes_a), len(network_nodes_b))
+    for level, (a, b) in enumerate(zip(network_nodes_a, network_nodes_b)):
+        if a != b:
+            return levels - level
+    return 0
+
+
+def nccl_tree_edges(nranks):
+    """Return the (child, parent) rank pairs of NCCL's inter-node double binary tree."""
+    def btree_parent(rank):
+        bit = 1
+        while bit < nranks and not (bit & rank):
+            bit <<= 1
+        parent = (rank ^ bit) | (bit << 1)
+        if parent >= nranks:
+            parent = rank ^ bit
+        return parent
+
+    edges = [(rank, btree_parent(rank)) for rank in range(1, nranks)]
+    # The second tree is the first one mirrored (even nranks) or
+    # shifted by one (odd nranks), see ncclGetDtree().
+    if nranks % 2:
+        remap = [(rank - 1) % nranks for rank in range(nranks)]
+    else:
+        remap = [nranks - 1 - rank for rank in range(nranks)]
+    edges += [(remap[child], remap[parent]) for child, parent in edges[:nranks - 1]]
+    return edges
+
+
+def ordering_cost(order, host_topology):
+    """Estimate the network cost of a rank order for ring and tree collectives.
 
-def generate_topology_csv(input_file, output_file, region):
-    ec2_client = boto3.client('ec2', region)
+    Returns a dict with the summed edge_distance over ring neighbours
+    (including the wrap-around edge) and over NCCL double binary tree
+    edges, plus the number of those edges that cross the spine layer.
+    """
+    n = len(order)
+    cost = {'ring_cost': 0, 'tree_cost': 0, 'ring_cross_spine': 0, 'tree_cross_spine': 0}
+    if n < 2:
+        return cost
 
-    done = False
+    paths = [host_topology[hostname] for hostname in order]
+    spine_distance = max(len(path) for path in paths)
 
-    network_to_hostname = defaultdict(lambda: defaultdict(list))
+    for i in range(n):
+        distance = edge_distance(paths[i], paths[(i + 1) % n])
+        cost['ring_cost'] += distance
+        cost['ring_cross_spine'] += distance == spine_distance
 
-    while not done:
-        hostname_to_ip = {}
-        ip_to_hostname = {}
-        instanceid_to_hostname = {}
+    for child, parent in nccl_tree_edges(n):
+        distance = edge_distance(paths[child], paths[parent])
+        cost['tree_cost'] += distance
+        cost['tree_cross_spine'] += distance == spine_distance
 
-        # translate hostname to private ip, since PCluster uses custom
-        # hostnames that the EC2 control plane doesn't see.
-        for _ in range(pagination_count):
-            hostname = input_file.readline()
-            if not hostname:
-                done = True
-                break
-            hostname = hostname.strip()
+    return cost
 
-            ip = None
-            for _ in range(max_retries):
-                try:
-                    ip = socket.gethostbyname(socket.getfqdn(hostname))
-                except Exception as e:
-                    print("Error getting ip address for %s: %s" % (hostname, e))
-                    time.sleep(1)
+
+def _total_cost(order, host_topology, tree_weight):
+    cost = ordering_cost(order, host_topology)
+    return cost['ring_cost'] + tree_weight * cost['tree_cost']
+
+
+def optimize_topology_tree(tree, host_topology, tree_weight=1.0, max_passes=10):
+    """Reorder sibling switch groups to minimise cross-switch hops.
+
+    Any depth-first order keeps every switch subtree contiguous, which is
+    already optimal for rings.  The order of sibling subtrees still
+    decides how many NCCL tree edges cross switches, so siblings are
+    first sorted by size (largest first, so big groups start on
+    power-of-two rank boundaries) and then improved by adjacent swaps
+    while the combined ring + tree cost decreases.
+    """
+    def sort_by_size(node):
+        if isinstance(node, list):
+            return node
+        children = sorted(node.items(), key=lambda item: -_subtree_size(item[1]))
+        return {name: sort_by_size(child) for name, child in children}
+
+    tree = sort_by_size(tree)
+
+    def internal_nodes(node):
+        if isinstance(node, list):
+            return []
+        nodes = [node]
+        for child in node.values():
+            nodes.extend(internal_nodes(child))
+        return nodes
+
+    best = _total_cost(flatten_topology_tree(tree), host_topology, tree_weight)
+    for _ in range(max_passes):
+        improved = False
+        for node in internal_nodes(tree):
+            keys = list(node)
+            for i in range(len(keys) - 1):
+                swapped = keys[:i] + [keys[i + 1], keys[i]] + keys[i + 2:]
+                children = {key: node[key] for key in swapped}
+                node.clear()
+                node.update(children)
+                cost = _total_cost(flatten_topology_tree(tree), host_topology, tree_weight)
+                if cost < best:
+                    best = cost
+                    keys = swapped
+                    improved = True
                 else:
-                    break
+                    children = {key: node[key] for key in keys}
+                    node.clear()
+                    node.update(children)
+        if not improved:
+            break
+    return tree
+
+
+def order_hosts(host_topology, optimize=False, tree_weight=1.0):
+    """Return hostnames ordered so adjoining ranks are close in the network.
+
+    Pure function over a {hostname: NetworkNodes} dict.  Hosts are
+    grouped by every topology level (spine, then intermediate, then leaf
+    switch).  With optimize=True the order of sibling groups is also
+    tuned for NCCL ring and tree collectives.
+    """
+    tree = build_topology_tree(host_topology)
+    if optimize:
+        tree = optimize_topology_tree(tree, host_topology, tree_weight)
+    return flatten_topology_tree(tree)
+
+
+def print_cost_summary(before, after, host_topology, file=sys.stderr):
+    cost_before = ordering_cost(before, host_topology)
+    cost_after = ordering_cost(after, host_topology)
+    print("Topology cost estimate for %d hosts (before -> after):" % len(after), file=file)
+    print("  ring cross-switch hops: %d -> %d, cross-spine edges: %d -> %d" % (
+        cost_before['ring_cost'], cost_after['ring_cost'],
+        cost_before['ring_cross_spine'], cost_after['ring_cross_spine']), file=file)
+    print("  tree cross-switch hops: %d -> %d, cross-spine edges: %d -> %d" % (
+        cost_before['tree_cost'], cost_after['tree_cost'],
+        cost_before['tree_cross_spine'], cost_after['tree_cross_spine']), file=file)
+
 
-            if ip is None:
-                print("Error getting ip address for %s" % (hostname))
-                sys.exit(1)
+def write_rank_map(order, rank_map_file, tasks_per_node):
+    """Write a SLURM_HOSTFILE for `srun --distribution=arbitrary`.
 
-            hostname_to_ip[hostname] = ip
-            ip_to_hostname[ip] = hostname
+    Each hostname is repeated once per task, so rank r runs on line r.
+    """
+    for hostname in order:
+        for _ in range(tasks_per_node):
+            rank_map_file.write("%s\n" % (hostname))
 
-        if len(ip_to_hostname.keys()) == 0:
+
+def generate_topology_csv(input_file, output_file, region,
+                          cache_file=None, cache_ttl=default_cache_ttl,
+                          optimize=False, show_cost=False):
+    hostnames = read_hostnames(input_file)
+    host_topology = resolve_topology(hostnames, region, cache_file, cache_ttl)
+
+    order = order_hosts(host_topology, optimize=optimize)
+    for hostname in order:
+        output_file.write("%s\n" % (hostname))
+
+    if show_cost and order:
+        before = [hostname for hostname in hostnames if hostname in host_topology]
+        print_cost_summary(before, order, host_topology)
+
+    return order
+
+
+def _select_from_subtree(tree, count):
+    """Pick count hosts from a topology subtree spanning the fewest switches.
+
+    Returns (hosts, switches) where switches is the number of switches
+    below this subtree's root that the selection touches.
+    """
+    if isinstance(tree, list):
+        return tree[:count], 0
+
+    sizes = {name: _subtree_size(child) for name, child in tree.items()}
+
+    # Best fit: among the single subtrees that hold all requested hosts,
+    # use the one whose selection spans the fewest switches, then the
+    # smallest one so larger subtrees stay free for bigger jobs.
+    fitting = [name for name in tree if sizes[name] >= count]
+    if fitting:
+        options = []
+        for name in fitting:
+            hosts, switches = _select_from_subtree(tree[name], count)
+            options.append((switches, sizes[name], hosts))
+        switches, _, hosts = min(options, key=lambda option: option[:2])
+        return hosts, switches + 1
+
+    # Otherwise take whole subtrees, largest first, which minimises the
+    # number of subtrees used, and best-fit the remainder into the
+    # smallest subtree that can still hold it.
+    selected = []
+    total_switches = 0
+    remaining = count
+    candidates = sorted(tree, key=lambda name: -sizes[name])
+    while remaining > 0:
+        fitting = [name for name in candidates if sizes[name] >= remaining]
+        if fitting:
+            hosts, switches = _select_from_subtree(tree, remaining)
+            selected.extend(hosts)
+            total_switches += switches
             break
+        name = candidates.pop(0)
+        selected.extend(flatten_topology_tree(tree[name]))
+        total_switches += 1 + _subtree_switches(tree[name])
+        tree = {key: child for key, child in tree.items() if key != name}
+        remaining -= sizes[name]
+    return selected, total_switches
 
-        # build instanceid -> hostname map by describing all the ips
-        # and matching ip to instance id, then translating through
-        # hostname_to_ip.
-        #
-        # The network-interface.addresses filter happens *after*
-        # pagination, so we need to properly handle pagination here.
-        pagination_done = False
-        next_token = ""
-        while not pagination_done:
-            response = ec2_client.describe_instances(
-                Filters=[
-                    {
-                        'Name': 'network-interface.addresses.private-ip-address',
-                        'Values': list(ip_to_hostname.keys())
-                    }
-                ],
-                MaxResults=pagination_count,
-                NextToken=next_token)
-
-            if 'NextToken' in response:
-                next_token = response['NextToken']
-            else:
-                pagination_done = True
-
-            for reservation in response['Reservations']:
-                for instance in reservation['Instances']:
-                    instanceid = instance['InstanceId']
-                    for network_interface in instance['NetworkInterfaces']:
-                        private_ip = network_interface['PrivateIpAddress']
-                        if private_ip in ip_to_hostname:
-                            instanceid_to_hostname[instanceid] = ip_to_hostname[private_ip]
-
-        pagination_done = False
-        next_token = ""
-        while not pagination_done:
-            response = ec2_client.describe_instance_topology(
-                InstanceIds=list(instanceid_to_hostname.keys()),
-                NextToken=next_token)
-
-            if 'NextToken' in response:
-                next_token = response['NextToken']
-            else:
-                pagination_done = True
 
-            for instance in response['Instances']:
-                instanceid = instance['InstanceId']
+def _subtree_switches(tree):
+    if isinstance(tree, list):
+        return 0
+    return sum(1 + _subtree_switches(child) for child in tree.values())
+
 
-                t2_node = instance['NetworkNodes'][1]
-                t1_node = instance['NetworkNodes'][2]
+def select_nodes(host_topology, count, optimize=False):
+    """Choose count hosts that share the fewest spine/T2/T1 switch subtrees.
 
-                network_to_hostname[t2_node][t1_node].append(
-                    instanceid_to_hostname[instanceid])
+    Pure function over a {hostname: NetworkNodes} dict of idle hosts.
+    Returns the selected hostnames in topology order, or raises
+    ValueError when fewer than count hosts are available.
+    """
+    if count > len(host_topology):
+        raise ValueError("requested %d nodes but only %d idle nodes with topology information"
+                         % (count, len(host_topology)))
+    if count <= 0:
+        return []
 
-    for t2 in network_to_hostname:
-        for t1 in network_to_hostname[t2]:
-            for hostname in network_to_hostname[t2][t1]:
-                output_file.write("%s\n" % (hostname))
+    hosts, _ = _select_from_subtree(build_topology_tree(host_topology), count)
+    selected = set(hosts)
+    return order_hosts({hostname: network_nodes
+                        for hostname, network_nodes in host_topology.items()
+                        if hostname in selected}, optimize=optimize)
+
+
+def count_switches(hosts, host_topology):
+    """Return the number of distinct switches spanned at each topology level."""
+    levels = max((len(host_topology[hostname]) for hostname in hosts), default=0)
+    return [len({tuple(host_topology[hostname][:level + 1]) for hostname in hosts})
+            for level in range(levels)]
+
+
+def generate_nodelist(input_file, output_file, region, count,
+                      cache_file=None, cache_ttl=default_cache_ttl, optimize=False):
+    """Write a comma separated --nodelist of count topologically close idle hosts."""
+    hostnames = read_hostnames(input_file)
+    host_topology = resolve_topology(hostnames, region, cache_file, cache_ttl)
+
+    try:
+        selected = select_nodes(host_topology, count, optimize=optimize)
+    except ValueError as e:
+        print("Error: %s" % (e))
+        sys.exit(1)
+
+    output_file.write("%s\n" % (",".join(selected)))
+    print("Selected %d of %d idle nodes spanning %s switches per level (spine first)" % (
+        len(selected), len(host_topology), count_switches(selected, host_topology)),
+        file=sys.stderr)
+    return selected
 
 
 if __name__ == "__main__":
@@ -142,15 +572,70 @@ if __name__ == "__main__":
         help="AWS region (default: us-east-1)",
         default="us-east-1"
     )
+    parser.add_argument(
+        "--cache-file",
+        help="Topology cache file (default: ~/.cache/hostfile_topologify/topology-<region>.json)",
+        default=None
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        help="Seconds before cached topology entries are refreshed (default: %d)" % default_cache_ttl,
+        type=int,
+        default=default_cache_ttl
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="Do not read or write the topology cache",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--optimize",
+        help="Also reorder sibling switch groups to minimise ring and tree cross-switch hops",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--rank-map",
+        help="Also write a SLURM_HOSTFILE rank map for srun --distribution=arbitrary",
+        default=None
+    )
+    parser.add_argument(
+        "--tasks-per-node",
+        help="Ranks per host in the rank map (default: 8)",
+        type=int,
+        default=8
+    )
+    parser.add_argument(
+        "--select",
+        help="Treat the input as idle nodes and write a --nodelist of this many "
+             "nodes spanning the fewest switches",
+        type=int,
+        default=None
+    )
 
     args = parser.parse_args()
 
+    if args.no_cache:
+        cache_file = None
+    else:
+        cache_file = args.cache_file or default_cache_file % args.region
+
+    def run(input_file_handle, output_file_handle):
+        if args.select is not None:
+            return generate_nodelist(input_file_handle, output_file_handle, args.region,
+                                     args.select, cache_file, args.cache_ttl, args.optimize)
+        return generate_topology_csv(input_file_handle, output_file_handle, args.region,
+                                     cache_file, args.cache_ttl, args.optimize, True)
+
     if args.output is not None:
         with (
             open(args.output, "w") as output_file_handle,
             open(args.input, "r") as input_file_handle,
         ):
-            generate_topology_csv(input_file_handle, output_file_handle, args.region)
+            order = run(input_file_handle, output_file_handle)
     else:
         with open(args.input, "r") as input_file_handle:
-            generate_topology_csv(input_file_handle, sys.stdout, args.region)
+            order = run(input_file_handle, sys.stdout)
+
+    if args.rank_map is not None:
+        with open(args.rank_map, "w") as rank_map_handle:
+            write_rank_map(order, rank_map_handle, args.tasks_per_node)
@@ -8,6 +8,8 @@ import tempfile
 import os
 import sys
 import importlib.util
+import json
+import socket
 import time
 from unittest.mock import Mock, patch, MagicMock
 from io import StringIO
@@ -401,6 +403,294 @@ class TestHostfileTopologify:
             os.unlink(input_file_path)
 
 
+    @patch('time.sleep')
+    def test_topology_cache_skips_ec2_on_repeat_run(self, mock_sleep, mock_ec2_responses, tmp_path):
+        """Test that a second run is served from the on-disk topology cache"""
+
+        cache_file = str(tmp_path / "topology.json")
+        hostname_to_ip_map = {
+            'host-1': '10.0.1.1',
+            'host-2': '10.0.1.2',
+            'host-3': '10.0.1.3',
+            'host-4': '10.0.1.4'
+        }
+
+        mock_ec2_client = Mock()
+        mock_ec2_client.describe_instances.return_value = mock_ec2_responses['describe_instances']
+        mock_ec2_client.describe_instance_topology.return_value = mock_ec2_responses['describe_topology']
+
+        outputs = []
+        with patch('socket.gethostbyname', side_effect=hostname_to_ip_map.get), \
+             patch('socket.getfqdn', side_effect=lambda x: x), \
+             patch('boto3.client', return_value=mock_ec2_client):
+            for _ in range(2):
+                output_buffer = StringIO()
+                hostfile_topologify.generate_topology_csv(
+                    StringIO("host-1\nhost-2\nhost-3\nhost-4\n"),
+                    output_buffer,
+                    'us-west-2',
+                    cache_file=cache_file
+                )
+                outputs.append(output_buffer.getvalue().split())
+
+        # Instance ids are resolved on every run, the topology only on the first
+        assert mock_ec2_client.describe_instances.call_count == 2
+        assert mock_ec2_client.describe_instance_topology.call_count == 1
+        assert outputs[0] == ['host-1', 'host-2', 'host-3', 'host-4']
+        assert outputs[1] == outputs[0]
+
+        with open(cache_file) as f:
+            cache = json.load(f)
+        assert set(cache['instances']) == {'i-1example', 'i-2example', 'i-3example', 'i-4example'}
+        assert cache['instances']['i-3example']['network_nodes'] == ['nn-1example', 'nn-2example', 'nn-5example']
+
+    @patch('time.sleep')
+    def test_topology_cache_expired_entries_are_refreshed(self, mock_sleep, mock_ec2_responses, tmp_path):
+        """Test that cache entries older than the TTL are looked up again"""
+
+        cache_file = str(tmp_path / "topology.json")
+        stale = time.time() - 7200
+        with open(cache_file, 'w') as f:
+            json.dump({
+                'version': hostfile_topologify.cache_format_version,
+                'instances': {
+                    'i-1example': {
+                        'ip': '10.0.1.1',
+                        'network_nodes': ['nn-9example', 'nn-9example', 'nn-9example'],
+                        'timestamp': stale
+                    }
+                }
+            }, f)
+
+        mock_ec2_client = Mock()
+        mock_ec2_client.describe_instances.return_value = mock_ec2_responses['describe_instances']
+        mock_ec2_client.describe_instance_topology.return_value = mock_ec2_responses['describe_topology']
+
+        output_buffer = StringIO()
+        with patch('socket.gethostbyname', side_effect=lambda h: {'host-1': '10.0.1.1'}[h]), \
+             patch('socket.getfqdn', side_effect=lambda x: x), \
+             patch('boto3.client', return_value=mock_ec2_client):
+            hostfile_topologify.generate_topology_csv(
+                StringIO("host-1\n"),
+                output_buffer,
+                'us-west-2',
+                cache_file=cache_file,
+                cache_ttl=3600
+            )
+
+        mock_ec2_client.describe_instances.assert_called_once()
+        assert output_buffer.getvalue().split() == ['host-1']
+        with open(cache_file) as f:
+            cache = json.load(f)
+        assert cache['instances']['i-1example']['network_nodes'] == ['nn-1example', 'nn-2example', 'nn-4example']
+        assert cache['instances']['i-1example']['timestamp'] > stale
+
+    @patch('time.sleep')
+    def test_topology_cache_misses_replaced_instance_with_same_ip(self, mock_sleep, mock_ec2_responses, tmp_path):
+        """Test that a cached ip now held by another instance is looked up again"""
+
+        cache_file = str(tmp_path / "topology.json")
+        with open(cache_file, 'w') as f:
+            json.dump({
+                'version': hostfile_topologify.cache_format_version,
+                'instances': {
+                    'i-0replaced': {
+                        'ip': '10.0.1.1',
+                        'network_nodes': ['nn-9example', 'nn-9example', 'nn-9example'],
+                        'timestamp': time.time()
+                    }
+                }
+            }, f)
+
+        mock_ec2_client = Mock()
+        mock_ec2_client.describe_instances.return_value = mock_ec2_responses['describe_instances']
+        mock_ec2_client.describe_instance_topology.return_value = mock_ec2_responses['describe_topology']
+
+        with patch('socket.gethostbyname', side_effect=lambda h: {'host-1': '10.0.1.1'}[h]), \
+             patch('socket.getfqdn', side_effect=lambda x: x), \
+             patch('boto3.client', return_value=mock_ec2_client):
+            topology = hostfile_topologify.resolve_topology(['host-1'], 'us-west-2', cache_file=cache_file)
+
+        mock_ec2_client.describe_instance_topology.assert_called_once()
+        assert topology == {'host-1': ['nn-1example', 'nn-2example', 'nn-4example']}
+        with open(cache_file) as f:
+            cache = json.load(f)
+        assert cache['instances']['i-1example']['ip'] == '10.0.1.1'
+
+    @patch('time.sleep')
+    def test_hostname_resolution_retries(self, mock_sleep):
+        """Test that transient DNS failures are retried with backoff during concurrent resolution"""
+
+        attempts = {}
+
+        def flaky_gethostbyname(hostname):
+            attempts[hostname] = attempts.get(hostname, 0) + 1
+            if hostname == 'host-2' and attempts[hostname] < 3:
+                raise socket.gaierror("temporary failure")
+            return {'host-1': '10.0.1.1', 'host-2': '10.0.1.2'}[hostname]
+
+        with patch('socket.gethostbyname', side_effect=flaky_gethostbyname), \
+             patch('socket.getfqdn', side_effect=lambda x: x):
+            hostname_to_ip = hostfile_topologify.resolve_hostnames(['host-1', 'host-2'])
+
+        assert hostname_to_ip == {'host-1': '10.0.1.1', 'host-2': '10.0.1.2'}
+        assert attempts['host-2'] == 3
+        # Backoff doubles between attempts
+        assert [c.args[0] for c in mock_sleep.call_args_list] == [0.25, 0.5]
+
+        with patch('socket.gethostbyname', side_effect=socket.gaierror("no such host")), \
+             patch('socket.getfqdn', side_effect=lambda x: x), \
+             pytest.raises(SystemExit):
+            hostfile_topologify.resolve_hostnames(['host-3'])
+
+
+
+class TestTopologyOrdering:
+    """Test cases for the pure topology ordering functions"""
+
+    @pytest.fixture
+    def two_spine_topology(self):
+        """8 hosts spread over 2 spines, 4 intermediate and 4 leaf switches, interleaved in input order"""
+        return {
+            'host-1': ['spine-a', 't2-a1', 't1-a1'],
+            'host-2': ['spine-b', 't2-b1', 't1-b1'],
+            'host-3': ['spine-a', 't2-a2', 't1-a2'],
+            'host-4': ['spine-b', 't2-b2', 't1-b2'],
+            'host-5': ['spine-a', 't2-a1', 't1-a1'],
+            'host-6': ['spine-b', 't2-b1', 't1-b1'],
+            'host-7': ['spine-a', 't2-a2', 't1-a2'],
+            'host-8': ['spine-b', 't2-b2', 't1-b2'],
+        }
+
+    def test_edge_distance(self):
+        """Test the number of switch levels crossed between two hosts"""
+        assert hostfile_topologify.edge_distance(['s', 'a', 'x'], ['s', 'a', 'x']) == 0
+        assert hostfile_topologify.edge_distance(['s', 'a', 'x'], ['s', 'a', 'y']) == 1
+        assert hostfile_topologify.edge_distance(['s', 'a', 'x'], ['s', 'b', 'y']) == 2
+        assert hostfile_topologify.edge_distance(['s', 'a', 'x'], ['t', 'b', 'y']) == 3
+
+    def test_nccl_tree_edges(self):
+        """Test that both NCCL binary trees span every rank"""
+        for nranks in (2, 3, 8, 13):
+            edges = hostfile_topologify.nccl_tree_edges(nranks)
+            assert len(edges) == 2 * (nranks - 1)
+            for tree in (edges[:nranks - 1], edges[nranks - 1:]):
+                assert {rank for edge in tree for rank in edge} == set(range(nranks))
+        assert hostfile_topologify.nccl_tree_edges(4)[:3] == [(1, 2), (2, 0), (3, 2)]
+
+    def test_hosts_grouped_by_spine(self, two_spine_topology):
+        """Test that hosts are grouped by spine, then intermediate, then leaf switch"""
+        order = hostfile_topologify.order_hosts(two_spine_topology)
+        assert order == ['host-1', 'host-5', 'host-3', 'host-7',
+                         'host-2', 'host-6', 'host-4', 'host-8']
+
+        before = hostfile_topologify.ordering_cost(list(two_spine_topology), two_spine_topology)
+        after = hostfile_topologify.ordering_cost(order, two_spine_topology)
+        # Interleaved input crosses the spine on every ring edge, grouped
+        # order only when entering and leaving each spine.
+        assert before['ring_cross_spine'] == 8
+        assert after['ring_cross_spine'] == 2
+        assert after['ring_cost'] < before['ring_cost']
+        assert after['tree_cross_spine'] < before['tree_cross_spine']
+
+    def test_optimize_never_increases_cost(self, two_spine_topology, mock_random_topology):
+        """Test that the optimized order keeps groups contiguous and does not cost more"""
+        for topology in (two_spine_topology, mock_random_topology):
+            grouped = hostfile_topologify.order_hosts(topology)
+            optimized = hostfile_topologify.order_hosts(topology, optimize=True)
+            assert sorted(optimized) == sorted(topology)
+
+            grouped_cost = hostfile_topologify.ordering_cost(grouped, topology)
+            optimized_cost = hostfile_topologify.ordering_cost(optimized, topology)
+            assert (optimized_cost['ring_cost'] + optimized_cost['tree_cost']
+                    <= grouped_cost['ring_cost'] + grouped_cost['tree_cost'])
+            # Every spine is still entered and left exactly once on the ring
+            assert optimized_cost['ring_cross_spine'] == grouped_cost['ring_cross_spine']
+
+    def test_optimize_improves_tree_placement(self):
+        """Test that sibling groups are reordered when that removes tree hops"""
+        topology = {
+            'host-1': ['spine', 't2', 't1-a'],
+            'host-2': ['spine', 't2', 't1-a'],
+            'host-3': ['spine', 't2', 't1-b'],
+            'host-4': ['spine', 't2', 't1-c'],
+        }
+        grouped = hostfile_topologify.order_hosts(topology)
+        optimized = hostfile_topologify.order_hosts(topology, optimize=True)
+        grouped_cost = hostfile_topologify.ordering_cost(grouped, topology)
+        optimized_cost = hostfile_topologify.ordering_cost(optimized, topology)
+        assert optimized_cost['tree_cost'] < grouped_cost['tree_cost']
+        assert optimized_cost['ring_cost'] == grouped_cost['ring_cost']
+
+    def test_write_rank_map(self):
+        """Test that the rank map repeats each host once per task"""
+        rank_map = StringIO()
+        hostfile_topologify.write_rank_map(['host-2', 'host-1'], rank_map, 2)
+        assert rank_map.getvalue().split() == ['host-2', 'host-2', 'host-1', 'host-1']
+
+    def test_select_nodes_prefers_single_switch(self):
+        """Test that selection picks the subtree that needs the fewest switches, not just the smallest spine"""
+        topology = {}
+        # spine-a: 40 hosts spread over 4 T2 switches of 10
+        for i in range(40):
+            topology[f'a-{i}'] = ['spine-a', f't2-a{i // 10}', f't1-a{i // 10}']
+        # spine-b: 64 hosts under a single T2 / T1 switch
+        for i in range(64):
+            topology[f'b-{i}'] = ['spine-b', 't2-b0', 't1-b0']
+
+        selected = hostfile_topologify.select_nodes(topology, 32)
+        assert len(selected) == 32
+        assert all(hostname.startswith('b-') for hostname in selected)
+        assert hostfile_topologify.count_switches(selected, topology) == [1, 1, 1]
+
+    def test_select_nodes_best_fit(self):
+        """Test that the smallest leaf switch that fits is used so larger ones stay free"""
+        topology = {}
+        for leaf, size in (('big', 16), ('small', 9), ('tiny', 4)):
+            for i in range(size):
+                topology[f'{leaf}-{i}'] = ['spine', 't2', f't1-{leaf}']
+
+        selected = hostfile_topologify.select_nodes(topology, 8)
+        assert all(hostname.startswith('small-') for hostname in selected)
+
+        # 20 nodes need two leaf switches: all of 'big' plus 4 more from 'tiny'
+        selected = hostfile_topologify.select_nodes(topology, 20)
+        assert sorted(hostfile_topologify.count_switches(selected, topology)) == [1, 1, 2]
+        assert sum(hostname.startswith('big-') for hostname in selected) == 16
+        assert sum(hostname.startswith('tiny-') for hostname in selected) == 4
+
+    def test_select_nodes_not_enough_idle(self, two_spine_topology):
+        """Test that asking for more nodes than are idle is an error"""
+        with pytest.raises(ValueError):
+            hostfile_topologify.select_nodes(two_spine_topology, 9)
+
+    def test_generate_nodelist(self, two_spine_topology):
+        """Test that the nodelist is written comma separated for sbatch --nodelist"""
+        output_buffer = StringIO()
+        with patch.object(hostfile_topologify, 'resolve_topology', return_value=two_spine_topology):
+            selected = hostfile_topologify.generate_nodelist(
+                StringIO("\n".join(two_spine_topology) + "\n"),
+                output_buffer,
+                'us-west-2',
+                4
+            )
+        assert output_buffer.getvalue().strip() == ",".join(selected)
+        assert hostfile_topologify.count_switches(selected, two_spine_topology)[0] == 1
+
+    @pytest.fixture
+    def mock_random_topology(self):
+        """64 hosts randomly spread over 2 spines x 3 intermediate x 4 leaf switches"""
+        import random
+        rng = random.Random(0)
+        topology = {}
+        for i in range(64):
+            spine = rng.randrange(2)
+            t2 = rng.randrange(3)
+            t1 = rng.randrange(4)
+            topology[f'host-{i}'] = [f'spine-{spine}', f't2-{spine}-{t2}', f't1-{spine}-{t2}-{t1}']
+        return topology
+
+
 
 
 if __name__ == "__main__":
@@ -5,3 +5,69 @@ import os
 def test_0_nccl_test(docker_build, docker_run):
     img = docker_build('nccl-test', 'nccl-tests.Dockerfile')
     #docker_run(img, ['python3', '-c', 'import torch'])
+
+
+MiB = 1024 ** 2
+
+
+def _history_run(conn, name, busbw):
+    from nccl_history import record_run
+    rows = [{'Size_Bytes': size, 'OOP_Time_us': 1.0, 'OOP_BusBW_GBps': value,
+             'IP_Time_us': 1.0, 'IP_BusBW_GBps': value} for size, value in busbw.items()]
+    metadata = {'File': name, 'Job_ID': None, 'Nodes': 2, 'Collective': 'allreduce',
+                'NCCL_Version': None, 'OFI_NCCL_Version': None, 'Avg_BusBW_GBps': None}
+    with conn:
+        return record_run(conn, rows, metadata, 'p5.48xlarge')
+
+
+def test_history_flags_drops_beyond_baseline_noise():
+    from nccl_history import compare_busbw
+    baselines = [{MiB: value, 64 * MiB: 300.0} for value in (100.0, 90.0, 110.0, 95.0, 105.0)]
+    # 6% below the median but within the baseline spread
+    report = compare_busbw({MiB: 94.0, 64 * MiB: 300.0}, baselines)
+    assert [entry['regression'] for entry in report] == [False, False]
+    report = compare_busbw({MiB: 70.0, 64 * MiB: 270.0}, baselines)
+    assert report[0]['robust_z'] < -3
+    # No spread in the baseline: the percentage threshold decides alone
+    assert report[1]['robust_z'] is None
+    assert [entry['regression'] for entry in report] == [True, True]
+    report = compare_busbw({MiB: 70.0, 64 * MiB: 270.0}, baselines, min_size=2 * MiB)
+    assert [entry['size'] for entry in report] == [64 * MiB]
+
+
+def test_history_compare_exit_code(tmp_path, monkeypatch):
+    import nccl_history
+    db = str(tmp_path / "history.db")
+    conn = nccl_history.open_db(db)
+    for i, value in enumerate((100.0, 98.0, 102.0)):
+        _history_run(conn, f"baseline_{i}.out", {MiB: value})
+    good = _history_run(conn, "good.out", {MiB: 99.0})
+    bad = _history_run(conn, "bad.out", {MiB: 80.0})
+    conn.close()
+    monkeypatch.chdir(tmp_path)
+
+    monkeypatch.setattr("sys.argv", ["nccl_history.py", "--db", db, "compare", str(good), "--last", "3"])
+    nccl_history.main()
+    monkeypatch.setattr("sys.argv", ["nccl_history.py", "--db", db, "compare", str(bad), "--last", "3"])
+    with pytest.raises(SystemExit) as exit_info:
+        nccl_history.main()
+    assert exit_info.value.code == 1
+
+
+def test_perf_model_recovers_protocol_breakpoint():
+    from nccl_perf_model import fit_piecewise, predict
+    sizes = [2 ** i for i in range(10, 31)]
+    # Latency bound below 1 MiB, bandwidth bound above: 5 us + 10 GB/s, then 50 us + 100 GB/s
+    times = [5.0 + size * 1e-4 if size < MiB else 50.0 + size * 1e-5 for size in sizes]
+    fit = fit_piecewise(sizes, times)
+    low, high = fit['segments']
+    assert (low['min_size'], low['max_size']) == (1024, MiB // 2)
+    assert (high['min_size'], high['max_size']) == (MiB, 2 ** 30)
+    assert low['alpha_us'] == pytest.approx(5.0)
+    assert low['bandwidth_GBps'] == pytest.approx(10.0)
+    assert high['alpha_us'] == pytest.approx(50.0)
+    assert high['bandwidth_GBps'] == pytest.approx(100.0)
+    assert fit['rms_relative_error'] < 1e-6
+
+    model = dict(fit, collective='allreduce', nodes=2, gpus_per_node=8)
+    assert predict([model], 'allreduce', 256 * MiB, 2) == pytest.approx(50.0 + 256 * MiB * 1e-5)